@@ -1,6 +1,6 @@
 
 import OpenGL.GL as GL              # standard Python OpenGL wrapper          
-from core import Mesh
+from core import Mesh, state
 from texture import Texture, Textured
 
 
@@ -15,7 +15,7 @@ class Grass_blade(Textured):
         mesh = Mesh(shader, attributes=dict(position=base_coords), texcoord =tex_coords)        
         texture = Texture(tex_path, GL.GL_REPEAT, *(GL.GL_NEAREST, GL.GL_NEAREST_MIPMAP_LINEAR))
         super().__init__(mesh, diffuse_map=texture)
-        GL.glEnable(GL.GL_CULL_FACE)
+        state.enable(GL.GL_CULL_FACE)
 
 class Grass_field():
     #use GPU instancing to create a field on grass, each grass is made by Grass_blade
@@ -53,14 +53,15 @@ class TransformKeyFrames:
 
 class KeyFrameControlNode(core.Node):
     """ Place core.Node with transform keys above a controlled subtree """
+    animated = True  # parents can't cull it with last frame's transform
+
     def __init__(self, trans_keys, rot_keys, scale_keys, transform=identity()):
         super().__init__(transform=transform)
         self.keyframes = TransformKeyFrames(trans_keys, rot_keys, scale_keys)
 
-    def draw(self, primitives=GL.GL_TRIANGLES, **uniforms):
+    def update(self):
         """ When redraw requested, interpolate our core.Node transform from keys """
-        self.transform = self.keyframes.value(glfw.get_time())
-        super().draw(primitives=primitives, **uniforms)
+        self.transform = self.keyframes.value(core.timer())
 
 
 # -------------- Linear Blend Skinning : TP7 ---------------------------------
@@ -1,6 +1,6 @@
 
 from lava import Lava                 
-from core import Node, Shader,load, timer
+from core import Node, shaders, load, timer
 from animation import KeyFrameControlNode
 from transform import quaternion_from_euler, translate, vec, quaternion
 import glfw
@@ -8,9 +8,9 @@ import glfw
 import random # 1/5 pas rocher mais lapins (chromatiques si possible)
 
 class RockTime(Node):
-    def __init__(self, shader, shader_chroma):
+    def __init__(self, shader, shader_chroma, seed=None):
         super().__init__()
-        random.seed()
+        random.seed(seed)
         self.obj_array = []
         self.obj_shader = shader
         res = random.randint(0, 5)
@@ -25,7 +25,7 @@ class RockTime(Node):
             obj = load(obj_filename, self.obj_shader)
             self.obj_array.append(obj[0])    
 
-        lavaShader = Shader("glsl/Lava.vert", "glsl/Lava.frag")
+        lavaShader = shaders.get("glsl/Lava.vert", "glsl/Lava.frag")
         self.lava_node = Node(transform=translate(-12,0,-20))
         self.lava_node.add(Lava(lavaShader, 90, 80, "texture/terrain_texture/noisemap.png", "texture/water/dudv.png", "texture/water/waternormalmap.png"))     
         
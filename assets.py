@@ -0,0 +1,104 @@
+"""
+Asset loader: image files are decoded (and converted to RGBA) on a thread
+pool, PIL releasing the GIL while it decodes, so the main thread goes on
+building the scene meanwhile. GL uploads need the GL thread: they are
+queued and run there by poll() (each frame) or finish() (before the first
+frame). Textures are created at once, with their GL name, and filled later;
+their 'loaded' future tells when.
+Without start(), files are decoded and uploaded right away, as before.
+"""
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from PIL import Image
+
+
+def decode_image(file):
+    """ RGBA pixels of an image file, as (width, height, bytes) """
+    with Image.open(file) as image:
+        image = image.convert('RGBA')
+        return image.width, image.height, image.tobytes()
+
+
+class AssetLoader:
+    """ Decodes images on worker threads, uploads them on the GL thread """
+    def __init__(self):
+        self.pool = None
+        self.queue = []         # (decode futures, upload, result future, files)
+        self.total = 0          # uploads queued since start()
+        self.done = 0
+        self.progress = None    # optional callback(done, total, files)
+
+    def start(self, workers=None, progress=None):
+        """ decode in parallel from now on """
+        self.pool = ThreadPoolExecutor(workers or min(8, os.cpu_count() or 1), 'assets')
+        self.progress = progress
+        self.total = self.done = 0
+
+    def load(self, files, upload):
+        """ decode files, then call upload(images) on the GL thread, images
+            being a list of decode_image() results in files order. Returns
+            the future of the upload result """
+        result = Future()
+        if self.pool is None:
+            self._upload([_decoded(file) for file in files], upload, result, files)
+        else:
+            self.queue.append(([self.pool.submit(decode_image, file) for file in files], upload, result, files))
+            self.total += 1
+        return result
+
+    def poll(self):
+        """ run the uploads of the already decoded files, from the GL thread """
+        if self.queue:
+            self._run([entry for entry in self.queue if all(future.done() for future in entry[0])])
+
+    def finish(self):
+        """ wait for all decodes and run all the uploads, from the GL thread,
+            then stop the worker threads: later loads are done right away """
+        while self.queue:
+            # upload whatever is ready first, then block on the oldest entry
+            ready = [entry for entry in self.queue if all(future.done() for future in entry[0])]
+            self._run(ready or self.queue[:1])
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def _run(self, entries):
+        for entry in entries:
+            self.queue.remove(entry)
+            futures, upload, result, files = entry
+            self._upload([_decoded(future) for future in futures], upload, result, files)
+            self.done += 1
+            if self.progress:
+                self.progress(self.done, self.total, files)
+
+    @staticmethod
+    def _upload(images, upload, result, files):
+        missing = [file for file, image in zip(files, images) if isinstance(image, FileNotFoundError)]
+        if missing:
+            print('ERROR: unable to load texture file %s' % missing[0])
+            result.set_exception(FileNotFoundError(missing[0]))
+        else:
+            try:
+                result.set_result(upload(images))
+            except Exception as error:  # pylint: disable=broad-except
+                print('ERROR: unable to upload %s: %s' % (files[0], error))
+                result.set_exception(error)
+
+
+def ready(value=None):
+    """ future already holding value, e.g. for textures made from memory """
+    future = Future()
+    future.set_result(value)
+    return future
+
+
+def _decoded(source):
+    """ decoded image of a file name or of a decode future, or the
+        FileNotFoundError raised trying """
+    try:
+        return source.result() if isinstance(source, Future) else decode_image(source)
+    except FileNotFoundError as error:
+        return error
+
+
+loader = AssetLoader()
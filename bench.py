@@ -0,0 +1,462 @@
+"""
+Deterministic benchmark of the viewer (python viewer.py --bench): hidden
+window, fixed time step, scripted camera orbit and eruption, then a JSON
+report of the time to first frame and of per pass timings, draw calls and
+triangles, compared to a baseline report if one is given. Only timings vary between runs.
+
+Run as a script (python bench.py [scenario ...]), it times scenarios of the
+loading and per frame code paths outside of the viewer instead, each
+against the code it replaced when that is kept below for reference.
+"""
+import json
+import os
+import sys
+from time import perf_counter
+import numpy as np
+import OpenGL.GL as GL              # standard Python OpenGL wrapper
+import glfw                         # lean window system wrapper for OpenGL
+from profiler import profiler
+from clock import clock
+from core import LAUNCH_TIME
+
+
+class Benchmark:
+    """ Drives Viewer.run: the simulation clock reads frame / fps as wall
+        time, so animations, day cycle, lava and particles see the same
+        times and steps on every run, and the first warmup frames are left
+        out of the stats """
+    def __init__(self, frames=600, fps=60, warmup=30, erupt_frame=120,
+                 baseline=None, output='bench.json', tolerance=0.1):
+        self.frames, self.fps, self.warmup = frames, fps, warmup
+        self.erupt_frame = erupt_frame      # counted from the first measured frame
+        self.baseline, self.output = baseline, output
+        self.tolerance = tolerance          # relative increase reported as a regression
+        self.frame = 0
+        self.first_frame = None             # seconds from launch to the first frame drawn
+        self.passes = {}                    # pass name -> list of per frame counters
+        self.regressions = []
+
+    @property
+    def running(self):
+        return self.frame < self.warmup + self.frames
+
+    def start(self, viewer):
+        clock.source = lambda: self.frame / self.fps
+
+    def camera_path(self, camera, t):
+        """ one orbit around the volcano over the measured frames """
+        angle = 2 * np.pi * t * self.fps / self.frames
+        camera.position = np.array((180 * np.cos(angle), 60.0, 180 * np.sin(angle)))
+        camera.yaw = camera.target_yaw = (angle + np.pi) % (2 * np.pi)   # toward the center
+        camera.pitch = camera.target_pitch = -np.arctan2(60.0, 180.0)
+        camera._update()
+
+    def before_frame(self, viewer):
+        if self.frame == self.warmup:
+            profiler.enable()   # statistics restart after the warm up frames
+        self.camera_path(viewer.camera, (self.frame - self.warmup) / self.fps)
+        if self.frame == self.warmup + self.erupt_frame:   # as if Enter was pressed
+            viewer.on_key(viewer.win, glfw.KEY_ENTER, 0, glfw.PRESS, 0)
+
+    def after_frame(self, viewer):
+        if self.frame == 0:
+            self.first_frame = perf_counter() - LAUNCH_TIME
+        if self.frame >= self.warmup:
+            for name, counters in viewer.pass_stats.items():
+                self.passes.setdefault(name, []).append(counters)
+        self.frame += 1
+
+    def finish(self, viewer):
+        """ write the report, compared to the baseline, and print a summary """
+        profiler.flush()
+        report = self.report(viewer)
+        baseline = {}
+        if self.baseline:
+            with open(self.baseline) as file:
+                baseline = json.load(file)
+            self.regressions = report['regressions'] = self.compare(baseline, report)
+        with open(self.output, 'w') as file:
+            json.dump(report, file, indent=1)
+
+        before = ' (baseline %.2f s)' % baseline['first_frame'] if baseline.get('first_frame') else ''
+        print('\nfirst frame drawn %.2f s after launch%s' % (report['first_frame'], before))
+        print('%d frames, %.2f ms per frame (p95 %.2f)' % (self.frames, report['frame']['cpu']['mean'], report['frame']['cpu']['p95']))
+        for name, entry in report['passes'].items():
+            print('%-12s cpu %6.2f  gpu %6.2f ms  %5d draws  %9d triangles' % (
+                name, entry['cpu']['mean'], entry.get('gpu', {}).get('mean', float('nan')), entry['draws'], entry['triangles']))
+        for regression in self.regressions:
+            print('REGRESSION', regression)
+        print('Benchmark report written to', self.output)
+
+    def report(self, viewer):
+        timings = {(row['scope'], row['clock']): {k: row[k] for k in ('mean', 'p95', 'max')} for row in profiler.stats()}
+        passes = {}
+        for name, frames in self.passes.items():
+            passes[name] = {key: float(np.mean([counters[key] for counters in frames])) for key in frames[0]}
+            passes[name].update({clock: timings[name, clock] for clock in ('cpu', 'gpu') if (name, clock) in timings})
+        return dict(frames=self.frames, fps=self.fps, erupt_frame=self.erupt_frame, first_frame=self.first_frame,
+                    size=list(glfw.get_window_size(viewer.win)),
+                    renderer=GL.glGetString(GL.GL_RENDERER).decode(),
+                    frame=dict(cpu=timings.get(('frame', 'cpu'))), passes=passes,
+                    scopes=profiler.stats())
+
+    def compare(self, baseline, report):
+        """ time to first frame, per pass timings and counts that grew by
+            more than tolerance """
+        regressions = []
+        before, new = baseline.get('first_frame'), report['first_frame']
+        if before and new > before * (1 + self.tolerance):
+            regressions.append('first frame: %.2f -> %.2f s (+%.0f%%)' % (before, new, 100 * (new / before - 1)))
+        for name, entry in report['passes'].items():
+            old = baseline.get('passes', {}).get(name, {})
+            values = [(key, entry[key], old.get(key)) for key in ('draws', 'triangles')]
+            values += [(clock, entry[clock]['mean'], old.get(clock, {}).get('mean'))
+                       for clock in ('cpu', 'gpu') if clock in entry]
+            for key, new, before in values:
+                if before and new > before * (1 + self.tolerance):
+                    regressions.append('%s %s: %.2f -> %.2f (+%.0f%%)' % (name, key, before, new, 100 * (new / before - 1)))
+        return regressions
+
+
+# ------------  scenarios: code paths timed outside the viewer ---------------
+HEIGHTMAP = 'texture/heightmapstests/Heightmap.png'
+SCENARIOS = {}      # name -> function printing its timings
+
+
+def scenario(function):
+    """ register a function as a scenario of python bench.py """
+    SCENARIOS[function.__name__] = function
+    return function
+
+
+def best_time(function, *args, repeat=3):
+    """ best wall time in ms of repeat calls to function(*args), and its result """
+    best = float('inf')
+    for _ in range(repeat):
+        start = perf_counter()
+        result = function(*args)
+        best = min(best, (perf_counter() - start) * 1e3)
+    return best, result
+
+
+def report(case, ms, reference=None):
+    """ one line of timing, with the speedup over a reference time """
+    speedup = '  (%.1fx)' % (reference / ms) if reference else ''
+    print('  %-64s %10.2f ms%s' % (case, ms, speedup))
+
+
+def loop_height_map(width, height, heightmap_file):
+    """ terrain.generate_height_map before vectorization: a Python loop per pixel """
+    from PIL import Image
+    heightmap = Image.open(heightmap_file).convert("L")
+    noise_map = np.zeros((height, width))
+    for z in range(min(heightmap.height, height)):
+        for x in range(min(heightmap.width, width)):
+            noise_map[z, x] = np.interp(heightmap.getpixel((z, x)), [0, 255], [-64, 64])
+    return noise_map
+
+
+@scenario
+def heightmap():
+    """ heightmap decode and height remapping, then resampling to 4k """
+    from terrain import generate_height_map
+    before, expected = best_time(loop_height_map, 513, 513, HEIGHTMAP, repeat=1)
+    after, heights = best_time(generate_height_map, 513, 513, HEIGHTMAP)
+    assert np.array_equal(heights, expected)
+    report('513x513, per pixel loop', before)
+    report('513x513, numpy', after, before)
+    report('257x257 resampled to 4097x4097', best_time(
+        generate_height_map, 4097, 4097, 'texture/heightmapstests/1203622053fullres.png', repeat=1)[0])
+
+
+@scenario
+def terrain_cache():
+    """ terrain mesh arrays built (cold start) or loaded from the cache (warm start) """
+    import tempfile
+    from terrain import generate_mesh_arrays, MIN_HEIGHT, MAX_HEIGHT
+    from terrain_cache import TerrainCache
+    with tempfile.TemporaryDirectory() as path:
+        cache = TerrainCache(path)
+        def cold():
+            cache.invalidate()
+            key = cache.key(HEIGHTMAP, 513, 513, MIN_HEIGHT, MAX_HEIGHT, False, None)
+            cache.store(key, generate_mesh_arrays(513, 513, HEIGHTMAP))
+        def warm():
+            return cache.load(cache.key(HEIGHTMAP, 513, 513, MIN_HEIGHT, MAX_HEIGHT, False, None))
+        def warm_read():   # as the upload to the GPU will
+            return sum(float(np.asarray(array).sum()) for array in warm().values())
+        before = best_time(cold, repeat=1)[0]
+        report('cold: build and store', before)
+        report('warm: load, memory-mapped', best_time(warm)[0], before)
+        report('warm: load and read every array', best_time(warm_read)[0], before)
+
+
+@scenario
+def height_queries():
+    """ terrain heights and normals under 1M random points, in one call """
+    from terrain import generate_height_map, generate_vertices
+    from heightfield import HeightField
+    vertices = generate_vertices(513, 513, generate_height_map(513, 513, HEIGHTMAP))
+    grid = vertices.reshape(513, 513, 3)
+    field = HeightField(grid[..., 1], origin=vertices[0, [0, 2]])
+    smooth = HeightField(grid[..., 1], origin=vertices[0, [0, 2]], gradients=True)
+    points = np.random.default_rng(0).uniform(-256, 256, (1_000_000, 2)).astype(np.float32)
+    loop = lambda: [field.height_at(x, z) for x, z in points[:10_000]]
+    before = best_time(loop, repeat=1)[0] * 100   # 10k points timed, scaled to 1M
+    report('heights, one call per point', before)
+    report('heights', best_time(field.height_at, points[:, 0], points[:, 1])[0], before)
+    report('heights and normals', best_time(field.sample_many, points)[0], before)
+    report('heights and normals, gradient grid', best_time(smooth.sample_many, points)[0], before)
+
+
+def add_at_normals(vertices, index):
+    """ transform.calc_normals before vectorization: apply_along_axis and np.add.at """
+    from transform import normalized
+    normals = np.zeros(vertices.shape, dtype=vertices.dtype)
+    a, b, c = vertices[index[::3]], vertices[index[1::3]], vertices[index[2::3]]
+    normal = np.apply_along_axis(normalized, axis=1, arr=np.cross(b - a, c - a))
+    np.add.at(normals, index[::3], normal)
+    np.add.at(normals, index[1::3], normal)
+    np.add.at(normals, index[2::3], normal)
+    return np.apply_along_axis(normalized, axis=1, arr=normals)
+
+
+@scenario
+def normals():
+    """ vertex normals of the 513x513 terrain grid, all or a deformed subset """
+    from terrain import generate_height_map, generate_vertices, generate_indices
+    from transform import calc_normals
+    vertices = generate_vertices(513, 513, generate_height_map(513, 513, HEIGHTMAP))
+    index = generate_indices(513, 513)
+    before, expected = best_time(add_at_normals, vertices, index, repeat=1)
+    report('apply_along_axis + add.at', before)
+    for weighting in ('uniform', 'area', 'angle'):
+        ms, result = best_time(calc_normals, vertices, index, weighting)
+        report('bincount, %s weights' % weighting, ms, before)
+        if weighting == 'uniform':
+            assert np.abs(result - expected).max() < 1e-5
+    subset = np.arange(100_000, 100_100)
+    report('bincount, 100 vertices subset', best_time(calc_normals, vertices, index, 'uniform', subset)[0], before)
+
+
+def loop_tangents(vertices, indices, texcoords):
+    """ terrain.generate_tangents before vectorization: one triangle at a
+        time, each vertex keeping the tangent of its last triangle """
+    tangents = np.zeros((len(vertices), 3))
+    tri_verts = vertices[indices].reshape(-1, 3, 3)
+    tri_uvs = texcoords[indices].reshape(-1, 3, 2)
+    edge_1, edge_2 = tri_verts[:, 1] - tri_verts[:, 0], tri_verts[:, 2] - tri_verts[:, 0]
+    delta_uv1, delta_uv2 = tri_uvs[:, 1] - tri_uvs[:, 0], tri_uvs[:, 2] - tri_uvs[:, 0]
+    f = 1.0 / (delta_uv1[:, 0] * delta_uv2[:, 1] - delta_uv2[:, 0] * delta_uv1[:, 1])
+    for j, i in enumerate(range(0, len(indices), 3)):
+        i1, i2, i3 = indices[i], indices[i+1], indices[i+2]
+        tangents[i1] = f[j] * (delta_uv2[j, 1] * edge_1[j] - delta_uv1[j, 1] * edge_2[j])
+        tangents[i2] = tangents[i1]
+        tangents[i3] = tangents[i1]
+    return tangents
+
+
+@scenario
+def tangents():
+    """ vertex tangents of the 513x513 terrain grid """
+    from terrain import generate_height_map, generate_vertices, generate_indices, generate_texcoords, generate_tangents
+    from transform import calc_normals
+    vertices = generate_vertices(513, 513, generate_height_map(513, 513, HEIGHTMAP))
+    index = generate_indices(513, 513)
+    texcoords = generate_texcoords(513, 513)
+    normals = calc_normals(vertices, index)
+    before, expected = best_time(loop_tangents, vertices, index, texcoords, repeat=1)
+    after, (tangents, _) = best_time(generate_tangents, vertices, index, texcoords, normals)
+    report('per triangle loop', before)
+    report('vectorized, orthonormalized', after, before)
+    # the loop keeps one face per vertex: compare directions, which differ on cliffs only
+    expected /= np.linalg.norm(expected, axis=1, keepdims=True)
+    assert np.mean(np.sum(expected * tangents, axis=1)) > 0.95
+
+
+_window = None      # hidden window of the scenarios drawing with GL
+
+
+def gl_context(width=640, height=480):
+    """ make the GL 3.3 context of a hidden window current, created once """
+    global _window
+    import core     # glfw initialized, on its null platform when headless
+    if _window is None:
+        glfw.window_hint(glfw.CONTEXT_VERSION_MAJOR, 3)
+        glfw.window_hint(glfw.CONTEXT_VERSION_MINOR, 3)
+        glfw.window_hint(glfw.OPENGL_FORWARD_COMPAT, GL.GL_TRUE)
+        glfw.window_hint(glfw.OPENGL_PROFILE, glfw.OPENGL_CORE_PROFILE)
+        glfw.window_hint(glfw.VISIBLE, False)
+        if core.HEADLESS:
+            glfw.window_hint(glfw.CONTEXT_CREATION_API, glfw.EGL_CONTEXT_API)
+        _window = glfw.create_window(width, height, 'bench', None, None)
+        if not _window:
+            raise RuntimeError('this scenario needs an OpenGL 3.3 context')
+        glfw.make_context_current(_window)
+        core.state.reset()
+        core.state.viewport(0, 0, width, height)
+        core.state.enable(GL.GL_DEPTH_TEST)
+    return _window
+
+
+FLAT_VERTEX = """#version 330 core
+uniform mat4 model, view, projection;
+in vec3 position;
+void main() { gl_Position = projection * view * model * vec4(position, 1); }
+"""
+FLAT_FRAGMENT = """#version 330 core
+out vec4 out_color;
+void main() { out_color = vec4(1); }
+"""
+
+
+@scenario
+def culling():
+    """ render queue of 1000 boxes around the camera, with and without frustum culling """
+    from core import Shader, Mesh, Node, RenderQueue
+    from transform import translate, lookat, perspective
+    gl_context()
+    shader = Shader(FLAT_VERTEX, FLAT_FRAGMENT)
+    corners = np.array([(x, y, z) for x in (-1, 1) for y in (-1, 1) for z in (-1, 1)], np.float32)
+    box = np.array((0, 1, 3, 0, 3, 2, 4, 6, 7, 4, 7, 5, 0, 4, 5, 0, 5, 1,
+                    2, 3, 7, 2, 7, 6, 0, 2, 6, 0, 6, 4, 1, 5, 7, 1, 7, 3), np.uint32)
+    root = Node()
+    for position in np.random.default_rng(0).uniform(-200, 200, (1000, 3)):
+        root.add(Node([Mesh(shader, dict(position=corners), index=box)], transform=translate(*position)))
+    queue = RenderQueue(root)
+    camera = dict(view=lookat(np.zeros(3), np.array((0.0, 0.0, -1.0)), np.array((0.0, 1.0, 0.0))),
+                  projection=perspective(60, 640 / 480, 0.1, 500))
+
+    def draw(**uniforms):
+        Node.stats = dict(drawn=0, culled=0)
+        queue.draw(**camera, **uniforms)
+        GL.glFinish()
+        return dict(Node.stats)
+    before, stats = best_time(lambda: draw(frustum=np.zeros((0, 4))), repeat=10)   # every box passes
+    report('no culling, %(drawn)d drawn' % stats, before)
+    after, stats = best_time(draw, repeat=10)
+    report('frustum culling, %(drawn)d drawn, %(culled)d culled' % stats, after, before)
+
+
+# programs built by viewer.py and core.Viewer
+SCENE_PROGRAMS = [
+    ("glsl/texture.vert", "glsl/texture.frag"),
+    ("glsl/texture_terrain.vert", "glsl/texture_terrain.frag"),
+    ("glsl/normalviz.vert", "glsl/normalviz.frag", "glsl/normalviz.geom"),
+    ("glsl/lightcube.vert", "glsl/lightcube.frag"),
+    ("glsl/skybox.vert", "glsl/skybox.frag"),
+    ("glsl/water.vert", "glsl/water.frag"),
+    ("glsl/texture.vert", "glsl/texture_reflection.frag"),
+    ("glsl/cloud.vert", "glsl/cloud.frag"),
+    ("glsl/particle.vert", "glsl/particle.frag"),
+    ("glsl/Lava.vert", "glsl/Lava.frag"),
+    ("glsl/fboviz.vert", "glsl/fboviz.frag"),
+]
+
+
+@scenario
+def shaders():
+    """ build of the scene programs: no binary cache, cold cache, warm cache """
+    import tempfile
+    from core import ShaderRegistry
+    gl_context()
+    def build(registry):
+        for sources in SCENE_PROGRAMS:
+            registry.get(*sources)
+        GL.glFinish()
+        return registry.stats
+    with tempfile.TemporaryDirectory() as path:
+        before, stats = best_time(lambda: build(ShaderRegistry()), repeat=1)
+        report('no cache, %(compiled)d compiled' % stats, before)
+        cold, stats = best_time(lambda: build(ShaderRegistry(path)), repeat=1)
+        report('cold cache, %(compiled)d compiled and stored' % stats, cold, before)
+        warm, stats = best_time(lambda: build(ShaderRegistry(path)), repeat=1)
+        report('warm cache, %(from_binary)d from binaries' % stats, warm, before)
+
+
+@scenario
+def particles():
+    """ particle quads uploaded each frame: a new Mesh per frame or one DynamicMesh """
+    from core import Shader, Mesh, DynamicMesh, VertexArray
+    from particles import ParticlesEmitter
+    gl_context()
+    shader = Shader("glsl/particle.vert", "glsl/particle.frag")
+    quad = np.array((1, 0, 3, 1, 3, 2), np.uint32)
+    rng = np.random.default_rng(0)
+    for vertices in (10_000, 40_000, 100_000):
+        quads = vertices // 4
+        position = rng.random((vertices, 3), np.float32)
+        color = rng.random((vertices, 4), np.float32)
+
+        def recreate():     # what ParticlesEmitter.update did before
+            index = (quad + 4 * np.arange(quads, dtype=np.uint32)[:, None]).ravel()
+            Mesh(shader, dict(position=position, color=color), index=index).draw()
+            GL.glFinish()
+        mesh = DynamicMesh(shader, vertices, dict(position=3, color=4),
+                           index=(quad + 4 * np.arange(quads, dtype=np.uint32)[:, None]).ravel())
+
+        def stream():
+            mesh.update('position', position)
+            mesh.update('color', color)
+            mesh.count = 6 * quads
+            mesh.draw()
+            GL.glFinish()
+        VertexArray.allocations = dict(arrays=0, buffers=0)
+        before = best_time(recreate, repeat=10)[0]
+        per_frame = {key: count / 10 for key, count in VertexArray.allocations.items()}
+        report('%dk, new Mesh: %g VAO + %g VBO/frame'
+               % (vertices // 1000, per_frame['arrays'], per_frame['buffers']), before)
+        VertexArray.allocations = dict(arrays=0, buffers=0)
+        DynamicMesh.stats = dict(orphans=0, uploads=0, bytes=0)
+        after = best_time(stream, repeat=10)[0]
+        per_frame = {key: count / 10 for key, count in dict(VertexArray.allocations, **DynamicMesh.stats).items()}
+        report('%dk, DynamicMesh: %g VAO + %g VBO, %g orphaned + %g sub-data/frame'
+               % (vertices // 1000, per_frame['arrays'], per_frame['buffers'], per_frame['orphans'], per_frame['uploads']),
+               after, before)
+
+    emitter = ParticlesEmitter(shader, seed=0)
+    for _ in range(120):    # 2 s of eruption: the particle count levels off
+        emitter.update(1 / 60, np.zeros(3), True)
+    ms = best_time(lambda: emitter.update(1 / 60, np.zeros(3), True), repeat=20)[0]
+    report('emitter update, %d particles' % len(emitter.particles_instances), ms)
+
+
+SCENE_TEXTURES = [
+    'texture/terrain_texture/%s%s.png' % (name, suffix) for suffix in ('', '_normal')
+    for name in ('blackrock', 'meadow', 'ocean', 'sand', 'rock_snow')] + [
+    'texture/terrain_texture/noise_map.png', 'texture/terrain_texture/lava_map.png',
+    'texture/water/dudv.png', 'texture/water/waternormalmap.png',
+    'texture/textures_wood/pineleaf2.png', 'texture/textures_wood/leaves.png', 'texture/textures_wood/bark.jpg'] + [
+    os.path.join(sky, face) for sky in ('texture/skybox/skyboxday', 'texture/skybox/skyboxnight')
+    for face in sorted(os.listdir(sky))]      # as CubeMapTexture lists them
+
+
+@scenario
+def textures():
+    """ scene textures decoded before building the terrain, or meanwhile on the loader threads """
+    from assets import AssetLoader, decode_image
+    from terrain import generate_mesh_arrays
+    def serial():
+        images = [decode_image(file) for file in SCENE_TEXTURES]
+        generate_mesh_arrays(513, 513, HEIGHTMAP)
+        return len(images)
+    def overlapped():
+        loader = AssetLoader()
+        loader.start()
+        loaded = loader.load(SCENE_TEXTURES, len)
+        generate_mesh_arrays(513, 513, HEIGHTMAP)
+        loader.finish()
+        return loaded.result()
+    report('decode %d textures' % len(SCENE_TEXTURES), best_time(lambda: [decode_image(file) for file in SCENE_TEXTURES])[0])
+    report('513x513 terrain arrays', best_time(generate_mesh_arrays, 513, 513, HEIGHTMAP)[0])
+    before, count = best_time(serial)
+    after, loaded = best_time(overlapped)
+    assert loaded == count
+    report('both, one after the other', before)
+    report('both, decoded on the loader threads', after, before)
+
+
+if __name__ == '__main__':
+    for name in sys.argv[1:] or SCENARIOS:
+        print(name, '-', SCENARIOS[name].__doc__.strip())
+        SCENARIOS[name]()
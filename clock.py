@@ -0,0 +1,57 @@
+"""
+Simulation clock shared by every animated part of the scene. Once per frame,
+tick() reads the wall clock and advances the simulation by whole fixed steps
+(scaled, paused, and capped when the frame took too long), then keeps a
+snapshot of the render time, interpolated between the last step and the
+next one. Everything reads that snapshot, so a frame sees one time only,
+and replaying the same elapsed times replays the same simulation.
+"""
+import glfw                         # lean window system wrapper for OpenGL
+
+
+class SimClock:
+    """ Fixed step simulation time, with interpolated render time """
+    def __init__(self, step=1 / 60, max_steps=5, source=glfw.get_time):
+        self.step = step              # seconds of simulation per fixed step
+        self.max_steps = max_steps    # catch up cap: more lag than that is dropped
+        self.source = source          # wall clock, in seconds
+        self.scale = 1.0              # simulated seconds per wall clock second
+        self.paused = False
+        self.reset()
+
+    def reset(self, time=0.0):
+        """ restart the simulation at the given time """
+        self.sim_time = time          # time of the last fixed step
+        self.accumulator = 0.0        # scaled time not simulated yet, < step
+        self.time = time              # render time of the frame
+        self.delta = 0.0              # render time elapsed since the last frame
+        self.real_delta = 0.0         # unscaled wall time elapsed, e.g. for the camera
+        self.last = None
+
+    def tick(self):
+        """ new frame: returns the number of fixed steps to simulate """
+        now = self.source()
+        self.real_delta = 0.0 if self.last is None else now - self.last
+        self.last = now
+        if not self.paused:
+            self.accumulator += self.real_delta * self.scale
+        steps = int(self.accumulator / self.step + 1e-6)   # no step lost to rounding
+        if steps > self.max_steps:    # too far behind: drop the lag, slow down instead
+            steps, self.accumulator = self.max_steps, self.max_steps * self.step
+        self.accumulator = max(self.accumulator - steps * self.step, 0.0)
+        self.sim_time += steps * self.step
+
+        previous, self.time = self.time, self.sim_time + self.accumulator
+        self.delta = self.time - previous
+        return steps
+
+    @property
+    def alpha(self):
+        """ position of the render time between the last step and the next """
+        return self.accumulator / self.step
+
+    def toggle_pause(self):
+        self.paused = not self.paused
+
+
+clock = SimClock()
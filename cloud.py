@@ -14,6 +14,7 @@ from OpenGL.GLUT import *
 
 class Cloud(Textured):
     """ Simple first textured object """
+    render_state = dict(blend=True, cull=False)     # drawn from both sides
     
     
     def __init__(self, shader, map_width, map_height, noise_map):
@@ -2,6 +2,11 @@
 import os                           # os function, i.e. checking file status
 from itertools import cycle         # allows easy circular choice list
 import atexit                       # launch a function at exit
+import ctypes                       # offsets of interleaved vertex attributes
+import hashlib                      # shader source hashes
+import re                           # glsl includes and uniform block members
+import sys                          # platform of headless runs
+from time import perf_counter       # shader build and profiler timings
 
 # External, non built-in modules
 import OpenGL.GL as GL              # standard Python OpenGL wrapper
@@ -10,7 +15,7 @@ import numpy as np                  # all matrix manipulations & OpenGL args
 import assimpcy                     # 3D resource loader
 
 # our transform functions
-from transform import identity, vec, FlyoutCamera
+from transform import identity, vec, FlyoutCamera, calc_tangents, frustum_planes, aabb_in_frustum, transform_aabb
 from waterFrameBuffer import WaterFrameBuffers
 from shadowFrameBuffer import ShadowFrameBuffer
 from quad import Quad
@@ -22,8 +27,18 @@ import particles
 
 #text functions
 from renderText import RenderText
+from profiler import profiler
+from clock import clock
+from assets import loader
+
+LAUNCH_TIME = perf_counter()     # for the time to first frame
 
 # initialize and automatically terminate glfw on exit
+# without a display server (e.g. benchmarks on a GPU-less linux box), use
+# glfw's null platform (glfw >= 3.4) and EGL contexts, i.e. Mesa llvmpipe
+HEADLESS = sys.platform.startswith('linux') and not (os.environ.get('DISPLAY') or os.environ.get('WAYLAND_DISPLAY'))
+if HEADLESS and hasattr(glfw, 'PLATFORM_NULL'):
+    glfw.init_hint(glfw.PLATFORM, glfw.PLATFORM_NULL)
 glfw.init()
 atexit.register(glfw.terminate)
 
@@ -32,9 +47,34 @@ atexit.register(glfw.terminate)
 class Shader:
     """ Helper class to create and automatically destroy shader program """
     @staticmethod
-    def _compile_shader(src, shader_type):
+    def _read_source(src):
+        """ text of a source string or file, #include "file" lines replaced
+            by the file, relative to the including file """
+        folder = os.path.dirname(src) if os.path.exists(src) else ''
         src = open(src, 'r').read() if os.path.exists(src) else src
         src = src.decode('ascii') if isinstance(src, bytes) else src
+        lines = src.split('\n')
+        for number, line in reversed(list(enumerate(lines))):
+            match = Shader.INCLUDE.match(line)
+            if match:  # keep the line numbers of compile errors right
+                included = Shader._read_source(os.path.join(folder, match.group(1)))
+                lines[number:number + 1] = [included, '#line %d' % (number + 2)]
+        return '\n'.join(lines)
+
+    @staticmethod
+    def included_files(src):
+        """ files included by a source file, recursively """
+        if src is None or not os.path.exists(src):
+            return []
+        folder = os.path.dirname(src)
+        files = [os.path.join(folder, name) for name in Shader.INCLUDE.findall(open(src).read())]
+        return files + [sub for file in files for sub in Shader.included_files(file)]
+
+    INCLUDE = re.compile(r'^\s*#include\s+"([^"]+)"', re.MULTILINE)
+
+    @staticmethod
+    def _compile_shader(src, shader_type):
+        src = Shader._read_source(src)
         shader = GL.glCreateShader(shader_type)
         GL.glShaderSource(shader, src)
         GL.glCompileShader(shader)
@@ -45,56 +85,145 @@ class Shader:
             GL.glDeleteShader(shader)
             src = '\n'.join(src)
             print('Compile failed for %s\n%s\n%s' % (shader_type, log, src))
-            os._exit(1)
+            return None
         return shader
 
-    def __init__(self, vertex_source, fragment_source, geom_source=None, debug=False):
+    def __init__(self, vertex_source, fragment_source, geom_source=None, debug=False, binary_cache=None):
         """ Shader can be initialized with raw strings or source file names """
-        vert = self._compile_shader(vertex_source, GL.GL_VERTEX_SHADER)
-        frag = self._compile_shader(fragment_source, GL.GL_FRAGMENT_SHADER)
-        if (not geom_source is None):
-            geom = self._compile_shader(geom_source, GL.GL_GEOMETRY_SHADER)
-        if vert and frag:
-            self.glid = GL.glCreateProgram()  # pylint: disable=E1111
-            GL.glAttachShader(self.glid, vert)
-            GL.glAttachShader(self.glid, frag)
-            if (not geom_source is None):
-                GL.glAttachShader(self.glid, geom)
-            GL.glLinkProgram(self.glid)
-            GL.glDeleteShader(vert)
-            GL.glDeleteShader(frag)
-            if (not geom_source is None):
-                GL.glDeleteShader(geom)
-            status = GL.glGetProgramiv(self.glid, GL.GL_LINK_STATUS)
-            if not status:
-                print(GL.glGetProgramInfoLog(self.glid).decode('ascii'))
-                os._exit(1)
+        self.sources = (vertex_source, fragment_source, geom_source)
+        self.binary_cache = binary_cache
+        self.debug = debug
+        self.glid = self._build()
+        if self.glid is None:
+            os._exit(1)
+        self._introspect()
 
+    @staticmethod
+    def source_key(sources):
+        """ hash of the current texts of (vertex, fragment, geometry) sources """
+        texts = [Shader._read_source(src) if src is not None else '' for src in sources]
+        return hashlib.sha1('\0'.join(texts).encode()).hexdigest()
+
+    def key(self):
+        return self.source_key(self.sources)
+
+    def _build(self, attribute_locations=None):
+        """ linked program from the binary cache or from the sources, None on errors """
+        key = self.key()
+        if self.binary_cache is not None:
+            glid = self.binary_cache.load(key)
+            if glid is not None:
+                return glid
+        stages = [(src, stage) for src, stage in zip(self.sources, (GL.GL_VERTEX_SHADER, GL.GL_FRAGMENT_SHADER,
+                                                                   GL.GL_GEOMETRY_SHADER)) if src is not None]
+        shaders = [self._compile_shader(src, stage) for src, stage in stages]
+        glid = None
+        if all(shaders):
+            glid = GL.glCreateProgram()  # pylint: disable=E1111
+            for shader in shaders:
+                GL.glAttachShader(glid, shader)
+            for name, location in (attribute_locations or {}).items():
+                GL.glBindAttribLocation(glid, location, name)
+            if self.binary_cache is not None:
+                self.binary_cache.prepare(glid)
+            GL.glLinkProgram(glid)
+            status = GL.glGetProgramiv(glid, GL.GL_LINK_STATUS)
+            if not status:
+                print(GL.glGetProgramInfoLog(glid).decode('ascii'))
+                GL.glDeleteProgram(glid)
+                glid = None
+            elif self.binary_cache is not None:
+                self.binary_cache.store(key, glid)
+        for shader in shaders:
+            if shader:
+                GL.glDeleteShader(shader)
+        return glid
+
+    def _introspect(self):
         # get location, size & type for uniform variables using GL introspection
-        self.uniforms = {}
-        self.debug = debug
+        self.uniforms, self.dtypes = {}, {}
         get_name = {int(k): str(k).split()[0] for k in self.GL_SETTERS.keys()}
         for var in range(GL.glGetProgramiv(self.glid, GL.GL_ACTIVE_UNIFORMS)):
             name, size, type_ = GL.glGetActiveUniform(self.glid, var)
             name = name.decode().split('[')[0]   # remove array characterization
             args = [GL.glGetUniformLocation(self.glid, name), size]
+            if args[0] == -1:  # member of a uniform block, set once per pass
+                UniformBlock.check_offset(self.glid, var, name)
+                continue
             # add transpose=True as argument for matrix types
             if type_ in {GL.GL_FLOAT_MAT2, GL.GL_FLOAT_MAT3, GL.GL_FLOAT_MAT4}:
                 args.append(True)
-            if debug:
+            if self.debug:
                 call = self.GL_SETTERS[type_].__name__
                 print(f'uniform {get_name[type_]} {name}: {call}{tuple(args)}')
             self.uniforms[name] = (self.GL_SETTERS[type_], args)
-
-    def set_uniforms(self, uniforms):
-        """ set only uniform variables that are known to shader """
+            self.dtypes[name] = self.SETTER_DTYPES.get(self.GL_SETTERS[type_], np.float32)
+        self.values = {}    # name -> (value, array) last uploaded to the program
+        for block in UniformBlock.blocks.values():
+            index = GL.glGetUniformBlockIndex(self.glid, block.name)
+            if index != GL.GL_INVALID_INDEX:
+                GL.glUniformBlockBinding(self.glid, index, block.binding)
+
+    def reload(self):
+        """ rebuild the program from its sources, keeping the attribute
+            locations already used by vertex arrays. The old program stays
+            in use if the new one does not compile """
+        locations = {}
+        for var in range(GL.glGetProgramiv(self.glid, GL.GL_ACTIVE_ATTRIBUTES)):
+            name = GL.glGetActiveAttrib(self.glid, var)[0]
+            name = name.decode() if isinstance(name, bytes) else name
+            locations[name] = GL.glGetAttribLocation(self.glid, name)
+        glid = self._build(locations)
+        if glid is None:
+            return False
+        GL.glDeleteProgram(self.glid)
+        self.glid = glid
+        self._introspect()
+        return True
+
+    def prepare(self, uniforms):
+        """ copy of uniforms where those known to the shader are converted
+            once to read only arrays of their GL type, for constant values
+            such as materials """
+        prepared = dict(uniforms)
         for name in uniforms.keys() & self.uniforms.keys():
-            set_uniform, args = self.uniforms[name]
-            set_uniform(*args, uniforms[name])
+            prepared[name] = np.array(uniforms[name], self.dtypes[name])
+            prepared[name].flags.writeable = False
+        return prepared
+
+    def set_uniforms(self, uniforms, defaults=None):
+        """ set only uniform variables that are known to shader, taken from
+            uniforms or else from defaults, skipping values the program
+            already holds """
+        for name, (set_uniform, args) in self.uniforms.items():
+            value = uniforms.get(name)
+            if value is None:
+                if defaults is None or name not in defaults:
+                    continue
+                value = defaults[name]
+            last = self.values.get(name)
+            if last is not None and value is last[0] and _immutable(value):
+                continue
+            array = np.asarray(value, self.dtypes[name])
+            if last is not None and np.array_equal(array, last[1]):
+                self.values[name] = (value, last[1])
+                continue
+            set_uniform(*args, array)
+            if array is value and value.flags.writeable:  # keep our own copy to compare with
+                array = array.copy()
+            self.values[name] = (value, array)
 
     def __del__(self):
         GL.glDeleteProgram(self.glid)  # object dies => destroy GL object
 
+    # array type of the values of non float setters
+    SETTER_DTYPES = {
+        GL.glUniform1uiv: np.uint32, GL.glUniform2uiv: np.uint32,
+        GL.glUniform3uiv: np.uint32, GL.glUniform4uiv: np.uint32,
+        GL.glUniform1iv: np.int32, GL.glUniform2iv: np.int32,
+        GL.glUniform3iv: np.int32, GL.glUniform4iv: np.int32,
+    }
+
     GL_SETTERS = {
         GL.GL_UNSIGNED_INT:      GL.glUniform1uiv,
         GL.GL_UNSIGNED_INT_VEC2: GL.glUniform2uiv,
@@ -114,112 +243,589 @@ class Shader:
     }
 
 
+def _immutable(value):
+    """ True for uniform values that can't change behind our back """
+    if isinstance(value, np.ndarray):
+        return not value.flags.writeable
+    return isinstance(value, (int, float, np.number)) or \
+        (isinstance(value, tuple) and all(isinstance(v, (int, float, np.number)) for v in value))
+
+
+class ShaderBinaryCache:
+    """ Linked program binaries on disk (glGetProgramBinary/glProgramBinary),
+        keyed by source hash and driver. Does nothing if the driver exposes
+        no binary format, and falls back to compiling on any mismatch """
+    def __init__(self, path):
+        self.path = path
+        self.driver = None
+
+    def available(self):
+        if self.driver is None:  # first use, once a GL context exists
+            formats = bool(GL.glGetProgramBinary) and GL.glGetIntegerv(GL.GL_NUM_PROGRAM_BINARY_FORMATS)
+            self.driver = ''
+            if formats:
+                self.driver = '%s|%s' % (GL.glGetString(GL.GL_RENDERER), GL.glGetString(GL.GL_VERSION))
+        return bool(self.driver)
+
+    def _file(self, key):
+        return os.path.join(self.path, hashlib.sha1((key + self.driver).encode()).hexdigest() + '.bin')
+
+    def has(self, key):
+        """ True if a binary of this driver is cached for key """
+        return self.available() and os.path.exists(self._file(key))
+
+    def prepare(self, glid):
+        if self.available():
+            GL.glProgramParameteri(glid, GL.GL_PROGRAM_BINARY_RETRIEVABLE_HINT, GL.GL_TRUE)
+
+    def load(self, key):
+        """ linked program for key, None if not cached or refused by the driver """
+        if not self.has(key):
+            return None
+        data = np.fromfile(self._file(key), np.uint8)
+        binary_format, binary = int(data[:4].view(np.uint32)[0]), data[4:]
+        glid = GL.glCreateProgram()  # pylint: disable=E1111
+        GL.glProgramBinary(glid, binary_format, binary, binary.size)
+        if not GL.glGetProgramiv(glid, GL.GL_LINK_STATUS):  # driver updated since
+            GL.glDeleteProgram(glid)
+            os.remove(self._file(key))
+            return None
+        return glid
+
+    def store(self, key, glid):
+        if not self.available():
+            return
+        size = GL.glGetProgramiv(glid, GL.GL_PROGRAM_BINARY_LENGTH)
+        binary, length = np.empty(size, np.uint8), np.zeros(1, np.int32)
+        binary_format = np.zeros(1, np.uint32)
+        GL.glGetProgramBinary(glid, size, length, binary_format, binary)
+        os.makedirs(self.path, exist_ok=True)
+        with open(self._file(key), 'wb') as file:
+            file.write(binary_format.tobytes() + binary[:length[0]].tobytes())
+
+
+class ShaderRegistry:
+    """ Shared shader programs: identical sources give the same Shader,
+        built from the binary cache when possible. Optionally watches the
+        source files and reloads the programs whose sources changed """
+    def __init__(self, cache_path=None, watch_interval=0.5):
+        self.binary_cache = ShaderBinaryCache(cache_path) if cache_path else None
+        self.programs = {}      # source hash -> Shader
+        self.watching = False
+        self.watch_interval = watch_interval
+        self.last_check = 0.0
+        self.stats = dict(compiled=0, from_binary=0, reused=0, seconds=0.0)
+
+    def get(self, vertex_source, fragment_source, geom_source=None, debug=False):
+        start = perf_counter()
+        key = Shader.source_key((vertex_source, fragment_source, geom_source))
+        if key in self.programs:
+            self.stats['reused'] += 1
+        else:
+            cached = self.binary_cache is not None and self.binary_cache.has(key)
+            self.programs[key] = Shader(vertex_source, fragment_source, geom_source, debug, self.binary_cache)
+            self.programs[key].mtimes = self._mtimes(self.programs[key])
+            self.stats['from_binary' if cached else 'compiled'] += 1
+        self.stats['seconds'] += perf_counter() - start
+        return self.programs[key]
+
+    @staticmethod
+    def _mtimes(shader):
+        files = [src for src in shader.sources if src is not None and os.path.exists(src)]
+        files += [file for src in files for file in Shader.included_files(src)]
+        return [os.path.getmtime(file) for file in files]
+
+    def watch(self, enabled=True):
+        """ opt in (or out) of reloading programs when their files change """
+        self.watching = enabled
+
+    def poll(self):
+        """ call once per frame: reloads the programs with modified files """
+        if not self.watching or perf_counter() - self.last_check < self.watch_interval:
+            return
+        self.last_check = perf_counter()
+        for key, shader in list(self.programs.items()):
+            mtimes = self._mtimes(shader)
+            if mtimes != shader.mtimes:
+                shader.mtimes = mtimes
+                if shader.reload():
+                    print('Reloaded shader %s' % ', '.join(str(src) for src in shader.sources if src))
+                    del self.programs[key]
+                    self.programs[shader.key()] = shader
+
+    def report(self):
+        stats = self.stats
+        print(f'Shaders: {len(self.programs)} programs, {stats["compiled"]} compiled,'
+              f' {stats["from_binary"]} from binary cache, {stats["reused"]} reused'
+              f' ({stats["seconds"]:.3f}s)')
+
+
+# shaders of the whole application, binaries cached with the other build products
+shaders = ShaderRegistry(".cache/shaders")
+
+
+class RenderState:
+    """ Shadow copy of the GL state changed while drawing: program, vertex
+        array, active unit and texture bound per unit, enabled capabilities
+        (blend, cull, depth, clip planes...), blend and depth functions,
+        viewport. Calls that would not change anything are dropped, and counted """
+    def __init__(self):
+        self.current = {}   # state key -> value last set through us
+        self.counts = dict(issued=0, elided=0)
+
+    def reset(self):
+        """ forget everything, after GL state was changed behind our back """
+        self.current = {}
+
+    def end_frame(self):
+        """ issued and elided calls since the last call, once per frame """
+        counts, self.counts = self.counts, dict(issued=0, elided=0)
+        return counts
+
+    def _apply(self, key, value, call, *args):
+        """ call(*args) unless the state 'key' already holds 'value' """
+        if key in self.current and self.current[key] == value:
+            self.counts['elided'] += 1
+            return
+        call(*args)
+        self.current[key] = value
+        self.counts['issued'] += 1
+
+    def use_program(self, glid):
+        self._apply('program', glid, GL.glUseProgram, glid)
+
+    def bind_vertex_array(self, glid):
+        self._apply('vertex_array', glid, GL.glBindVertexArray, glid)
+
+    def active_texture(self, unit):
+        self._apply('active_texture', unit, GL.glActiveTexture, GL.GL_TEXTURE0 + unit)
+
+    def bind_texture(self, target, glid, unit=None):
+        """ bind texture glid on unit, or on the active unit if None """
+        if unit is not None:
+            self.active_texture(unit)
+        unit = self.current.get('active_texture')
+        if unit is None:  # can't know which binding we replace
+            GL.glBindTexture(target, glid)
+            self.counts['issued'] += 1
+            return
+        self._apply(('texture', unit, target), glid, GL.glBindTexture, target, glid)
+
+    def enable(self, capability):
+        self._apply(('enabled', capability), True, GL.glEnable, capability)
+
+    def disable(self, capability):
+        self._apply(('enabled', capability), False, GL.glDisable, capability)
+
+    def blend_func(self, source, destination):
+        self._apply('blend_func', (source, destination), GL.glBlendFunc, source, destination)
+
+    def depth_func(self, function):
+        self._apply('depth_func', function, GL.glDepthFunc, function)
+
+    def require(self, blend=False, depth_func=GL.GL_LESS, cull=True):
+        """ blending, depth function and face culling of the next draw, the
+            defaults being those of opaque geometry. Each draw states all
+            three, so none depends on what was drawn before it """
+        if blend:
+            self.enable(GL.GL_BLEND)
+            self.blend_func(GL.GL_SRC_ALPHA, GL.GL_ONE_MINUS_SRC_ALPHA)
+        else:
+            self.disable(GL.GL_BLEND)
+        self.depth_func(depth_func)
+        if cull:
+            self.enable(GL.GL_CULL_FACE)
+        else:
+            self.disable(GL.GL_CULL_FACE)
+
+    def viewport(self, x, y, width, height):
+        self._apply('viewport', (x, y, width, height), GL.glViewport, x, y, width, height)
+
+    def viewport_size(self):
+        """ (width, height) of the viewport, only read back from GL (which
+            stalls the pipeline) if it was not set through us """
+        if 'viewport' not in self.current:
+            self.current['viewport'] = tuple(int(value) for value in GL.glGetIntegerv(GL.GL_VIEWPORT))
+        return self.current['viewport'][2:]
+
+    def deleted(self, kind, glid):
+        """ GL unbinds deleted 'texture' or 'vertex_array' objects, and may
+            give their name to the next object created """
+        for key, value in self.current.items():
+            if value == glid and (key == kind or (isinstance(key, tuple) and key[0] == kind)):
+                self.current[key] = 0
+
+
+# bound objects and enabled capabilities, shared by all the drawables
+state = RenderState()
+
+
+class UniformBlock:
+    """ std140 uniform block declared in a glsl include file, packed on the
+        CPU in a numpy structured array and uploaded to a uniform buffer
+        bound to 'binding', which every program declaring the block reads """
+    blocks = {}     # block name -> UniformBlock, bound by Shader at link time
+
+    # glsl type: (numpy type, shape, std140 base alignment, size) in bytes
+    STD140 = {
+        'float': ('<f4', (), 4, 4), 'int': ('<i4', (), 4, 4), 'uint': ('<u4', (), 4, 4),
+        'vec2': ('<f4', (2,), 8, 8), 'vec3': ('<f4', (3,), 16, 12), 'vec4': ('<f4', (4,), 16, 16),
+        'mat4': ('<f4', (4, 4), 16, 64),  # declared row_major, like numpy matrices
+    }
+
+    def __init__(self, glsl_file, binding=0):
+        text = re.sub(r'//.*', '', open(glsl_file).read())
+        self.name, members = re.search(r'uniform\s+(\w+)\s*\{(.*?)\}', text, re.DOTALL).groups()
+        names, formats, offsets, offset = [], [], [], 0
+        for type_, name in re.findall(r'(\w+)\s+(\w+)\s*;', members):
+            dtype, shape, alignment, size = self.STD140[type_]
+            offset = -(-offset // alignment) * alignment
+            names.append(name)
+            formats.append((dtype, shape))
+            offsets.append(offset)
+            offset += size
+        self.size = -(-offset // 16) * 16   # whole vec4s, like a std140 structure
+        self.dtype = np.dtype(dict(names=names, formats=formats, offsets=offsets, itemsize=self.size))
+        self.values = np.zeros((), self.dtype)
+        self.binding = binding
+        self.glid, self.uploaded = None, None
+        UniformBlock.blocks[self.name] = self
+
+    def update(self, uniforms):
+        """ pack the members found in uniforms (others keep their value) and
+            upload the block if it changed, once per pass """
+        for name in self.dtype.names:
+            if name in uniforms:
+                field = self.values[name]
+                self.values[name] = np.asarray(uniforms[name], np.float32).ravel()[:field.size].reshape(field.shape)
+        data = self.values.tobytes()
+        if self.glid is None:  # the GL context exists by the first pass
+            self.glid = GL.glGenBuffers(1)
+            GL.glBindBuffer(GL.GL_UNIFORM_BUFFER, self.glid)
+            GL.glBufferData(GL.GL_UNIFORM_BUFFER, self.size, None, GL.GL_DYNAMIC_DRAW)
+            GL.glBindBufferBase(GL.GL_UNIFORM_BUFFER, self.binding, self.glid)
+        if data != self.uploaded:
+            GL.glBindBuffer(GL.GL_UNIFORM_BUFFER, self.glid)
+            GL.glBufferSubData(GL.GL_UNIFORM_BUFFER, 0, self.size, data)
+            self.uploaded = data
+
+    @staticmethod
+    def check_offset(program, index, name):
+        """ warn if the driver placed a block member elsewhere than we pack it """
+        for block in UniformBlock.blocks.values():
+            if name in block.dtype.names:
+                offset = np.zeros(1, np.int32)
+                GL.glGetActiveUniformsiv(program, 1, np.array([index], np.uint32), GL.GL_UNIFORM_OFFSET, offset)
+                if int(offset[0]) != block.dtype.fields[name][1]:
+                    print('Warning: %s.%s at offset %d, packed at %d' % (block.name, name, offset[0],
+                                                                        block.dtype.fields[name][1]))
+
+
+# uniforms shared by all the programs during a render pass, see glsl/pass_block.glsl
+pass_block = UniformBlock(os.path.join(os.path.dirname(os.path.abspath(__file__)), "glsl", "pass_block.glsl"))
+
+
 class VertexArray:
     """ helper class to create and self destroy OpenGL vertex array objects."""
-    def __init__(self, shader, attributes, index=None, usage=GL.GL_STATIC_DRAW):
+    stats = dict(draws=0, triangles=0)  # draw calls counters, reset per pass by the viewer
+    allocations = dict(arrays=0, buffers=0)  # GL objects created, for benchmarks
+
+    def __init__(self, shader, attributes, index=None, usage=GL.GL_STATIC_DRAW, layout=None):
         """ Vertex array from attributes and optional index array. Vertex
-            Attributes should be list of arrays with one row per vertex. """
+            Attributes should be list of arrays with one row per vertex.
+            With a layout, a dict of attribute name -> FORMATS key (float32
+            for attributes not listed), all the attributes are interleaved
+            in a single buffer, each stored in its own format. """
 
         # create vertex array object, bind it
         self.glid = GL.glGenVertexArrays(1)
-        GL.glBindVertexArray(self.glid)
+        state.bind_vertex_array(self.glid)
         self.buffers = {}  # we will store buffers in a named dict
+        self.vertices = None  # CPU copy of the interleaved vertices, if any
+        self.nbytes, self.float32_nbytes = 0, 0  # GPU memory, and as float32 / uint32
         nb_primitives, size = 0, 0
 
-        # load buffer per vertex attribute (in list with index = shader layout)
-        for name, data in attributes.items():
-            #print (shader.name, name, data)
-            loc = GL.glGetAttribLocation(shader.glid, name)
-            #print (loc)
-            if loc >= 0:
+        locations = {name: GL.glGetAttribLocation(shader.glid, name) for name in attributes}
+        attributes = {name: data for name, data in attributes.items() if locations[name] >= 0}
+        if layout is not None and attributes:
+            nb_primitives = self._interleave(attributes, locations, layout, usage)
+        else:
+            # load buffer per vertex attribute (in list with index = shader layout)
+            for name, data in attributes.items():
                 # bind a new vbo, upload its data to GPU, declare size and type
                 self.buffers[name] = GL.glGenBuffers(1)
-                data = np.array(data, np.float32, copy=False)  # ensure format
+                data = np.ascontiguousarray(data, np.float32)  # ensure format, copies only if needed
                 nb_primitives, size = data.shape
-                GL.glEnableVertexAttribArray(loc)
+                GL.glEnableVertexAttribArray(locations[name])
                 GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.buffers[name])
                 GL.glBufferData(GL.GL_ARRAY_BUFFER, data, usage)
-                GL.glVertexAttribPointer(loc, size, GL.GL_FLOAT, False, 0, None)
+                GL.glVertexAttribPointer(locations[name], size, GL.GL_FLOAT, False, 0, None)
+                self.nbytes += data.nbytes
+                self.float32_nbytes += data.nbytes
 
         # optionally create and upload an index buffer for this object
         self.draw_command = GL.glDrawArrays
         self.arguments = (0, nb_primitives)
         if index is not None:
             self.buffers['index'] = GL.glGenBuffers(1)
-            index_buffer = np.array(index, np.int32, copy=False)  # good format
+            index_buffer = np.ascontiguousarray(index)
+            if index_buffer.dtype not in self.INDEX_TYPES:  # good format
+                small = index_buffer.size == 0 or index_buffer.max() < 1 << 16
+                index_buffer = index_buffer.astype(np.uint16 if small else np.uint32)
             GL.glBindBuffer(GL.GL_ELEMENT_ARRAY_BUFFER, self.buffers['index'])
             GL.glBufferData(GL.GL_ELEMENT_ARRAY_BUFFER, index_buffer, usage)
             self.draw_command = GL.glDrawElements
-            self.arguments = (index_buffer.size, GL.GL_UNSIGNED_INT, None)
-
-    def execute(self, primitive, attributes=None):
-        """ draw a vertex array, either as direct array or indexed array """
+            self.arguments = (index_buffer.size, self.INDEX_TYPES[index_buffer.dtype], None)
+            self.nbytes += index_buffer.nbytes
+            self.float32_nbytes += index_buffer.size * 4
+        VertexArray.allocations['arrays'] += 1
+        VertexArray.allocations['buffers'] += len(self.buffers)
+
+    def _interleave(self, attributes, locations, layout, usage):
+        """ pack the attributes in one buffer of records, returns their count """
+        names, formats, offsets, offset = [], [], [], 0
+        for name, data in attributes.items():
+            data = np.asarray(data)
+            dtype = self.FORMATS[layout.get(name, 'float32')][0]
+            names.append(name)
+            formats.append((dtype, data.shape[1:]))
+            offsets.append(offset)
+            offset += -(-np.dtype(dtype).itemsize * int(np.prod(data.shape[1:])) // 4) * 4  # 4 byte aligned
+            self.float32_nbytes += data.size * 4
+        record = np.dtype(dict(names=names, formats=formats, offsets=offsets, itemsize=offset))
+        self.layout = {name: layout.get(name, 'float32') for name in names}
+        self.vertices = np.zeros(len(next(iter(attributes.values()))), record)
+        for name, data in attributes.items():
+            self.vertices[name] = self.convert(data, self.layout[name])
+
+        self.buffers['vertices'] = GL.glGenBuffers(1)
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.buffers['vertices'])
+        GL.glBufferData(GL.GL_ARRAY_BUFFER, self.vertices.view(np.uint8), usage)
+        for name in names:
+            _, gl_type, normalized = self.FORMATS[self.layout[name]]
+            GL.glEnableVertexAttribArray(locations[name])
+            GL.glVertexAttribPointer(locations[name], int(np.prod(record[name].shape)), gl_type,
+                                     normalized, record.itemsize, ctypes.c_void_p(record.fields[name][1]))
+        self.nbytes += self.vertices.nbytes
+        return len(self.vertices)
+
+    @classmethod
+    def convert(cls, data, format_):
+        """ attribute data in one of the FORMATS, normalized integers scaled """
+        dtype, _, normalized = cls.FORMATS[format_]
+        data = np.asarray(data)
+        if normalized:
+            low, high = np.iinfo(dtype).min, np.iinfo(dtype).max
+            data = np.round(np.clip(data, -1 if low else 0, 1) * high)
+        return data.astype(dtype, copy=False)
+
+    def execute(self, primitive, attributes=None, count=None):
+        """ draw a vertex array, either as direct array or indexed array,
+            only its first 'count' vertices (or indices) if given """
 
         # optionally update the data attribute VBOs, useful for e.g. particles
         attributes = attributes or {}
         for name, data in attributes.items():
+            self.update(name, data)
+        arguments = self.arguments
+        if count is not None:
+            arguments = (0, count) if self.draw_command is GL.glDrawArrays else (count,) + arguments[1:]
+        state.bind_vertex_array(self.glid)
+        self.draw_command(primitive, *arguments)
+        self.count_draw(primitive, arguments[1] if self.draw_command is GL.glDrawArrays else arguments[0])
+
+    @staticmethod
+    def count_draw(primitive, count, instances=1):
+        """ add a draw call of count vertices (or indices) to the stats """
+        VertexArray.stats['draws'] += 1
+        if primitive == GL.GL_TRIANGLES:
+            VertexArray.stats['triangles'] += count // 3 * instances
+        elif primitive == GL.GL_TRIANGLE_STRIP:   # restart indices counted as vertices: an upper bound
+            VertexArray.stats['triangles'] += max(count - 2, 0) * instances
+
+    def update(self, name, data, first=0):
+        """ overwrite part of an attribute buffer, starting at vertex 'first' """
+        if self.vertices is not None:  # rewrite the whole records, from our copy
+            if name in self.layout:
+                last = first + len(data)
+                self.vertices[name][first:last] = self.convert(data, self.layout[name])
+                GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.buffers['vertices'])
+                GL.glBufferSubData(GL.GL_ARRAY_BUFFER, first * self.vertices.itemsize, self.vertices[first:last].view(np.uint8))
+        elif name in self.buffers:  # attributes unused by the shader have no buffer
+            data = np.ascontiguousarray(data, np.float32)
             GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.buffers[name])
-            GL.glBufferSubData(GL.GL_ARRAY_BUFFER, 0, data)
-        GL.glBindVertexArray(self.glid)
-        self.draw_command(primitive, *self.arguments)
+            GL.glBufferSubData(GL.GL_ARRAY_BUFFER, first * data.strides[0], data)
 
     def __del__(self):  # object dies => kill GL array and buffers from GPU
         GL.glDeleteVertexArrays(1, [self.glid])
         GL.glDeleteBuffers(len(self.buffers), list(self.buffers.values()))
+        state.deleted('vertex_array', self.glid)
+
+    # compact index arrays are uploaded as is, others as 16 bits if they fit
+    INDEX_TYPES = {
+        np.dtype(np.uint16): GL.GL_UNSIGNED_SHORT,
+        np.dtype(np.uint32): GL.GL_UNSIGNED_INT,
+    }
+
+    # attribute formats of interleaved layouts: numpy type, GL type, normalized
+    FORMATS = {
+        'float32': (np.float32, GL.GL_FLOAT, False),
+        'float16': (np.float16, GL.GL_HALF_FLOAT, False),
+        'int16n': (np.int16, GL.GL_SHORT, True),             # [-1, 1], e.g. normals
+        'uint16n': (np.uint16, GL.GL_UNSIGNED_SHORT, True),  # [0, 1], e.g. texture coordinates
+        'int8n': (np.int8, GL.GL_BYTE, True),
+        'uint8n': (np.uint8, GL.GL_UNSIGNED_BYTE, True),     # e.g. colors
+    }
 
 
 # ------------  Mesh is the core drawable -------------------------------------
 class Mesh:
     """ Basic mesh class, attributes and uniforms passed as arguments """
     def __init__(self, shader, attributes, index=None,
-                 usage=GL.GL_STATIC_DRAW, **uniforms):
+                 usage=GL.GL_STATIC_DRAW, layout=None, **uniforms):
         self.shader = shader
-        self.uniforms = uniforms
-        self.vertex_array = VertexArray(shader, attributes, index, usage)
+        self.uniforms = shader.prepare(uniforms)
+        self.vertex_array = VertexArray(shader, attributes, index, usage, layout)
+
+        # object space bounding volumes for culling, none if vertices move
+        self.bounds, self.sphere = None, None
+        position = attributes.get('position')
+        if position is not None and usage == GL.GL_STATIC_DRAW:
+            position = np.asarray(position, np.float32)
+            if position.ndim == 2 and position.shape[1] >= 3 and len(position):
+                self.bounds = (position[:, :3].min(axis=0), position[:, :3].max(axis=0))
+                center = (self.bounds[0] + self.bounds[1]) / 2
+                self.sphere = (center, float(np.linalg.norm(position[:, :3] - center, axis=1).max()))
 
     def draw(self, primitives=GL.GL_TRIANGLES, attributes=None, **uniforms):
-        GL.glUseProgram(self.shader.glid)
-        self.shader.set_uniforms({**self.uniforms, **uniforms})
+        state.use_program(self.shader.glid)
+        self.shader.set_uniforms(uniforms, self.uniforms)
         self.vertex_array.execute(primitives, attributes)
 
 
+class DynamicMesh(Mesh):
+    """ Mesh whose vertices are rewritten every frame, e.g. particles. Its
+        buffers hold 'capacity' vertices of the given attribute sizes and
+        are GL_STREAM_DRAW: the first write to a buffer after a draw orphans
+        it, so the driver gives us fresh memory instead of waiting for the
+        GPU to finish the previous frame. Only 'count' vertices (or indices
+        with an index) are drawn, so each frame rewrites what it draws """
+    stats = dict(orphans=0, uploads=0, bytes=0)  # buffer traffic, for benchmarks
+
+    def __init__(self, shader, capacity, sizes, index=None, **uniforms):
+        attributes = {name: np.zeros((capacity, size), np.float32) for name, size in sizes.items()}
+        super().__init__(shader, attributes, index, usage=GL.GL_STREAM_DRAW, **uniforms)
+        self.capacity = capacity
+        self.sizes = sizes
+        self.count = 0
+        self.written = set()    # buffers already orphaned since the last draw
+
+    def update(self, name, data, first=0):
+        """ write vertices first, first+1... of an attribute """
+        vertex_array = self.vertex_array
+        if name not in vertex_array.buffers:   # unused by the shader
+            return
+        data = np.ascontiguousarray(data, np.float32)
+        if first + len(data) > self.capacity:
+            raise ValueError('%d vertices written in a DynamicMesh of capacity %d' % (first + len(data), self.capacity))
+        if name not in self.written:
+            GL.glBindBuffer(GL.GL_ARRAY_BUFFER, vertex_array.buffers[name])
+            GL.glBufferData(GL.GL_ARRAY_BUFFER, self.capacity * self.sizes[name] * 4, None, GL.GL_STREAM_DRAW)
+            self.written.add(name)
+            DynamicMesh.stats['orphans'] += 1
+        vertex_array.update(name, data, first)
+        DynamicMesh.stats['uploads'] += 1
+        DynamicMesh.stats['bytes'] += data.nbytes
+
+    def draw(self, primitives=GL.GL_TRIANGLES, attributes=None, **uniforms):
+        for name, data in (attributes or {}).items():
+            self.update(name, data)
+        self.written.clear()
+        if self.count:
+            state.use_program(self.shader.glid)
+            self.shader.set_uniforms(uniforms, self.uniforms)
+            self.vertex_array.execute(primitives, count=self.count)
+
+
 # ------------  Node is the core drawable for hierarchical scene graphs -------
 class Node:
     """ Scene graph transform and parameter broadcast node """
+    animated = False        # True if the transform changes at draw time
+    revision = 0            # bumped on any change of the scene bounds
+    tree_revision = 0       # bumped when nodes are added or removed
+    stats = dict(drawn=0, culled=0)  # frustum culling counters, reset per pass by the viewer
+
     def __init__(self, children=(), transform=identity()):
         self.transform = transform
         self.world_transform = identity()
         self.children = list(iter(children))
+        self._bounds, self._bounds_revision = None, -1
 
     def add(self, *drawables):
         """ Add drawables to this node, simply updating children list """
         self.children.extend(drawables)
+        Node.revision += 1
+        Node.tree_revision += 1
+
+    def bounds(self):
+        """ box (bmin, bmax) around the children, in the frame of this node
+            before its own transform, None if unknown (never culled) """
+        self.child_bounds()
+        return self._bounds
+
+    def child_bounds(self):
+        """ (N,3) bmin and bmax of the children in the frame of this node,
+            and the mask of children with known bounds, cached until the
+            scene changes """
+        if self._bounds_revision != Node.revision:
+            boxes = [drawable_bounds(child) for child in self.children]
+            known = np.array([box is not None for box in boxes], bool)
+            unknown = (np.zeros(3), np.zeros(3))
+            bmin, bmax = (np.array([(box or unknown)[k] for box in boxes], np.float64).reshape(-1, 3) for k in (0, 1))
+            self._child_bounds = bmin, bmax, known
+            self._bounds = (bmin.min(axis=0), bmax.max(axis=0)) if known.size and known.all() else None
+            self._bounds_revision = Node.revision
+        return self._child_bounds
 
     def draw(self, model=identity(), draw_water_flag=True, draw_cloud_flag=True, **other_uniforms):
         """ Recursive draw, passing down updated model matrix. """
+        self.update()
         self.world_transform = model @ self.transform
-        for child in self.children:
+        # frustum planes are extracted once per pass, by the first node drawn
+        frustum = other_uniforms.get('frustum')
+        if frustum is None and 'view' in other_uniforms and 'projection' in other_uniforms:
+            frustum = other_uniforms['frustum'] = frustum_planes(other_uniforms['projection'] @ other_uniforms['view'])
+        visible = None
+        if frustum is not None and self.children:  # all children tested at once
+            bmin, bmax, known = self.child_bounds()
+            visible = ~known | aabb_in_frustum(frustum, *transform_aabb(self.world_transform, bmin, bmax))
+            Node.stats['culled'] += int(np.count_nonzero(~visible))
+        for k, child in enumerate(self.children):
+            if visible is not None:
+                if not visible[k]:
+                    continue
+                if not isinstance(child, Node):
+                    Node.stats['drawn'] += 1
             if (not isinstance(child, water.Water) or draw_water_flag): 
                 if ( isinstance(child, cloud.Cloud)):
                     if (not draw_cloud_flag):
                         continue
-                    GL.glDisable(GL.GL_CULL_FACE)
-                    child.draw(model=self.world_transform, **other_uniforms)
-                    GL.glEnable(GL.GL_CULL_FACE)
                 elif (isinstance(child, particles.ParticlesEmitter)):
-                    if (child.get_activity()):
-                        GL.glDisable(GL.GL_CULL_FACE)
-                        child.draw(model=self.world_transform, **other_uniforms)
-                        GL.glEnable(GL.GL_CULL_FACE)
-                    else:
+                    if (not child.get_activity()):
                         continue
-                else:
-                    child.draw(model=self.world_transform, **other_uniforms)
+                if not hasattr(child, 'render_state'):
+                    state.require()     # decorators set the state they declare
+                child.draw(model=self.world_transform, **other_uniforms)
+
+    def update(self):
+        """ refresh self.transform before drawing, for animated nodes """
 
     # remove nodes once they aren't needed anymore
     def remove(self, *drawables):
         """ Add drawables to this node, simply updating children list """
         self.children.remove(*drawables)
+        Node.revision += 1
+        Node.tree_revision += 1
 
 
     def key_handler(self, key):
@@ -229,6 +835,146 @@ class Node:
     
 
 
+def drawable_bounds(drawable):
+    """ box (bmin, bmax) of a drawable in the frame of its parent node, found
+        on meshes (through decorators), None if unknown or moving """
+    if isinstance(drawable, Node):
+        bounds = None if drawable.animated else drawable.bounds()
+        return bounds and transform_aabb(drawable.transform, *bounds)
+    while not hasattr(drawable, 'bounds') and hasattr(drawable, 'drawable'):
+        drawable = drawable.drawable  # Textured and other decorators
+    return getattr(drawable, 'bounds', None)
+
+
+def draw_key(drawable):
+    """ (program, textures) of a drawable found through its decorators,
+        draws with equal keys need no program or texture change """
+    program, textures = 0, []
+    while drawable is not None:
+        textures.extend(int(getattr(texture, 'glid', texture)) for texture in getattr(drawable, 'textures', {}).values())
+        program = program or getattr(getattr(drawable, 'shader', None), 'glid', 0)
+        drawable = getattr(drawable, 'drawable', None) or getattr(drawable, 'mesh', None)
+    return int(program), tuple(textures)
+
+
+# ------------  Flat render queue compiled from the scene graph --------------
+class RenderQueue:
+    """ Scene graph under root compiled to a flat list of drawables, sorted
+        by program and textures, with the world matrices of all its nodes
+        in one array. Compiled again when nodes are added or removed, only
+        the matrices of animated subtrees are recomputed at each draw """
+    WATER, CLOUD, PARTICLES = 1, 2, 4   # drawables some passes skip
+    BLENDED = WATER | CLOUD | PARTICLES  # keep their place in the scene order
+
+    def __init__(self, root):
+        self.root = root
+        self.tree_revision, self.revision = -1, -1
+
+    def compile(self):
+        """ flatten the tree: one slot per node, one entry per drawable """
+        self.nodes, parents, depths = [self.root], [-1], [0]
+        self.entries = []       # (drawable, parent node slot, kind)
+        self.groups = []        # profiler scope of each entry: its subtree under the root
+        dynamic = [False]
+
+        def visit(node, slot, animated, group):
+            for child in node.children:
+                group_ = group or type(child).__name__
+                if isinstance(child, Node) and type(child).draw is Node.draw:
+                    self.nodes.append(child)
+                    parents.append(slot)
+                    depths.append(depths[slot] + 1)
+                    dynamic.append(animated or child.animated)
+                    visit(child, len(self.nodes) - 1, dynamic[-1], group_)
+                else:  # meshes, decorators and nodes drawing themselves
+                    kind = self.WATER if isinstance(child, water.Water) else \
+                        self.CLOUD if isinstance(child, cloud.Cloud) else \
+                        self.PARTICLES if isinstance(child, particles.ParticlesEmitter) else 0
+                    self.entries.append((child, slot, kind))
+                    self.groups.append(group_)
+        visit(self.root, 0, self.root.animated, None)
+
+        self.parents, depths, dynamic = np.array(parents), np.array(depths), np.array(dynamic)
+        self.levels = [np.flatnonzero(depths == depth) for depth in range(1, depths.max() + 1)]
+        self.dynamic_levels = [level[dynamic[level]] for level in self.levels if dynamic[level].any()]
+        self.animated = [node for node in self.nodes if node.animated]
+        self.entry_parents = np.array([slot for _, slot, _ in self.entries], int)
+        self.worlds = np.zeros((len(self.nodes), 4, 4), np.float32)
+        for slot, node in enumerate(self.nodes):
+            node.world_transform = self.worlds[slot]   # updated in place from now on
+
+        # sorted by key between blended drawables, which stay in scene order
+        keys = [draw_key(drawable) for drawable, _, _ in self.entries]
+        self.order, run = [], []
+        for k, (_, _, kind) in enumerate(self.entries):
+            if kind & self.BLENDED:
+                self.order += sorted(run, key=keys.__getitem__) + [k]
+                run = []
+            else:
+                run.append(k)
+        self.order += sorted(run, key=keys.__getitem__)
+        self.tree_revision, self.revision = Node.tree_revision, -1
+
+    def _update_bounds(self):
+        """ boxes of the drawables in the frame of their parent node """
+        boxes = [drawable_bounds(drawable) for drawable, _, _ in self.entries]
+        self.known = np.array([box is not None for box in boxes], bool)
+        unknown = (np.zeros(3), np.zeros(3))
+        self.bmin, self.bmax = (np.array([(box or unknown)[k] for box in boxes], np.float64).reshape(-1, 3) for k in (0, 1))
+        self.revision = Node.revision
+
+    def _update_worlds(self, levels):
+        """ world matrices of the given node slots, parents first """
+        for level in levels:
+            local = np.array([self.nodes[slot].transform for slot in level], np.float32)
+            self.worlds[level] = self.worlds[self.parents[level]] @ local
+
+    def draw(self, model=identity(), draw_water_flag=True, draw_cloud_flag=True, **uniforms):
+        """ draw all the visible drawables, like root.draw() would """
+        if self.tree_revision != Node.tree_revision:
+            self.compile()
+        if self.revision != Node.revision:
+            self._update_bounds()
+        for node in self.animated:
+            node.update()
+        root = model @ self.root.transform
+        if not np.array_equal(root, self.worlds[0]):
+            self.worlds[0] = root
+            self._update_worlds(self.levels)
+        else:
+            self._update_worlds(self.dynamic_levels)
+
+        frustum = uniforms.get('frustum')
+        if frustum is None and 'view' in uniforms and 'projection' in uniforms:
+            frustum = uniforms['frustum'] = frustum_planes(uniforms['projection'] @ uniforms['view'])
+        visible = np.ones(len(self.entries), bool)
+        if frustum is not None and self.entries:
+            boxes = transform_aabb(self.worlds[self.entry_parents], self.bmin, self.bmax)
+            visible = ~self.known | aabb_in_frustum(frustum, *boxes)
+        hidden = (0 if draw_water_flag else self.WATER) | (0 if draw_cloud_flag else self.CLOUD)
+
+        # draws are sorted across subtrees: time each one, add it to its subtree
+        scope = profiler.child('') if profiler.enabled else None
+        for k in self.order:
+            drawable, slot, kind = self.entries[k]
+            if kind & hidden:
+                continue
+            if not visible[k]:
+                Node.stats['culled'] += 1
+                continue
+            if kind & self.PARTICLES and not drawable.get_activity():
+                continue
+            if not hasattr(drawable, 'render_state'):
+                state.require()     # decorators set the state they declare
+            if scope is None:
+                drawable.draw(model=self.worlds[slot], **uniforms)
+            else:
+                start = perf_counter()
+                drawable.draw(model=self.worlds[slot], **uniforms)
+                profiler.add(scope + self.groups[k], perf_counter() - start)
+            Node.stats['drawn'] += 1
+
+
 
 # -------------- 3D resource loader -------------------------------------------
 MAX_BONES = 128
@@ -246,8 +992,9 @@ except ImportError:
     KeyFrameControlNode, Skinned = None, None
 
 
-def load(file, shader, tex_file=None, **params):
-    """ load resources from file using assimp, return node hierarchy """
+def load(file, shader, tex_file=None, tangents=False, **params):
+    """ load resources from file using assimp, return node hierarchy,
+        with an optional tangent attribute on textured meshes """
     try:
         pp = assimpcy.aiPostProcessSteps
         flags = pp.aiProcess_JoinIdenticalVertices | pp.aiProcess_FlipUVs
@@ -333,6 +1080,10 @@ def load(file, shader, tex_file=None, **params):
         # ---- optionally add texture coordinates attribute if present
         if mesh.HasTextureCoords[0]:
             attributes.update(tex_coord=mesh.mTextureCoords[0])
+            if tangents:
+                attributes.update(tangent=calc_tangents(
+                    np.asarray(mesh.mVertices), np.asarray(index),
+                    np.asarray(mesh.mTextureCoords[0])[:, :2], np.asarray(mesh.mNormals))[0])
 
         # --- optionally add vertex colors as attributes if present
         if mesh.HasVertexColors[0]:
@@ -372,14 +1123,15 @@ def load(file, shader, tex_file=None, **params):
     return [root_node]
 
 def timer():
-    return glfw.get_time()
+    """ render time of the current frame, see clock.SimClock """
+    return clock.time
 
 
 # ------------  Viewer class & window management ------------------------------
 class Viewer(Node):
     """ GLFW viewer window, with classic initialization & graphics loop """
 
-    def __init__(self, width=1280, height=720):
+    def __init__(self, width=1280, height=720, visible=True):
         super().__init__()
 
         # version hints: create GL window with >= OpenGL 3.3 and core profile
@@ -388,6 +1140,9 @@ class Viewer(Node):
         glfw.window_hint(glfw.OPENGL_FORWARD_COMPAT, GL.GL_TRUE)
         glfw.window_hint(glfw.OPENGL_PROFILE, glfw.OPENGL_CORE_PROFILE)
         glfw.window_hint(glfw.RESIZABLE, True)
+        glfw.window_hint(glfw.VISIBLE, visible)
+        if HEADLESS:
+            glfw.window_hint(glfw.CONTEXT_CREATION_API, glfw.EGL_CONTEXT_API)
         self.win = glfw.create_window(width, height, 'Viewer', None, None)
 
         # make win's OpenGL context current; no OpenGL calls can happen before
@@ -410,8 +1165,9 @@ class Viewer(Node):
 
         # initialize GL by setting viewport and default render characteristics
         GL.glClearColor(0, 0, 0.2, 1)
-        GL.glEnable(GL.GL_CULL_FACE)   # backface culling enabled (TP2)
-        GL.glEnable(GL.GL_DEPTH_TEST)  # depth test now enabled (TP2)
+        state.viewport(0, 0, *glfw.get_framebuffer_size(self.win))
+        state.enable(GL.GL_CULL_FACE)   # backface culling enabled (TP2)
+        state.enable(GL.GL_DEPTH_TEST)  # depth test now enabled (TP2)
 
         # cyclic iterator to easily toggle polygon rendering modes
         self.fill_modes = cycle([GL.GL_LINE, GL.GL_POINT, GL.GL_FILL])
@@ -428,22 +1184,44 @@ class Viewer(Node):
         self.shadowFrameBuffer = ShadowFrameBuffer(self.win)
         self.shadow_map_manager = ShadowMapManager(10.0,1.0,15.0, 200.0)
         
+        # drawn / culled drawables, draw calls and triangles of each render pass of the last frame
+        self.pass_stats = {}
+        self.queue = RenderQueue(self)   # the scene, compiled for drawing
+        # GL state calls issued / elided by the render state cache, last frame
+        self.state_stats = dict(issued=0, elided=0)
+
         # inti shader used for animation
-        self.shader = Shader("glsl/texture.vert", "glsl/texture.frag")
+        self.shader = shaders.get("glsl/texture.vert", "glsl/texture.frag")
 
-    def run(self):
-        """ Main render loop for this OpenGL window """
+    def draw_pass(self, name, **uniforms):
+        """ draw the scene once, keeping the frustum culling counters of the pass """
+        Node.stats = dict(drawn=0, culled=0)
+        VertexArray.stats = dict(draws=0, triangles=0)
+        with profiler.scope(name, gpu=True):
+            pass_block.update(uniforms)
+            self.queue.draw(**uniforms)
+        self.pass_stats[name] = dict(Node.stats, **VertexArray.stats)
+
+    def run(self, bench=None):
+        """ Main render loop for this OpenGL window, or the frames of a
+            bench.Benchmark which then drives time, camera and eruption """
 
         #init time counter
-        self.last_time = timer()
+        if bench is not None:
+            bench.start(self)
+        clock.reset()
 
-        quadShader = Shader("glsl/fboviz.vert", "glsl/fboviz.frag")
+        quadShader = shaders.get("glsl/fboviz.vert", "glsl/fboviz.frag")
+        shaders.report()
+        loader.finish()     # textures still decoding are uploaded before the first frame
+        first_frame = True
 
         # setup quad mesh for FBO vizualisation
         base_coords = ((-1, -1, 0), (1, -1, 0), (1, 1, 0), (-1, 1, 0))
         indices = np.array((1, 3, 0, 1 , 2 , 3), np.uint32)
         texcoords = ([0,0], [1, 0], [1, 1], [0, 1])
         mesh = Mesh(quadShader, attributes=dict(position=base_coords, tex_coord=texcoords), index=indices)
+        hud, hud_time = None, 0     # profiler statistics, refreshed twice a second
 
         WATER_HEIGHT = -40 # Should be synced with water height from water.py
         WAVE_SPEED_FACTOR = 0.02
@@ -456,63 +1234,75 @@ class Viewer(Node):
             f' X/SPACE    : move the camera down/up\n'
             f' Enter      : (re)launch the animation\n'
             f' R          : restart the global timer\n'
+            f' P          : pause/resume the simulation\n'
+            f' [ ]        : slow down/speed up the simulation\n'
             f' W          : show the wireframe/vertex view\n'
             f' LeftClick  : change camera orientation\n'
             f' RightClick : pan the camera in the scene\n'
-            f' ScrollWheel: change the fov of the camera\n')
+            f' ScrollWheel: change the fov of the camera\n'
+            f' F3         : show/hide the frame profiler\n'
+            f' F4         : export the profile to profile.csv and profile.json\n')
 
-        while not glfw.window_should_close(self.win):
+        while not glfw.window_should_close(self.win) and (bench is None or bench.running):
+            if bench is not None:
+                bench.before_frame(self)
 
+            steps = clock.tick()    # fixed simulation steps to run this frame
             current_time = timer()
-            self.delta_time = current_time - self.last_time
-            self.last_time = current_time
+            shaders.poll()  # reloads edited shaders, when watching
+            loader.poll()   # uploads textures loaded since the last frame
+            self.delta_time = clock.real_delta  # camera moves even when paused
                 
             # clear draw buffer and depth buffer (<-TP2)
             GL.glClear(GL.GL_COLOR_BUFFER_BIT | GL.GL_DEPTH_BUFFER_BIT)
 
             win_size = glfw.get_window_size(self.win)
-            self.main_light = ( 256 * np.cos(timer() / self.DAY_TIME), 256 * np.abs(np.sin(timer () / self.DAY_TIME)), 
-                               np.abs(256 * np.sin(timer() / self.DAY_TIME)) )
-            cam_pos = np.linalg.inv(self.camera.view_matrix())[:, 3]
+            day_angle = current_time / self.DAY_TIME
+            self.main_light = ( 256 * np.cos(day_angle), 256 * np.abs(np.sin(day_angle)), 
+                               np.abs(256 * np.sin(day_angle)) )
+            view, projection = self.camera.view_matrix(), self.camera.projection_matrix(win_size)
+            cam_pos = self.camera.inverse_view_matrix()[:, 3]
 
-            self.particles_emitter.update(self.delta_time, cam_pos[:3], self.launch_particles)
+            with profiler.scope('particles'):
+                self.particles_emitter.update(clock.step, cam_pos[:3], self.launch_particles, steps)
 
             # draw our scene objects
             self.shadowFrameBuffer.bindFrameBuffer()
-            GL.glEnable(GL.GL_DEPTH_CLAMP) # so that object in front of the frustum can still cast shadows
+            state.enable(GL.GL_DEPTH_CLAMP) # so that object in front of the frustum can still cast shadows
             light_view, light_projection = self.shadow_map_manager.compute_matrices_for_shadow_mapping(self.main_light, 
                                                                                                        self.camera, cam_pos,
                                                                                                        win_size)
  
-            self.draw(view=light_view,
+            self.draw_pass('shadow', view=light_view,
+                      frustum=frustum_planes(light_projection @ light_view)[[0, 1, 2, 3, 5]],  # no near plane: depth clamped casters
                       projection=light_projection,
                       model=identity(),
                       draw_water_flag = False,
                       draw_cloud_flag = False,
                       light_dir=self.main_light)
-            GL.glDisable(GL.GL_DEPTH_CLAMP)
+            state.disable(GL.GL_DEPTH_CLAMP)
             self.shadowFrameBuffer.unbindCurrentFrameBuffer()
 
             self.waterFrameBuffers.bindReflectionFrameBuffer()
-            GL.glEnable(GL.GL_CLIP_PLANE0) # for reflection/refraction clip planes
+            state.enable(GL.GL_CLIP_PLANE0) # for reflection/refraction clip planes
             
-            self.camera.underwater_cam(WATER_HEIGHT)
-            self.draw(view=self.camera.view_matrix(),
-                      projection=self.camera.projection_matrix(win_size),
+            # camera mirrored under the water plane, the camera itself is left untouched
+            self.draw_pass('reflection', view=self.camera.reflected_view_matrix(WATER_HEIGHT),
+                      projection=projection,
                       model=identity(),
                       draw_water_flag = False,
-                      w_camera_position=self.camera.position,
+                      w_camera_position=self.camera.reflected_position(WATER_HEIGHT),
                       light_dir=self.main_light,
                       fog_color=fog,
                       time_of_day = self.getCurrentTimeOfDay(),
                       clipping_plane= reflection_clip_plane,
                       light_space_matrix = light_projection @ light_view,
                       shadow_distance=self.shadow_map_manager.getShadowDistance())
-            self.camera.underwater_cam(WATER_HEIGHT)
             self.waterFrameBuffers.unbindCurrentFrameBuffer()
             self.waterFrameBuffers.bindRefractionFrameBuffer()
-            self.draw(view=self.camera.view_matrix(),
-                      projection=self.camera.projection_matrix(win_size),
+            self.draw_pass('refraction', view=view,
+                      projection=projection,
+                      frustum=self.camera.frustum(win_size),
                       model=identity(),
                       draw_water_flag = False,
                       w_camera_position=cam_pos,
@@ -523,17 +1313,18 @@ class Viewer(Node):
                       light_space_matrix = light_projection @ light_view,
                       shadow_distance=self.shadow_map_manager.getShadowDistance())
             self.waterFrameBuffers.unbindCurrentFrameBuffer()
-            GL.glDisable(GL.GL_CLIP_PLANE0) # for reflection/refraction clip planes
-            GL.glEnable(GL.GL_FRAMEBUFFER_SRGB)
+            state.disable(GL.GL_CLIP_PLANE0) # for reflection/refraction clip planes
+            state.enable(GL.GL_FRAMEBUFFER_SRGB)
             
             #if pour la lave ou non 
             time=0
             if (self.flag_lava_start != 0) :
-                time = timer() - self.flag_lava_start
+                time = current_time - self.flag_lava_start
             
             
-            self.draw(view=self.camera.view_matrix(),
-                    projection=self.camera.projection_matrix(win_size),
+            self.draw_pass('main', view=view,
+                    projection=projection,
+                    frustum=self.camera.frustum(win_size),
                     model=identity(),
                     w_camera_position=cam_pos,
                     light_dir=self.main_light,
@@ -546,17 +1337,37 @@ class Viewer(Node):
                     light_space_matrix = light_projection @ light_view,
                     shadow_distance=self.shadow_map_manager.getShadowDistance())
         
-            GL.glDisable(GL.GL_FRAMEBUFFER_SRGB)
+            state.disable(GL.GL_FRAMEBUFFER_SRGB)
             #Draw the FBOS texture in a quad in the corner of the screen
             #Quad(self.shadowFrameBuffer.getDepthTexture(), mesh).draw(model=identity())
             
             
+            if profiler.enabled:
+                with profiler.scope('hud'):
+                    if hud is None or clock.last - hud_time > 0.5:   # wall clock: refreshed when paused too
+                        hud, hud_time = RenderText(profiler.text(), None, 12, quadShader), clock.last
+                    state.disable(GL.GL_DEPTH_TEST)
+                    hud.draw(model=identity())
+                    state.enable(GL.GL_DEPTH_TEST)
+
+            self.state_stats = state.end_frame()
+
             # flush render commands, and swap draw buffers
-            glfw.swap_buffers(self.win)
+            with profiler.scope('swap'):
+                glfw.swap_buffers(self.win)
+            profiler.end_frame()
+            if first_frame:
+                print('First frame drawn %.2f s after launch' % (perf_counter() - LAUNCH_TIME))
+                first_frame = False
+            if bench is not None:
+                bench.after_frame(self)
 
             # Poll for and process events
             glfw.poll_events()
 
+        if bench is not None:
+            bench.finish(self)
+
     def on_key(self, _win, key, _scancode, action, _mods):
         #print( "position camera = ",self.camera.position)
         """ 'Q' or 'Escape' quits """
@@ -566,8 +1377,19 @@ class Viewer(Node):
                 glfw.set_window_should_close(self.win, True)
             if key == glfw.KEY_Z:
                 GL.glPolygonMode(GL.GL_FRONT_AND_BACK, next(self.fill_modes))
+            if key == glfw.KEY_P and action == glfw.PRESS:
+                clock.toggle_pause()
+            if key == glfw.KEY_LEFT_BRACKET:
+                clock.scale = max(clock.scale / 2, 1 / 16)
+            if key == glfw.KEY_RIGHT_BRACKET:
+                clock.scale = min(clock.scale * 2, 16)
+            if key == glfw.KEY_F3 and action == glfw.PRESS:
+                profiler.enable(not profiler.enabled)
+            if key == glfw.KEY_F4 and action == glfw.PRESS and profiler.enabled:
+                profiler.export('profile.csv')
+                profiler.export('profile.json')
             if key == glfw.KEY_R:
-                glfw.set_time(0.0)
+                clock.reset()
                 self.flag_lava_start = 0
                 self.launch_particles = False
             if  key== glfw.KEY_W:
@@ -605,7 +1427,7 @@ class Viewer(Node):
 
     def on_size(self, _win, _width, _height):
         """ window size update => update viewport to new framebuffer size """
-        GL.glViewport(0, 0, *glfw.get_framebuffer_size(self.win))
+        state.viewport(0, 0, *glfw.get_framebuffer_size(self.win))
 
     def getLightPos(self):
         return self.main_light
@@ -1,4 +1,5 @@
 #version 330 core
+#include "pass_block.glsl"
 
 // input attribute variable, given per vertex
 in vec3 position;
@@ -6,8 +7,6 @@ in vec2 tex_coord;
 
 // global matrix variables
 uniform mat4 model;
-uniform mat4 view;
-uniform mat4 projection;
 
 out vec4 clip_space;
 out vec3 w_position;   // in world coordinates
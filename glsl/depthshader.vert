@@ -1,8 +1,7 @@
 #version 330 core
+#include "pass_block.glsl"
 in vec3 position;
 
-uniform mat4 projection;
-uniform mat4 view;
 uniform mat4 model;
 
 void main()
@@ -1,4 +1,5 @@
 #version 330 core
+#include "pass_block.glsl"
 in vec3 position;
 in vec2 aTexCoord;
 in vec3 aColor;
@@ -6,8 +7,6 @@ in vec3 aColor;
 
 
 uniform mat4 model;
-uniform mat4 view;
-uniform mat4 projection;
 
 
 out vec3 ourColor;
@@ -1,9 +1,8 @@
 #version 330 core
+#include "pass_block.glsl"
 in vec3 position;
 
 uniform mat4 model;
-uniform mat4 view;
-uniform mat4 projection;
 
 void main()
 {
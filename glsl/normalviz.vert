@@ -1,4 +1,5 @@
 #version 330 core
+#include "pass_block.glsl"
 in vec3 position;
 in vec3 normal;
 
@@ -6,7 +7,6 @@ out VS_OUT {
     vec3 normalout;
 } vs_out;
 
-uniform mat4 view;
 uniform mat4 model;
 
 void main()
@@ -1,10 +1,9 @@
 #version 330 core
+#include "pass_block.glsl"
 in vec3 position;
 in vec4 color;
 
 uniform mat4 model;
-uniform mat4 view;
-uniform mat4 projection;
 
 out vec4 fragment_color;
 
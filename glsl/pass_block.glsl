@@ -0,0 +1,12 @@
+// per pass uniforms, written once per render pass by the viewer (core.pass_block)
+layout(std140, row_major) uniform PassBlock {
+    mat4 view;
+    mat4 projection;
+    mat4 light_space_matrix;
+    vec4 clipping_plane;
+    vec3 w_camera_position;
+    float time_of_day;
+    vec3 light_dir;
+    float shadow_distance;
+    vec3 fog_color;
+};
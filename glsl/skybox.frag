@@ -1,12 +1,11 @@
 #version 330 core
+#include "pass_block.glsl"
 out vec4 out_color;
 
 in vec3 frag_tex_coords;
 
 uniform samplerCube cube_map;
 uniform samplerCube cube_map2;
-uniform vec3 fog_color;
-uniform float time_of_day;
 
 // determine the limits for the skybox fading into the fog
 const float lower_limit = 0.0;
@@ -1,11 +1,9 @@
 #version 330 core
+#include "pass_block.glsl"
 
 out vec3 frag_tex_coords;
 in vec3 position;
 
-uniform mat4 projection;
-uniform mat4 view;
-
 void main()
 {
     frag_tex_coords = position;
@@ -1,4 +1,5 @@
 #version 330 core
+#include "pass_block.glsl"
 
 uniform sampler2D diffuse_map;
 uniform sampler2D normal_map;
@@ -20,11 +21,6 @@ in vec3 w_position, w_normal;
 in float out_of_shadow_area_factor;
 
 
-uniform vec3 w_camera_position, light_dir;
-
-//Fog specified color
-uniform vec3 fog_color;
-
 const vec3 BLEND_SHARPNESS = vec3(16.0,16.0,16.0);
 const float TILE_SCALE = 2.0;
 
@@ -1,12 +1,7 @@
 #version 330 core
+#include "pass_block.glsl"
 
 uniform mat4 model;
-uniform mat4 view;
-uniform mat4 projection;
-uniform vec4 clipping_plane;
-uniform mat4 light_space_matrix;
-
-uniform float shadow_distance;
 
 in vec3 position;
 in vec2 tex_coord;
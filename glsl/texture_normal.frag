@@ -1,4 +1,5 @@
 #version 330 core
+#include "pass_block.glsl"
 
 uniform sampler2D diffuse_map;
 uniform sampler2D normal_map;
@@ -14,11 +15,6 @@ uniform float s;
 in vec3 tangent_light_pos, tangent_view_pos, tangent_frag_pos;
 in vec3 w_position;
 
-uniform vec3 w_camera_position;
-
-//Fog specified color
-uniform vec3 fog_color;
-
 float computeFog(float d)
 {
     const float density = 0.0015;
@@ -1,11 +1,7 @@
 #version 330 core
+#include "pass_block.glsl"
 
 uniform mat4 model;
-uniform mat4 view;
-uniform mat4 projection;
-uniform vec4 clipping_plane;
-uniform vec3 light_dir;
-uniform vec3 w_camera_position;
 
 in vec3 position;
 in vec2 tex_coord;
@@ -1,4 +1,5 @@
 #version 330 core
+#include "pass_block.glsl"
 
 uniform samplerCube cube_map;
 in vec2 frag_tex_coords;
@@ -8,18 +9,12 @@ out vec4 out_color;
 // (you can also compute in VIEW coordinates, your choice! rename variables)
 in vec3 w_position, w_normal;   // in world coodinates
 
-// light dir, in world coordinates
-uniform vec3 light_dir;
-
 // material properties
 uniform vec3 k_d;
 uniform vec3 k_s;
 uniform vec3 k_a; 
 uniform float s;
 
-// world camera position
-uniform vec3 w_camera_position;
-
 void main() {
     // compute reflection/refraction from the object
     // float ratio = 1.00 / 1.52; decomment and change reflect by refract on the next line to compute refraction
@@ -1,4 +1,5 @@
 #version 330 core
+#include "pass_block.glsl"
 
 uniform sampler2D lava_map;
 uniform sampler2DArray terrain;
@@ -20,11 +21,6 @@ uniform float s;
 in vec3 w_position, w_normal;
 in float out_of_shadow_area_factor;
 
-uniform vec3 w_camera_position, light_dir;
-
-//Fog specified color
-uniform vec3 fog_color;
-
 uniform float lava_speed;
 uniform float displacement_speed;
 
@@ -0,0 +1,52 @@
+#version 330 core
+#include "pass_block.glsl"
+
+uniform mat4 model;
+
+// whole map in one texture, one texel per grid vertex: xyz = normal, w = height
+uniform sampler2D height_map;
+uniform vec2 grid_origin;   // world (x, z) of grid vertex [0, 0]
+uniform int patch_size;     // quads per side of the shared patch
+uniform int patches_x;      // patch instances per row of the map
+
+in vec2 grid_coord;         // vertex of the shared patch, in [0, patch_size]
+
+out vec2 frag_tex_coords;
+out vec4 frag_tex_light_space_coords; 
+
+out vec3 w_position, w_normal;
+out float out_of_shadow_area_factor;
+
+const float shadow_trans_dist = 10.0 ;
+
+void main() {
+    // grid vertex drawn by this instance, clamped on the partial patches of the map border
+    ivec2 tile = ivec2(gl_InstanceID % patches_x, gl_InstanceID / patches_x);
+    ivec2 vertex = min(tile * patch_size + ivec2(grid_coord), textureSize(height_map, 0) - 1);
+    vec4 texel = texelFetch(height_map, vertex, 0);
+    vec3 position = vec3(grid_origin.x + vertex.x, texel.w, grid_origin.y + vertex.y);
+    vec3 normal = texel.xyz;
+    vec2 tex_coord = vec2(vertex);
+
+    // Transform the position into world coordinates
+    vec4 w_position4 = model * vec4(position, 1.0);
+    w_position = w_position4.xyz / w_position4.w;
+    w_normal = normalize( transpose(inverse(mat3(model))) * normal);
+
+    // Set the clipping plane
+    gl_ClipDistance[0] = dot(w_position4, clipping_plane);  // tell GLSL to cull every vertices above/below clipping plane
+    vec4 position_from_camera = view * w_position4;
+    gl_Position = projection * position_from_camera;
+    frag_tex_coords = tex_coord ;
+
+    //compute vertex pos in light space
+    frag_tex_light_space_coords = light_space_matrix * w_position4;
+
+    // compute a transition period between shadowed / out of shadow area
+    // out_of_shadow_area_factor = 0.0 if outside area, 1.0 if before shadow_distance 
+    // and a value between 0 and 1 in the transition
+    float distance = length(position_from_camera) - (shadow_distance - shadow_trans_dist);
+    distance = distance / shadow_trans_dist;
+    out_of_shadow_area_factor = clamp (1.0-distance, 0.0, 1.0);
+
+}
\ No newline at end of file
@@ -1,4 +1,5 @@
 #version 330 core
+#include "pass_block.glsl"
 out vec4 out_color;
 
 uniform sampler2D reflection_tex;
@@ -14,9 +15,6 @@ in vec2 frag_tex_coords;
 in vec4 frag_tex_light_space_coords; 
 in float out_of_shadow_area_factor;
 
-// light dir, in world coordinates
-uniform vec3 light_dir;
-
 // material properties
 uniform vec3 k_a;
 uniform vec3 k_d;
@@ -25,12 +23,6 @@ uniform float s;
 
 uniform float displacement_speed;
 
-// world camera position
-uniform vec3 w_camera_position;
-
-//Fog specified color
-uniform vec3 fog_color;
-
 //Near and far plane for floor depth calc
 uniform float near;
 uniform float far;
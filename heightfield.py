@@ -0,0 +1,63 @@
+"""
+Height field queries on a regular terrain grid, in plain numpy.
+The grid is indexed [row, col] = [z, x] like terrain.generate_vertices.
+"""
+import numpy as np
+
+
+class HeightField:
+    """ Bilinear height and normal lookups for many world positions at once """
+    def __init__(self, heights, origin=(0.0, 0.0), spacing=1.0, gradients=False):
+        self.heights = np.asarray(heights, np.float32)
+        self.origin = origin      # world (x, z) of grid vertex [0, 0]
+        self.spacing = spacing    # world distance between two grid vertices
+        # optional smooth (central difference) slopes, interpolated like heights
+        self.gradients = None
+        if gradients:
+            dz, dx = np.gradient(self.heights, spacing)
+            self.gradients = np.stack((dx, dz), axis=-1)
+
+    def _cells(self, x, z):
+        """ grid cell and fractional position of world coordinates, clamped to the grid """
+        rows, cols = self.heights.shape
+        u = np.clip((np.asarray(x) - self.origin[0]) / self.spacing, 0, cols - 1)
+        v = np.clip((np.asarray(z) - self.origin[1]) / self.spacing, 0, rows - 1)
+        col = np.minimum(u.astype(np.intp), max(cols - 2, 0))
+        row = np.minimum(v.astype(np.intp), max(rows - 2, 0))
+        return row, col, (u - col).astype(u.dtype), (v - row).astype(v.dtype)
+
+    def sample_many(self, points):
+        """ heights (N,) and unit normals (N,3) under (N,2) x,z or (N,3) x,y,z points """
+        points = np.asarray(points)
+        x, z = (points[..., 0], points[..., 1]) if points.shape[-1] == 2 else (points[..., 0], points[..., 2])
+        return self._sample(x, z, normals=True)
+
+    def height_at(self, x, z):
+        """ height under a single world position (or arrays of x and z) """
+        return self._sample(x, z, normals=False)[0]
+
+    def _sample(self, x, z, normals):
+        """ bilinear heights under world coordinates, and their normals if asked """
+        row, col, fx, fz = self._cells(x, z)
+        row1 = np.minimum(row + 1, self.heights.shape[0] - 1)
+        col1 = np.minimum(col + 1, self.heights.shape[1] - 1)
+        h00, h01 = self.heights[row, col], self.heights[row, col1]
+        h10, h11 = self.heights[row1, col], self.heights[row1, col1]
+        top = h00 + (h01 - h00) * fx
+        bottom = h10 + (h11 - h10) * fx
+        heights = top + (bottom - top) * fz
+        if not normals:
+            return heights, None
+
+        if self.gradients is None:  # slopes of the bilinear patch itself
+            dx = ((h01 - h00) * (1 - fz) + (h11 - h10) * fz) / self.spacing
+            dz = (bottom - top) / self.spacing
+        else:
+            g = self.gradients
+            fx, fz = fx[..., None], fz[..., None]
+            g = (g[row, col] * (1 - fx) + g[row, col1] * fx) * (1 - fz) \
+                + (g[row1, col] * (1 - fx) + g[row1, col1] * fx) * fz
+            dx, dz = g[..., 0], g[..., 1]
+        normals = np.stack((-dx, np.ones_like(dx), -dz), axis=-1)
+        normals /= np.linalg.norm(normals, axis=-1, keepdims=True)
+        return heights, normals
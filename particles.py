@@ -32,7 +32,8 @@ class Particle():
                 self.camera_distance = -1.0
 
 class ParticlesEmitter(Textured):
-    def __init__(self, shader, scale=0.25, color=(0.7,0.2,0.0,1.0), life=2.0, pos=np.array([0.0,23.0,0.0]), speed=np.array([0.0,10.0,0.0]), max_count=1000):
+    render_state = dict(blend=True, cull=False)     # drawn from both sides
+    def __init__(self, shader, scale=0.25, color=(0.7,0.2,0.0,1.0), life=2.0, pos=np.array([0.0,23.0,0.0]), speed=np.array([0.0,10.0,0.0]), max_count=1000, seed=None):
         self.max_particles_count = max_count
         self.shader = shader
         self.scale = scale
@@ -42,11 +43,34 @@ class ParticlesEmitter(Textured):
         self.speed = speed
         self.last_used_particle = 0
         self.is_active = False # allows us to stop the emitter
-        random.seed() 
+        random.seed(seed)
 
         self.particles_instances = []
+        # one quad of 4 vertices per particle, rewritten in place every frame
+        quad_index = np.array((1, 0, 3, 1 , 3 , 2), np.uint32)
+        index = (quad_index + 4 * np.arange(max_count, dtype=np.uint32)[:, None]).ravel()
+        self.mesh = core.DynamicMesh(shader, 4 * max_count, dict(position=3, color=4), index=index,
+                                     k_a=(0.1,0.1,0.1), k_d=(0.4,0.4,0.4), k_s=(1.0,0.9,0.8), s=16)
+        super().__init__(self.mesh)
 
-    def update(self, delta, cam_pos, create_new_particles):
+    def update(self, delta, cam_pos, create_new_particles, steps=1):
+        """ advance the particles by steps fixed steps of delta seconds,
+            then upload the living ones """
+        if steps == 0:  # nothing moved since the last frame
+            return
+        for _ in range(steps):
+            living_particles = self.step(delta, cam_pos, create_new_particles)
+        if (len(living_particles)!=0):   #if there is at least one particle to draw 
+            particles_coords = np.concatenate([particle.coords for particle in living_particles])
+            particles_color = np.repeat([particle.color for particle in living_particles], 4, axis=0) # 1 color per vertex
+            self.mesh.update('position', particles_coords)
+            self.mesh.update('color', particles_color)
+            self.mesh.count = 6 * len(living_particles)
+        else:
+            self.is_active = False
+
+    def step(self, delta, cam_pos, create_new_particles):
+        """ one simulation step: emit new particles, move the living ones """
         if (create_new_particles): # if the emitter was asked to create new particles
             self.is_active = True
             nb_new_particles = 100
@@ -62,20 +86,7 @@ class ParticlesEmitter(Textured):
             particle = particle.update(delta, cam_pos)
             if (particle != None):
                 living_particles.append(particle)
-        if (len(living_particles)!=0):   #if there is at least one particle to draw 
-            particles_coords = []
-            particles_color = []
-            particles_index = []
-            particle_index = np.array((1, 0, 3, 1 , 3 , 2), np.uint32)
-            for i in range(len(living_particles)):
-                particle_coords = living_particles[i].coords.tolist()
-                particles_coords.extend(particle_coords)
-                particles_color.extend(np.array([living_particles[i].color] * len(particle_coords)).tolist()) # 1 color per vertex
-                particles_index.extend(particle_index + i*4) #*4 because it's the nb of vertices of the particles
-            mesh = core.Mesh(self.shader, attributes=dict(position=particles_coords, color=particles_color), index=particles_index, k_a=(0.1,0.1,0.1), k_d=(0.4,0.4,0.4), k_s=(1.0,0.9,0.8), s=16)    
-            super().__init__(mesh)
-        else:
-            self.is_active = False
+        return living_particles
 
 
     def find_dead_particle(self):
@@ -0,0 +1,162 @@
+"""
+Frame profiler: nested CPU scopes and GL_TIME_ELAPSED queries, kept over a
+rolling window of frames for mean / p95 / max statistics, which can be shown
+on screen and exported as CSV or JSON.
+GPU timings are read back a few frames late, once the queries are available,
+so the CPU never waits for the GPU. When disabled, scope() returns a shared
+no-op context manager and the instrumented code only tests a flag.
+"""
+import csv
+import json
+from collections import deque, defaultdict
+from contextlib import nullcontext
+from time import perf_counter
+import numpy as np
+import OpenGL.GL as GL              # standard Python OpenGL wrapper
+
+NULL_SCOPE = nullcontext()
+
+
+class Scope:
+    """ Context manager timing one scope of the frame """
+    def __init__(self, profiler, name, gpu):
+        self.profiler, self.name, self.gpu = profiler, name, gpu
+
+    def __enter__(self):
+        profiler = self.profiler
+        profiler.stack.append(self.name)
+        self.path = '/'.join(profiler.stack)
+        self.query = profiler.begin_query(self.path) if self.gpu else None
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        profiler = self.profiler
+        profiler.add(self.path, perf_counter() - self.start)
+        if self.query is not None:
+            GL.glEndQuery(GL.GL_TIME_ELAPSED)
+        profiler.stack.pop()
+
+
+class Profiler:
+    """ Per frame CPU and GPU timings of named scopes, in milliseconds """
+    def __init__(self, history=240, latency=3):
+        self.enabled = False
+        self.history = history    # frames kept for the statistics
+        self.latency = latency    # frames before GL query results are read
+        self.stack = []           # names of the open scopes
+        self.frame = defaultdict(float)   # cpu time of the scopes of this frame
+        self.cpu, self.gpu = {}, {}       # scope path -> deque of ms
+        self.queries = []         # (path, query) begun this frame
+        self.pending = deque()    # (frame, [(path, query)]) not read back yet
+        self.free = []            # query objects ready for reuse
+        self.frame_index = 0
+        self.last_frame = None
+
+    def enable(self, enabled=True):
+        """ start (or stop) profiling, statistics restart from scratch """
+        self.enabled = enabled
+        self.frame.clear()
+        self.cpu.clear()
+        self.gpu.clear()
+        # queries of the old run can be begun again without reading them
+        self.pending.append((self.frame_index, self.queries))
+        self.free.extend(query for _, queries in self.pending for _, query in queries)
+        self.queries, self.last_frame = [], None
+        self.pending.clear()
+
+    def scope(self, name, gpu=False):
+        """ context manager timing a scope nested in the open ones, and on
+            the GPU too if gpu is True (GL queries of the same target
+            cannot nest: use it on non overlapping scopes, e.g. passes) """
+        if not self.enabled:
+            return NULL_SCOPE
+        return Scope(self, name, gpu)
+
+    def add(self, path, seconds):
+        """ add cpu time to a scope, e.g. timed by the caller """
+        self.frame[path] += seconds * 1e3
+
+    def child(self, name):
+        """ path of a scope named name under the open scopes """
+        return '/'.join(self.stack + [name])
+
+    def begin_query(self, path):
+        query = self.free.pop() if self.free else GL.glGenQueries(1)
+        GL.glBeginQuery(GL.GL_TIME_ELAPSED, query)
+        self.queries.append((path, query))
+        return query
+
+    def end_frame(self):
+        """ close the frame: keep its timings, read back old queries """
+        if not self.enabled:
+            return
+        now = perf_counter()
+        if self.last_frame is not None:
+            self.frame['frame'] = (now - self.last_frame) * 1e3
+        self.last_frame = now
+        for path, ms in self.frame.items():
+            self._samples(self.cpu, path).append(ms)
+        self.frame.clear()
+
+        if self.queries:
+            self.pending.append((self.frame_index, self.queries))
+            self.queries = []
+        while self.pending and self.frame_index - self.pending[0][0] >= self.latency:
+            queries = self.pending[0][1]
+            last = queries[-1][1]   # queries complete in order
+            if not GL.glGetQueryObjectiv(last, GL.GL_QUERY_RESULT_AVAILABLE):
+                break
+            self.pending.popleft()
+            self._read(queries)
+        self.frame_index += 1
+
+    def _read(self, queries):
+        for path, query in queries:
+            self._samples(self.gpu, path).append(GL.glGetQueryObjectuiv(query, GL.GL_QUERY_RESULT) / 1e6)
+            self.free.append(query)
+
+    def flush(self):
+        """ wait for the GPU and read back all the pending queries """
+        GL.glFinish()
+        for _, queries in self.pending:
+            self._read(queries)
+        self.pending.clear()
+
+    def _samples(self, timings, path):
+        if path not in timings:
+            timings[path] = deque(maxlen=self.history)
+        return timings[path]
+
+    def stats(self):
+        """ rows of mean / p95 / max ms of every scope, in scope order """
+        rows = []
+        for clock, timings in (('cpu', self.cpu), ('gpu', self.gpu)):
+            for path in sorted(timings):
+                samples = np.array(timings[path])
+                rows.append(dict(scope=path, clock=clock, frames=len(samples),
+                                 mean=float(samples.mean()), p95=float(np.percentile(samples, 95)),
+                                 max=float(samples.max())))
+        return rows
+
+    def text(self):
+        """ statistics as aligned text lines, e.g. for a HUD """
+        lines = ['%-28s %5s %7s %7s %7s' % ('scope', 'clock', 'mean', 'p95', 'max')]
+        for row in sorted(self.stats(), key=lambda row: (row['scope'], row['clock'])):
+            lines.append('%-28s %5s %7.2f %7.2f %7.2f' % (row['scope'], row['clock'], row['mean'], row['p95'], row['max']))
+        return '\n'.join(lines)
+
+    def export(self, path):
+        """ write the statistics to a .json or .csv file """
+        rows = self.stats()
+        with open(path, 'w', newline='') as file:
+            if path.endswith('.json'):
+                json.dump(rows, file, indent=1)
+            else:
+                writer = csv.DictWriter(file, ['scope', 'clock', 'frames', 'mean', 'p95', 'max'])
+                writer.writeheader()
+                writer.writerows(rows)
+        print('Profile of %d frames written to %s' % (len(self.cpu.get('frame', ())), path))
+
+
+profiler = Profiler()
@@ -1,5 +1,6 @@
 import OpenGL.GL as GL              # standard Python OpenGL wrapper
 import glfw                         # lean window system wrapper for OpenGL
+import core
 
 class ShadowFrameBuffer:
     
@@ -29,7 +30,7 @@ class ShadowFrameBuffer:
 
     def createDepthTextureAttachment(self, width, height):
         texture = GL.glGenTextures(1)
-        GL.glBindTexture(GL.GL_TEXTURE_2D, texture)
+        core.state.bind_texture(GL.GL_TEXTURE_2D, texture)
         GL.glTexImage2D(GL.GL_TEXTURE_2D, 0, GL.GL_DEPTH_COMPONENT32, width, height, 0, GL.GL_DEPTH_COMPONENT, GL.GL_FLOAT,  None)
         GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER, GL.GL_LINEAR)
         GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, GL.GL_LINEAR)
@@ -45,14 +46,14 @@ class ShadowFrameBuffer:
         return texture
 
     def bindFrameBuffer(self): #call before rendering to this FBO
-        GL.glBindTexture(GL.GL_TEXTURE_2D, 0)#To make sure the texture isn't bound
+        core.state.bind_texture(GL.GL_TEXTURE_2D, 0)#To make sure the texture isn't bound
         GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, self.frameBuffer)
         GL.glClear(GL.GL_DEPTH_BUFFER_BIT)
-        GL.glViewport(0, 0, self.TEX_WIDTH, self.TEX_HEIGHT)
+        core.state.viewport(0, 0, self.TEX_WIDTH, self.TEX_HEIGHT)
     
     def unbindCurrentFrameBuffer(self): #call to switch to default frame buffer
         GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, 0)
-        GL.glViewport(0, 0, *glfw.get_framebuffer_size(self.win))
+        core.state.viewport(0, 0, *glfw.get_framebuffer_size(self.win))
 
     def getDepthTexture(self): #get the resulting depth textureé
         return self.depthTexture
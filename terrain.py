@@ -1,24 +1,76 @@
 #!/usr/bin/env python3
 import OpenGL.GL as GL              # standard Python OpenGL wrapper
 import numpy as np                  # all matrix manipulations & OpenGL args
-from core import  Mesh
-from texture import Texture, Textured, TextureArray
-from transform import normalized, calc_normals
+from core import  Mesh, VertexArray, Node, state, shaders
+from texture import Texture, Textured, TextureArray, HeightTexture
+from transform import normalized, calc_normals, calc_tangents, frustum_planes, aabb_in_frustum
+from terrain_lod import TerrainQuadTree, lod_scale, tile_indices, tile_attribute
+from heightfield import HeightField
 from PIL import Image
 
+MIN_HEIGHT = -64
+MAX_HEIGHT = 64
+DISPLACED_VERTEX_SHADER = "glsl/texture_terrain_displaced.vert"  # vertex stage of displaced=True
 
  
 # -------------- Terrain ---------------------------------
 class Terrain(Textured):
     """ Simple first textured object """
-    def __init__(self, shader, terrain_textures, terrain_normal_textures, noise_file, lava_map_file, dudv_file, lava_normal_file, map_width, map_height, heightmap_file, shadowFrameBuffer):
-        height_map = generate_height_map(map_width, map_height, heightmap_file)
-        self.vertices = generate_vertices(map_width, map_height, height_map)
-        indices = generate_indices(map_width, map_height)
-        texcoords = generate_texcoords(map_width, map_height)
-        normals = calc_normals(self.vertices, indices) 
-        # setup plane mesh to be textured
-        mesh = Mesh(shader, attributes=dict(position=self.vertices, tex_coord=texcoords, normal=normals), index=indices, k_a=(0.4,0.4,0.4), k_d=(0.8,0.7,0.7), k_s=(1.0,0.85,0.85), s=8)
+    def __init__(self, shader, terrain_textures, terrain_normal_textures, noise_file, lava_map_file, dudv_file, lava_normal_file, map_width, map_height, heightmap_file, shadowFrameBuffer, strip=False, lod=False, cache=None, tangents=False, stream=None, camera=None, displaced=False, max_error=None, compact=False):
+        single_mesh = not (lod or stream is not None or displaced)
+        if strip and not single_mesh:
+            raise ValueError("strip only applies to the single mesh terrain (no lod, stream or displaced)")
+        if max_error is not None and (strip or not single_mesh):
+            raise ValueError("max_error only applies to the single mesh terrain drawn as triangles (no strip, lod, stream or displaced)")
+        if stream is not None and camera is None:
+            raise ValueError("a streamed terrain needs the camera around which its tiles are loaded")
+        material = dict(k_a=(0.4,0.4,0.4), k_d=(0.8,0.7,0.7), k_s=(1.0,0.85,0.85), s=8)
+        self.restart_index = None
+        if stream is not None:
+            # out of core map: only the tiles streamed around the camera exist, on CPU and GPU,
+            # so there is no whole grid to query or deform (see whole_grid)
+            self.vertices, self.height_field = None, None
+            mesh = StreamingTiles(shader, stream, camera, **material)
+        else:
+            # reuse the arrays of a previous run when an (optional) TerrainCache has them
+            arrays = None
+            if cache is not None:
+                key = cache.key(heightmap_file, map_width, map_height, MIN_HEIGHT, MAX_HEIGHT, tangents, max_error)
+                arrays = cache.load(key)
+            if arrays is None:
+                arrays = generate_mesh_arrays(map_width, map_height, heightmap_file, tangents, max_error)
+                if cache is not None:
+                    cache.store(key, arrays)
+            if max_error is not None:
+                full = 2 * (map_width - 1) * (map_height - 1)
+                print(f'Simplified terrain to {arrays["index"].size // 3} triangles out of {full}'
+                      f' ({100 * arrays["index"].size // 3 / full:.1f}%, max error {max_error})')
+            self.vertices, indices = arrays['position'], arrays['index']
+            attributes = {name: array for name, array in arrays.items() if name != 'index'}
+            layout = compact_layout(map_width, map_height) if compact else None
+            self.attributes, self.grid_shape = attributes, (map_height, map_width)
+            # height & normal queries for foliage placement, collisions, camera...
+            grid = self.grid
+            self.height_field = HeightField(grid(self.vertices)[..., 1], origin=self.vertices[0, [0, 2]])
+            if displaced:
+                # one shared flat patch, heights and normals read from a texture by the vertex shader,
+                # which replaces the vertex stage of the terrain program
+                displaced_shader = shaders.get(DISPLACED_VERTEX_SHADER, *shader.sources[1:])
+                mesh = DisplacedGrid(displaced_shader, HeightTexture(grid(self.vertices)[..., 1], grid(attributes['normal'])),
+                                     origin=self.vertices[0, [0, 2]], **material)
+            elif lod:
+                # quadtree of tiles, each pass draws the levels of detail its camera needs
+                mesh = TerrainTiles(shader, {name: grid(array) for name, array in attributes.items()},
+                                    layout=layout, **material)
+            else:
+                # optionally draw the grid as one triangle strip per row, separated by a restart index
+                if strip:
+                    indices = generate_strip_indices(map_width, map_height)
+                    self.restart_index = np.iinfo(indices.dtype).max
+                # setup plane mesh to be textured
+                mesh = Mesh(shader, attributes=attributes, index=indices, layout=layout, **material)
+                print(f'Terrain vertex arrays: {mesh.vertex_array.nbytes / 2**20:.1f} MB'
+                      f' ({mesh.vertex_array.float32_nbytes / 2**20:.1f} MB as float32)')
 
         # setup & upload texture to GPU, bind it to shader name 'diffuse_map'
 
@@ -28,65 +80,348 @@ class Terrain(Textured):
         lava_map_tex = Texture(lava_map_file, GL.GL_REPEAT, *(GL.GL_LINEAR, GL.GL_LINEAR_MIPMAP_LINEAR), gamma_correction=False)
         lava_normal_tex = Texture(lava_normal_file, GL.GL_MIRRORED_REPEAT, *(GL.GL_LINEAR, GL.GL_LINEAR_MIPMAP_LINEAR), gamma_correction=False)
         dudv_tex = Texture(dudv_file, GL.GL_MIRRORED_REPEAT, *(GL.GL_LINEAR, GL.GL_LINEAR_MIPMAP_LINEAR), gamma_correction=False)
-        super().__init__(mesh, terrain=terrain_tex, terrain_normal=terrain_normal_tex, noise_map=noise_tex, lava_map=lava_map_tex, 
+        height_map = dict(height_map=mesh.heights) if displaced else {}
+        super().__init__(mesh, **height_map, terrain=terrain_tex, terrain_normal=terrain_normal_tex, noise_map=noise_tex, lava_map=lava_map_tex, 
                          lava_normal_map=lava_normal_tex, dudv_map=dudv_tex, shadow_map=shadowFrameBuffer.getDepthTexture())
 
+    def draw(self, primitives=GL.GL_TRIANGLES, **uniforms):
+        if self.restart_index is None:
+            super().draw(primitives=primitives, **uniforms)
+            return
+        state.enable(GL.GL_PRIMITIVE_RESTART)
+        GL.glPrimitiveRestartIndex(self.restart_index)
+        super().draw(primitives=GL.GL_TRIANGLE_STRIP, **uniforms)
+        state.disable(GL.GL_PRIMITIVE_RESTART)
+
+    def grid(self, attribute):
+        """ [row=z, col=x] view of a per vertex attribute array """
+        return attribute.reshape(*self.grid_shape, -1)
+
+    def deform(self, row, col, heights, add=False):
+        """ set (or add to) the heights of the grid block whose first vertex
+            is [row, col], then update the normals of the block and of its
+            one-ring and upload only the changed rows of the vertex buffers """
+        self.whole_grid('deformations')
+        if not isinstance(self.drawable, (Mesh, DisplacedGrid)):
+            raise ValueError("only the single mesh or displaced terrain can be deformed (no lod or stream)")
+        if not self.vertices.flags.writeable:  # cached arrays are read-only memory maps
+            self.attributes = {name: np.array(array) for name, array in self.attributes.items()}
+            self.vertices = self.attributes['position']
+            self.height_field = HeightField(self.grid(self.vertices)[..., 1], origin=self.vertices[0, [0, 2]])
+        rows, cols = self.grid_shape
+        heights = np.atleast_2d(np.asarray(heights, np.float32))
+        r0, c0 = max(row, 0), max(col, 0)
+        r1, c1 = min(row + heights.shape[0], rows), min(col + heights.shape[1], cols)
+        if r0 >= r1 or c0 >= c1:
+            return
+        block = heights[r0 - row:r1 - row, c0 - col:c1 - col]
+        y = self.grid(self.vertices)[r0:r1, c0:c1, 1]
+        y[...] = y + block if add else block
+        bounds = getattr(self.drawable, 'bounds', None)
+        if bounds is not None:  # grow the culling box, never shrink it
+            bounds[0][1], bounds[1][1] = min(bounds[0][1], y.min()), max(bounds[1][1], y.max())
+            Node.revision += 1
+
+        # vertices whose normal changes, and the vertices of the faces around them
+        n0, n1, m0, m1 = max(r0 - 1, 0), min(r1 + 1, rows), max(c0 - 1, 0), min(c1 + 1, cols)
+        s0, s1, t0, t1 = max(n0 - 1, 0), min(n1 + 1, rows), max(m0 - 1, 0), min(m1 + 1, cols)
+        local = lambda name: self.grid(self.attributes[name])[s0:s1, t0:t1].reshape((s1 - s0) * (t1 - t0), -1)
+        inner = lambda array: array.reshape(s1 - s0, t1 - t0, -1)[n0 - s0:n1 - s0, m0 - t0:m1 - t0]
+        index = generate_indices(t1 - t0, s1 - s0)
+        normals = calc_normals(local('position'), index)
+        self.grid(self.attributes['normal'])[n0:n1, m0:m1] = inner(normals)
+        if 'tangent' in self.attributes:
+            tangents, _ = generate_tangents(local('position'), index, local('tex_coord'), normals)
+            self.grid(self.attributes['tangent'])[n0:n1, m0:m1] = inner(tangents)
+
+        if isinstance(self.drawable, DisplacedGrid):  # heights and normals live in the texture
+            self.drawable.heights.update(n0, m0, self.grid(self.vertices)[n0:n1, m0:m1, 1],
+                                         self.grid(self.attributes['normal'])[n0:n1, m0:m1])
+            return
+        self.upload('position', r0, r1, c0, c1)
+        for name in ('normal', 'tangent'):
+            if name in self.attributes:
+                self.upload(name, n0, n1, m0, m1)
+
+    def deform_around(self, x, z, radius, amount):
+        """ raise (amount > 0, e.g. lava build-up) or dig (amount < 0, e.g. a
+            crater) the terrain around world position (x, z), smoothly
+            fading to nothing at 'radius' """
+        origin = self.whole_grid('deformations')[0, [0, 2]]
+        col, row = int(np.floor(x - origin[0] - radius)), int(np.floor(z - origin[1] - radius))
+        size = int(np.ceil(2 * radius)) + 2
+        dz, dx = np.meshgrid(row + np.arange(size) - (z - origin[1]), col + np.arange(size) - (x - origin[0]), indexing='ij')
+        falloff = np.clip(1 - (dx**2 + dz**2) / radius**2, 0, 1)**2
+        self.deform(row, col, amount * falloff, add=True)
+
+    def upload(self, name, r0, r1, c0, c1):
+        """ send the [r0:r1, c0:c1] block of a vertex attribute to its buffer """
+        cols, array = self.grid_shape[1], self.attributes[name]
+        if c1 - c0 == cols:  # whole rows are one contiguous range
+            spans = [(r0 * cols, r1 * cols)]
+        else:
+            spans = [(r * cols + c0, r * cols + c1) for r in range(r0, r1)]
+        for start, end in spans:
+            self.drawable.vertex_array.update(name, array[start:end], start)
+
+    def whole_grid(self, operation):
+        """ vertices of the grid, or ValueError for a streamed terrain """
+        if self.vertices is None:
+            raise ValueError(f"{operation} need the whole grid, a streamed terrain only has the tiles around the camera")
+        return self.vertices
+
     def getVertices (self):
-        return self.vertices 
+        return self.whole_grid('vertex positions')
+
+    def height_at(self, x, z):
+        """ bilinear terrain height under world position (x, z) """
+        self.whole_grid('height queries')
+        return self.height_field.height_at(x, z)
+
+    def sample_many(self, points):
+        """ terrain heights (N,) and normals (N,3) under (N,2) x,z or (N,3) points """
+        self.whole_grid('height queries')
+        return self.height_field.sample_many(points)
  
 
-def generate_height_map(width, height, heightmap_file):
-    MIN_HEIGHT = -64
-    MAX_HEIGHT = 64
+class TerrainTiles:
+    """ Terrain split in quadtree tiles, drawn at the level of detail that the
+        view and projection of each pass require. Tile meshes are built the
+        first time they are selected, skirts hide the cracks between levels """
+    def __init__(self, shader, grids, tile_size=32, pixel_error=2.0, layout=None, **uniforms):
+        self.shader = shader
+        self.uniforms = uniforms
+        self.layout = layout
+        self.grids = grids   # (rows, cols, size) array per vertex attribute
+        positions = grids['position']
+        self.tree = TerrainQuadTree(positions[..., 1], tile_size, origin=(positions[0, 0, 0], positions[0, 0, 2]))
+        self.tile_size = tile_size
+        self.pixel_error = pixel_error
+        self.indices = tile_indices(tile_size)
+        self.meshes = {}
+        self.nb_tiles = 0   # tiles drawn by the last pass
+
+    def tile_mesh(self, node):
+        if node not in self.meshes:
+            rows, cols = self.tree.tile_samples(*node)
+            attributes = {name: tile_attribute(grid, rows, cols, self.tile_size) for name, grid in self.grids.items()}
+            attributes['position'][(self.tile_size + 1)**2:, 1] -= self.tree.skirt_depth
+            self.meshes[node] = Mesh(self.shader, attributes=attributes, index=self.indices,
+                                     layout=self.layout, **self.uniforms)
+        return self.meshes[node]
+
+    def draw(self, primitives=GL.GL_TRIANGLES, view=None, projection=None, **uniforms):
+        # the terrain is never moved, so the eye and frustum can be taken straight from view & projection
+        eye = np.linalg.inv(view)[:3, 3]
+        planes = frustum_planes(projection @ view)
+        scale, perspective = lod_scale(projection, state.viewport_size()[1])
+        nodes = self.tree.select(eye, scale, self.pixel_error, perspective,
+                                 cull=lambda bmin, bmax: aabb_in_frustum(planes, bmin, bmax))
+        for node in nodes:
+            self.tile_mesh(node).draw(primitives, view=view, projection=projection, **uniforms)
+        self.nb_tiles = len(nodes)
+
+
+class DisplacedGrid:
+    """ Terrain drawn as instances of one flat patch of patch_size quads,
+        the vertex shader (texture_terrain_displaced.vert) fetches heights
+        and normals of every grid vertex from a HeightTexture """
+    def __init__(self, shader, heights, patch_size=64, origin=(0.0, 0.0), **uniforms):
+        self.shader = shader
+        self.heights = heights
+        rows, cols = heights.shape
+        patches = (-(-(rows - 1) // patch_size), -(-(cols - 1) // patch_size))
+        self.nb_instances = patches[0] * patches[1]
+        self.uniforms = shader.prepare(dict(uniforms, patch_size=patch_size, patches_x=patches[1],
+                                            grid_origin=origin))
+        z, x = np.meshgrid(np.arange(patch_size + 1), np.arange(patch_size + 1), indexing='ij')
+        grid_coord = np.stack((x, z), axis=-1).reshape(-1, 2).astype(np.float32)
+        self.vertex_array = VertexArray(shader, dict(grid_coord=grid_coord), tile_indices(patch_size, skirt=False))
+
+    def draw(self, primitives=GL.GL_TRIANGLES, **uniforms):
+        state.use_program(self.shader.glid)
+        self.shader.set_uniforms(uniforms, self.uniforms)
+        state.bind_vertex_array(self.vertex_array.glid)
+        count, index_type, _ = self.vertex_array.arguments
+        GL.glDrawElementsInstanced(primitives, count, index_type, None, self.nb_instances)
+        VertexArray.count_draw(primitives, count, self.nb_instances)
+
+
+class StreamingTiles:
+    """ Draws the tiles that a TileStreamer keeps resident around the camera.
+        Tile meshes are created and deleted here, on the GL thread, as the
+        streamer reports loaded and evicted tiles """
+    def __init__(self, shader, streamer, camera, **uniforms):
+        self.shader = shader
+        self.uniforms = uniforms
+        self.streamer = streamer
+        self.camera = camera
+        self.indices = streamer.field.tile_indices()
+        self.meshes = {}    # tile key -> (mesh, bmin, bmax)
+        self.last_position = None
+
+    def update(self):
+        position = tuple(self.camera.position)
+        if position != self.last_position:
+            self.streamer.update(position)
+            self.last_position = position
+        for event, key, arrays in self.streamer.poll():
+            if event == 'load':
+                positions = arrays['position']
+                mesh = Mesh(self.shader, attributes=arrays, index=self.indices, **self.uniforms)
+                self.meshes[key] = (mesh, positions.min(axis=0), positions.max(axis=0))
+            else:
+                self.meshes.pop(key, None)   # GL objects freed with the mesh
+
+    def draw(self, primitives=GL.GL_TRIANGLES, view=None, projection=None, **uniforms):
+        self.update()
+        planes = frustum_planes(projection @ view)
+        for mesh, bmin, bmax in self.meshes.values():
+            if aabb_in_frustum(planes, bmin, bmax):
+                mesh.draw(primitives, view=view, projection=projection, **uniforms)
 
+
+def generate_mesh_arrays(width, height, heightmap_file, tangents=False, max_error=None):
+    """ positions, normals, texcoords, triangle indices and optionally tangents of the terrain grid,
+        triangles simplified down to max_error vertical error if given (normals keep full detail) """
+    height_map = generate_height_map(width, height, heightmap_file)
+    vertices = generate_vertices(width, height, height_map)
+    indices = generate_indices(width, height)
+    arrays = dict(position=vertices, normal=calc_normals(vertices, indices),
+                  tex_coord=generate_texcoords(width, height), index=indices)
+    if tangents:
+        arrays['tangent'], _ = generate_tangents(vertices, indices, arrays['tex_coord'], arrays['normal'])
+    if max_error is not None:
+        arrays['index'] = generate_simplified_indices(width, height, vertices[:, 1].reshape(height, width), max_error)
+    return arrays
+
+
+def generate_height_map(width, height, heightmap_file):
     im = Image.open(heightmap_file) 
     
-    heightmap = im.convert("L")  # convert to grayscale
-    
-    noise_map = np.zeros((height, width))
-    
-    for z in range(min(heightmap.height, height)):
-        for x in range(min(heightmap.width, width)):
-            noise_map[z,x] = np.interp(heightmap.getpixel((z,x)), [0,255], [MIN_HEIGHT,MAX_HEIGHT]) #map height map value    
-    return noise_map
+    # decode the grayscale image straight to an array, transposed so that it is indexed [z,x] like before
+    heightmap = np.asarray(im.convert("L"), dtype=np.float64).T
+    if heightmap.shape != (height, width):
+        heightmap = resample_bilinear(heightmap, height, width)
+
+    # map height map value from [0,255] to [MIN_HEIGHT,MAX_HEIGHT] in one go
+    return heightmap * ((MAX_HEIGHT - MIN_HEIGHT) / 255) + MIN_HEIGHT
+
+
+def resample_bilinear(grid, rows, cols):
+    """ bilinear resampling of a 2D array to shape (rows, cols), corners stay aligned """
+    src_rows, src_cols = grid.shape
+    r = np.linspace(0, src_rows - 1, rows)
+    c = np.linspace(0, src_cols - 1, cols)
+    r0 = np.clip(r.astype(np.intp), 0, max(src_rows - 2, 0))
+    c0 = np.clip(c.astype(np.intp), 0, max(src_cols - 2, 0))
+    r1 = np.minimum(r0 + 1, src_rows - 1)
+    c1 = np.minimum(c0 + 1, src_cols - 1)
+    fr = (r - r0)[:, None]
+    fc = (c - c0)[None, :]
+    top = grid[r0][:, c0] * (1 - fc) + grid[r0][:, c1] * fc
+    bottom = grid[r1][:, c0] * (1 - fc) + grid[r1][:, c1] * fc
+    return top * (1 - fr) + bottom * fr
 
 
 def generate_vertices(width, height, noise_map): #à récup pour les coord de chaque point de la grille
-    v = []
-    for z in range(0,height): 
-        for x in range(0,width):
-            v.append((-height/2 + x, noise_map[x,z], -width/2 + z))   
-    return np.asarray(v)
-
-def generate_indices(width, height):
-    indices = []
-    
-    for z in range(0,height): 
-        for x in range(0,width):
-            pos = x + z*width
-            
-            if (x == width - 1 or z == height - 1):
-                # Don't create indices for right or top edge
-                continue
-            else:
-                # Bottom left triangle of square
-                indices.append(pos)
-                indices.append(pos + width)
-                indices.append(pos + width + 1)
-                # Top right triangle of square
-                indices.append(pos + 1 + width)
-                indices.append(pos + 1)
-                indices.append(pos)
-    
-    return np.asarray(indices)
+    # vertex (x,z) is stored at row z*width + x, with its height read from noise_map[x,z]
+    z, x = np.meshgrid(np.arange(height), np.arange(width), indexing='ij')
+    v = np.empty((height, width, 3), np.float32)
+    v[..., 0] = -height/2 + x
+    v[..., 1] = noise_map[x, z]
+    v[..., 2] = -width/2 + z
+    return v.reshape(-1, 3)
+
+def index_dtype(nb_vertices, restart=False):
+    """ smallest GL index type able to address nb_vertices (+ a restart value) """
+    return np.uint16 if nb_vertices + restart <= 1 << 16 else np.uint32
+
+def generate_indices(width, height, dtype=None):
+    dtype = dtype or index_dtype(width*height)
+    # one quad per grid cell, except on the right and top edges
+    pos = (np.arange(height - 1)[:, None] * width + np.arange(width - 1)).ravel()
+    indices = np.empty((pos.size, 6), dtype)
+    indices[:, 0] = pos                  # Bottom left triangle of square
+    indices[:, 1] = pos + width
+    indices[:, 2] = pos + width + 1
+    indices[:, 3] = pos + width + 1      # Top right triangle of square
+    indices[:, 4] = pos + 1
+    indices[:, 5] = pos
+    return indices.ravel()
+
+def generate_simplified_indices(width, height, heights, max_error, dtype=None):
+    """ triangles of a right triangulated irregular network (RTIN) of the grid:
+        starting from the two halves of the map, triangles are split in two
+        along their hypotenuse only while the height of its middle vertex
+        (or of any finer split below it) is more than max_error away from
+        the hypotenuse. Crack free, needs a square grid of 2^k+1 vertices """
+    size = width - 1
+    if width != height or size < 2 or size & (size - 1):
+        raise ValueError(f"terrain simplification needs a square 2^k+1 grid, not {width}x{height}")
+    dtype = dtype or index_dtype(width*height)
+    heights = np.asarray(heights).ravel()
+    vertex = lambda p: p[:, 1] * width + p[:, 0]   # grid (x, z) to vertex index
+    children = lambda a, b, c, m: np.concatenate((np.stack((c, a, m), 1), np.stack((b, c, m), 1)))
+
+    # every level of the triangle tree as (N, 3, 2) arrays of a, b, c with hypotenuse a-b
+    levels = [np.array([[(0, 0), (size, size), (size, 0)], [(size, size), (0, 0), (0, size)]])]
+    while not np.any((levels[-1][0, 0] - levels[-1][0, 2]) % 2):  # down to the triangles over 2 quads
+        a, b, c = np.moveaxis(levels[-1], 1, 0)
+        levels.append(children(a, b, c, (a + b) // 2))
+
+    # error of each split vertex, finest levels first so parents include their children
+    errors = np.zeros(width * height, np.float32)
+    for level, triangles in reversed(list(enumerate(levels))):
+        a, b, c = np.moveaxis(triangles, 1, 0)
+        middle = vertex((a + b) // 2)
+        error = np.abs((heights[vertex(a)] + heights[vertex(b)]) / 2 - heights[middle])
+        if level < len(levels) - 1:
+            error = np.maximum.reduce([error, errors[vertex((a + c) // 2)], errors[vertex((b + c) // 2)]])
+        np.maximum.at(errors, middle, error)
+
+    # keep splitting from the root while the error is over budget, quad halves can't split
+    triangles, kept = levels[0], []
+    while len(triangles):
+        a, b, c = np.moveaxis(triangles, 1, 0)
+        split = np.abs(a - c).sum(axis=1) > 1
+        split[split] = errors[vertex((a[split] + b[split]) // 2)] > max_error
+        kept.append(triangles[~split])
+        a, b, c = a[split], b[split], c[split]
+        triangles = children(a, b, c, (a + b) // 2)
+    triangles = np.concatenate(kept)
+
+    # same winding as generate_indices (normals up)
+    a, b, c = np.moveaxis(triangles, 1, 0)
+    ab, ac = b - a, c - a
+    flip = ab[:, 1] * ac[:, 0] - ab[:, 0] * ac[:, 1] < 0
+    triangles[flip] = triangles[flip][:, [0, 2, 1]]
+    return vertex(triangles.reshape(-1, 2)).astype(dtype)
+
+def generate_strip_indices(width, height, dtype=None):
+    """ same triangles as generate_indices, as one strip per row of quads
+        separated by the max value of dtype (primitive restart index) """
+    dtype = dtype or index_dtype(width*height, restart=True)
+    above = np.arange(height - 1)[:, None] * width + width + np.arange(width)
+    below = above - width
+    strips = np.empty((height - 1, 2*width + 2), dtype)
+    strips[:, 0] = above[:, 0]           # repeated first vertex keeps the winding of generate_indices
+    strips[:, 1:-1:2] = above
+    strips[:, 2:-1:2] = below
+    strips[:, -1] = np.iinfo(dtype).max  # restart index
+    return strips.ravel()[:-1]
+
+def compact_layout(width, height):
+    """ interleaved vertex formats of the grid meshes: unit vectors as
+        normalized int16, texture coordinates (grid units) as half floats
+        as long as they are exact integers """
+    return dict(normal='int16n', tangent='int16n',
+                tex_coord='float16' if max(width, height) <= 2049 else 'float32')
 
 # make sure that the wrap mode is set to repeat !
 def generate_texcoords(width, height):
-    texcoords = []
-    for z in range(0,height): 
-        for x in range(0,width):
-            texcoords.append((x,z))
-    return np.asarray(texcoords)
+    z, x = np.meshgrid(np.arange(height, dtype=np.float32), np.arange(width, dtype=np.float32), indexing='ij')
+    return np.stack((x, z), axis=-1).reshape(-1, 2)
 
 def generate_normals(width, height, position):
 
@@ -104,22 +439,6 @@ def generate_normals(width, height, position):
             normals[x+z*width] = normalized(normal)
     return normals 
 
-def generate_tangents(vertices, indices, texcoords):
-    tangents = np.zeros((len(vertices), 3))
-
-    # reshape the input arrays to be (num_triangles, 3, 3) and (num_triangles, 3, 2)
-    tri_verts = vertices[indices].reshape(-1, 3, 3)
-    tri_uvs = texcoords[indices].reshape(-1, 3, 2)
-    edge_1 = tri_verts[:,1] - tri_verts[:,0]
-    edge_2 = tri_verts[:,2] - tri_verts[:,0]
-    delta_uv1 = tri_uvs[:,1] - tri_uvs[:,0]
-    delta_uv2 = tri_uvs[:,2] - tri_uvs[:,0]
-    f = 1.0 / (delta_uv1[:,0] * delta_uv2[:,1] - delta_uv2[:,0] * delta_uv1[:,1])
-    j=0
-    for i in range(0, len(indices), 3):
-        i1, i2, i3 = indices[i], indices[i+1], indices[i+2]
-        tangents[i1] = f[j] * (delta_uv2[j,1] * edge_1[j] - delta_uv1[j,1] * edge_2[j])
-        tangents[i2] = tangents[i1]
-        tangents[i3] = tangents[i1]
-        j = j + 1
-    return tangents
\ No newline at end of file
+def generate_tangents(vertices, indices, texcoords, normals):
+    """ unit tangents and bitangents of the grid, see transform.calc_tangents """
+    return calc_tangents(vertices, indices, texcoords, normals)
@@ -0,0 +1,80 @@
+"""
+On disk cache of the terrain mesh arrays (positions, normals, texcoords and
+indices), so that warm starts skip heightmap decoding, grid generation and
+normal computation. Each build is stored as .npy files in a directory named
+after a hash of the heightmap bytes and of the build parameters, and loaded
+back memory-mapped (no copy before the upload to the GPU).
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+import numpy as np
+
+CACHE_VERSION = 1   # bump when the layout of the cached arrays changes
+
+
+class TerrainCache:
+    """ Directory of cached terrain builds, least recently used evicted first """
+    def __init__(self, path, max_bytes=256 * 2**20):
+        self.path = path
+        self.max_bytes = max_bytes
+
+    def key(self, heightmap_file, *params):
+        """ hash of the heightmap content and of the build parameters """
+        digest = hashlib.sha1(repr((CACHE_VERSION, params)).encode())
+        with open(heightmap_file, 'rb') as file:
+            digest.update(file.read())
+        return digest.hexdigest()
+
+    def load(self, key):
+        """ dict of memory-mapped arrays stored under key, None if missing """
+        entry = os.path.join(self.path, key)
+        if not os.path.isdir(entry):
+            return None
+        try:
+            arrays = {name[:-4]: np.load(os.path.join(entry, name), mmap_mode='r')
+                      for name in os.listdir(entry) if name.endswith('.npy')}
+        except (OSError, ValueError):   # truncated or corrupted entry
+            self.invalidate(key)
+            return None
+        os.utime(entry)  # mark as recently used
+        return arrays
+
+    def store(self, key, arrays):
+        """ write all arrays under key, then evict old entries over max_bytes """
+        os.makedirs(self.path, exist_ok=True)
+        # write to a temporary directory first so that readers never see half an entry
+        tmp = tempfile.mkdtemp(dir=self.path, prefix='.tmp-')
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp, name + '.npy'), np.ascontiguousarray(array))
+        self.invalidate(key)
+        os.replace(tmp, os.path.join(self.path, key))
+        self.evict(keep=key)
+
+    def invalidate(self, key=None):
+        """ remove one entry, or the whole cache if no key is given """
+        shutil.rmtree(os.path.join(self.path, key) if key else self.path, ignore_errors=True)
+
+    def entries(self):
+        """ (last use time, size in bytes, key) of cached entries, oldest first """
+        entries = []
+        if os.path.isdir(self.path):
+            for key in os.listdir(self.path):
+                entry = os.path.join(self.path, key)
+                if key.startswith('.') or not os.path.isdir(entry):
+                    continue
+                size = sum(os.path.getsize(os.path.join(entry, name)) for name in os.listdir(entry))
+                entries.append((os.path.getmtime(entry), size, key))
+        return sorted(entries)
+
+    def evict(self, keep=None):
+        """ drop least recently used entries until the cache fits in max_bytes """
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            if key != keep:
+                self.invalidate(key)
+                total -= size
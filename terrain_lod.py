@@ -0,0 +1,152 @@
+"""
+Quadtree level of detail selection for height field terrains (CDLOD-like).
+Pure numpy: no OpenGL here, terrain.py builds and draws the tile meshes.
+
+The height grid is indexed [row, col] = [z, x] like terrain.generate_vertices.
+Level 0 nodes are the finest tiles (tile_size quads at full resolution), a
+level l node covers tile_size * 2**l quads sampled every 2**l vertices, so
+every tile mesh has the same number of triangles whatever its level.
+"""
+import math
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+class TerrainQuadTree:
+    """ Per level bounding boxes and geometric errors of the terrain tiles """
+    def __init__(self, heights, tile_size=32, origin=(0.0, 0.0), spacing=1.0):
+        self.rows, self.cols = heights.shape
+        self.tile_size = tile_size
+        self.origin = origin      # world (x, z) of grid vertex [0, 0]
+        self.spacing = spacing    # world distance between two grid vertices
+        quads = max(self.rows - 1, self.cols - 1, 1)
+        self.levels = max(math.ceil(math.log2(quads / tile_size)), 0)
+
+        # pad the grid to a power of 2 number of tiles so that blocks align
+        size = tile_size * 2**self.levels + 1
+        padded = np.pad(np.asarray(heights, np.float32),
+                        ((0, size - self.rows), (0, size - self.cols)), mode='edge')
+
+        # min/max height and max vertical error of each node, level by level
+        self.ymin, self.ymax, self.error = [], [], []
+        for level in range(self.levels + 1):
+            stride, block = 2**level, tile_size * 2**level
+            windows = sliding_window_view(padded, (block + 1, block + 1))[::block, ::block]
+            self.ymin.append(windows.min(axis=(2, 3)))
+            self.ymax.append(windows.max(axis=(2, 3)))
+            error = np.abs(padded - upsample(padded[::stride, ::stride], stride))
+            error = sliding_window_view(error, (block + 1, block + 1))[::block, ::block]
+            self.error.append(error.max(axis=(2, 3)))
+            if level > 0:  # a node never looks better than its children
+                children = self.error[level - 1]
+                children = np.maximum.reduce([children[::2, ::2], children[1::2, ::2],
+                                              children[::2, 1::2], children[1::2, 1::2]])
+                self.error[level] = np.maximum(self.error[level], children)
+
+        # skirts hang below tile borders to hide cracks between levels
+        self.skirt_depth = max(float(self.error[-1].max()), 1.0)
+
+    def contains(self, level, i, j):
+        """ True where nodes (level, i, j) cover at least one quad of the grid """
+        block = self.tile_size * 2**level
+        return (i * block < max(self.rows - 1, 1)) & (j * block < max(self.cols - 1, 1))
+
+    def bounds(self, level, i, j):
+        """ world space axis aligned bounding boxes of nodes, skirts included.
+            i and j can be arrays, then boxes are returned as (N,3) arrays """
+        block = self.tile_size * 2**level
+        x0 = self.origin[0] + j * block * self.spacing
+        x1 = self.origin[0] + np.minimum((j + 1) * block, self.cols - 1) * self.spacing
+        z0 = self.origin[1] + i * block * self.spacing
+        z1 = self.origin[1] + np.minimum((i + 1) * block, self.rows - 1) * self.spacing
+        return (np.stack((x0, self.ymin[level][i, j] - self.skirt_depth, z0), axis=-1),
+                np.stack((x1, self.ymax[level][i, j], z1), axis=-1))
+
+    def tile_samples(self, level, i, j):
+        """ grid rows and columns sampled by a node, clamped to the grid """
+        stride, block = 2**level, self.tile_size * 2**level
+        steps = np.arange(self.tile_size + 1) * stride
+        rows = np.minimum(i * block + steps, self.rows - 1)
+        cols = np.minimum(j * block + steps, self.cols - 1)
+        return rows, cols
+
+    def select(self, eye, pixel_scale, pixel_error=2.0, perspective=True, cull=None):
+        """ Returns the (level, i, j) nodes to draw for a camera at 'eye'.
+            A node is refined while its error, projected with pixel_scale
+            (see lod_scale), exceeds pixel_error pixels. Nodes for which
+            the optional cull(bmin, bmax) mask is False are skipped, it
+            receives the (N,3) boxes of all candidate nodes of a level. """
+        eye = np.asarray(eye, np.float64)[:3]
+        selected = []
+        i, j = np.zeros(1, int), np.zeros(1, int)   # the root node
+        for level in range(self.levels, -1, -1):    # one level at a time
+            bmin, bmax = self.bounds(level, i, j)
+            if cull is not None:
+                visible = cull(bmin, bmax)
+                i, j, bmin, bmax = i[visible], j[visible], bmin[visible], bmax[visible]
+            error = self.error[level][i, j] * pixel_scale
+            if perspective:  # distance from the eye to the closest point of the box
+                gap = np.maximum(np.maximum(bmin - eye, eye - bmax), 0)
+                error = error / np.maximum(np.linalg.norm(gap, axis=1), 1e-6)
+            refine = error > pixel_error if level > 0 else np.zeros(i.size, bool)
+            selected.extend((level, int(a), int(b)) for a, b in zip(i[~refine], j[~refine]))
+            # the 4 children of every refined node
+            i = (2 * i[refine][:, None] + (0, 0, 1, 1)).ravel()
+            j = (2 * j[refine][:, None] + (0, 1, 0, 1)).ravel()
+            inside = self.contains(level - 1, i, j)
+            i, j = i[inside], j[inside]
+        return selected
+
+
+def lod_scale(projection, viewport_height):
+    """ pixels per world unit at distance 1 (perspective) or anywhere (ortho)
+        for a projection matrix, and whether it is a perspective projection """
+    perspective = projection[3, 3] == 0
+    return projection[1, 1] * viewport_height / 2, perspective
+
+
+def upsample(coarse, stride):
+    """ linear interpolation of a grid sampled every 'stride' vertices back to full resolution """
+    def axis_weights(n):
+        full = np.arange((n - 1) * stride + 1)
+        lower = np.minimum(full // stride, max(n - 2, 0))
+        return lower, np.minimum(lower + 1, n - 1), (full / stride - lower).astype(np.float32)
+    r0, r1, fr = axis_weights(coarse.shape[0])
+    c0, c1, fc = axis_weights(coarse.shape[1])
+    rows = coarse[r0] * (1 - fr[:, None]) + coarse[r1] * fr[:, None]
+    return rows[:, c0] * (1 - fc) + rows[:, c1] * fc
+
+
+def tile_ring(tile_size):
+    """ vertex indices around the border of a (tile_size+1)^2 tile grid """
+    n, last = tile_size, tile_size + 1
+    steps = np.arange(n)
+    return np.concatenate((steps,                          # first row, left to right
+                           steps * last + n,               # last column, downwards
+                           n * last + n - steps,           # last row, right to left
+                           (n - steps) * last))            # first column, upwards
+
+
+def tile_indices(tile_size, skirt=True):
+    """ triangle indices of a tile grid, with the same layout and winding as
+        terrain.generate_indices, followed by the skirt quads whose vertices
+        are appended after the grid in tile_ring order """
+    width = tile_size + 1
+    pos = (np.arange(tile_size)[:, None] * width + np.arange(tile_size)).ravel()
+    quads = np.stack((pos, pos + width, pos + width + 1,
+                      pos + width + 1, pos + 1, pos), axis=1)
+    dtype = np.uint16 if width * (width + 4) <= 1 << 16 else np.uint32
+    if not skirt:
+        return quads.ravel().astype(dtype)
+    ring = tile_ring(tile_size)
+    below = width * width + np.arange(ring.size)
+    ring_next, below_next = np.roll(ring, -1), np.roll(below, -1)
+    skirts = np.stack((ring, ring_next, below_next,
+                       below_next, below, ring), axis=1)
+    return np.concatenate((quads.ravel(), skirts.ravel())).astype(dtype)
+
+
+def tile_attribute(grid, rows, cols, tile_size):
+    """ per vertex attribute of a tile: grid samples then their skirt copies """
+    samples = grid[rows][:, cols].reshape((tile_size + 1)**2, -1)
+    return np.concatenate((samples, samples[tile_ring(tile_size)]))
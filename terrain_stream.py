@@ -0,0 +1,171 @@
+"""
+Out of core terrain: huge heightmaps are converted once to a tiled float32
+.npy file (plus a .json sidecar), then memory-mapped and streamed around the
+camera by a background thread. Only the tiles near the camera are read and
+turned into mesh arrays, so the resident set stays bounded whatever the size
+of the map. No OpenGL here: the GL thread polls the streamer for tiles to
+upload or delete (see terrain.StreamingTiles).
+
+Each tile holds (tile_size+1)^2 grid vertices plus a 1 vertex apron on every
+side, so that normals are computed the same way on both sides of a border.
+"""
+import json
+import threading
+import queue
+from collections import OrderedDict
+import numpy as np
+from PIL import Image
+
+from terrain_lod import tile_indices
+
+Image.MAX_IMAGE_PIXELS = None   # survey heightmaps are legitimately huge
+
+
+def convert_heightmap(heightmap_file, out_file, tile_size=256, min_height=-64, max_height=64, spacing=1.0):
+    """ convert a grayscale (8 or 16 bits) image to the tiled format, one
+        band of tiles at a time so the whole map never exists as floats """
+    im = Image.open(heightmap_file)
+    if im.mode not in ('I;16', 'I;16B', 'I'):
+        im, max_value = im.convert('L'), 255
+    else:
+        max_value = 65535
+    cols, rows = im.size
+    nb_z, nb_x = -(-(rows - 1) // tile_size), -(-(cols - 1) // tile_size)
+    apron = tile_size + 3
+    tiles = np.lib.format.open_memmap(out_file + '.npy', mode='w+', dtype=np.float32,
+                                      shape=(nb_z, nb_x, apron, apron))
+    # grid column/row read by each tile sample, clamped at the map borders
+    col_index = np.clip(np.arange(nb_x)[:, None] * tile_size - 1 + np.arange(apron), 0, cols - 1)
+    for i in range(nb_z):
+        row_index = np.clip(i * tile_size - 1 + np.arange(apron), 0, rows - 1)
+        band = im.crop((0, int(row_index[0]), cols, int(row_index[-1]) + 1))
+        band = np.asarray(band, np.float32)[row_index - row_index[0]]
+        tiles[i] = np.moveaxis(band[:, col_index], 1, 0) * ((max_height - min_height) / max_value) + min_height
+    tiles.flush()
+    header = dict(rows=rows, cols=cols, tile_size=tile_size, spacing=spacing,
+                  min_height=min_height, max_height=max_height)
+    with open(out_file + '.json', 'w') as file:
+        json.dump(header, file)
+    return TiledHeightField(out_file)
+
+
+class TiledHeightField:
+    """ Read only, memory-mapped access to a converted heightmap """
+    def __init__(self, path):
+        with open(path + '.json') as file:
+            header = json.load(file)
+        self.rows, self.cols = header['rows'], header['cols']
+        self.tile_size, self.spacing = header['tile_size'], header['spacing']
+        self.tiles = np.load(path + '.npy', mmap_mode='r')
+        self.shape = self.tiles.shape[:2]    # number of tiles along z and x
+        # centered on the origin like terrain.generate_vertices
+        self.origin = (-self.cols / 2 * self.spacing, -self.rows / 2 * self.spacing)
+
+    def tiles_around(self, position, radius):
+        """ tiles with any point closer than radius to position (x,y,z),
+            closest first """
+        size = self.tile_size * self.spacing
+        x, z = position[0] - self.origin[0], position[2] - self.origin[1]
+        j = np.arange(max(int((x - radius) // size), 0), min(int((x + radius) // size) + 1, self.shape[1]))
+        i = np.arange(max(int((z - radius) // size), 0), min(int((z + radius) // size) + 1, self.shape[0]))
+        i, j = [a.ravel() for a in np.meshgrid(i, j, indexing='ij')]
+        dx = np.maximum(np.maximum(j * size - x, x - (j + 1) * size), 0)
+        dz = np.maximum(np.maximum(i * size - z, z - (i + 1) * size), 0)
+        distance = np.hypot(dx, dz)
+        order = np.argsort(distance[distance <= radius], kind='stable')
+        near = np.flatnonzero(distance <= radius)[order]
+        return [(int(i[k]), int(j[k])) for k in near]
+
+    def tile_arrays(self, i, j):
+        """ position, normal and tex_coord arrays of the tile mesh, reading
+            (and paging in) only this tile of the file """
+        heights = np.array(self.tiles[i, j])    # copy: the only disk read
+        n, s = self.tile_size, self.spacing
+        dz = (heights[2:, 1:-1] - heights[:-2, 1:-1]) / (2 * s)
+        dx = (heights[1:-1, 2:] - heights[1:-1, :-2]) / (2 * s)
+        normals = np.stack((-dx, np.ones_like(dx), -dz), axis=-1)
+        normals /= np.linalg.norm(normals, axis=-1, keepdims=True)
+        rows, cols = np.meshgrid(i * n + np.arange(n + 1), j * n + np.arange(n + 1), indexing='ij')
+        positions = np.stack((self.origin[0] + cols * s, heights[1:-1, 1:-1],
+                              self.origin[1] + rows * s), axis=-1).astype(np.float32)
+        texcoords = np.stack((cols, rows), axis=-1).astype(np.float32)
+        return dict(position=positions.reshape(-1, 3), normal=normals.reshape(-1, 3),
+                    tex_coord=texcoords.reshape(-1, 2))
+
+    def tile_indices(self):
+        """ triangle indices shared by all the tile meshes """
+        return tile_indices(self.tile_size, skirt=False)
+
+
+class TileStreamer:
+    """ Background thread keeping the tiles around a position resident, with
+        at most max_resident tiles, least recently wanted evicted first.
+        poll() returns what happened since the last call, in order, as
+        ('load', key, arrays) and ('evict', key, None) events. """
+    def __init__(self, field, radius, max_resident=64):
+        self.field = field
+        self.radius = radius
+        self.max_resident = max_resident
+        self.resident = OrderedDict()      # key -> None, in least recently wanted order
+        self.events = queue.Queue()
+        self.position = None
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.idle = threading.Event()
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def update(self, position):
+        """ new camera position, cheap enough to call every frame """
+        with self.lock:
+            self.position = np.array(position[:3], np.float64)
+            self.idle.clear()
+            self.wake.set()
+
+    def poll(self):
+        events = []
+        while not self.events.empty():
+            events.append(self.events.get_nowait())
+        return events
+
+    def wait_idle(self, timeout=None):
+        """ block until the last update has been fully processed """
+        return self.idle.wait(timeout)
+
+    def stop(self):
+        self.running = False
+        self.wake.set()
+        self.thread.join()
+
+    def _run(self):
+        while self.running:
+            self.wake.wait()
+            self.wake.clear()
+            with self.lock:
+                position = self.position
+            if position is None or not self.running:
+                continue
+            wanted = self.field.tiles_around(position, self.radius)[:self.max_resident]
+            for key in reversed(wanted):  # closest tiles become the most recently wanted
+                if key in self.resident:
+                    self.resident.move_to_end(key)
+            for key in wanted:
+                if self.wake.is_set():    # camera moved again, start over from the new position
+                    break
+                if key not in self.resident:
+                    self._evict(keep=set(wanted), room=1)   # evicted before, so the GPU never holds more either
+                    self.events.put(('load', key, self.field.tile_arrays(*key)))
+                    self.resident[key] = None
+            with self.lock:
+                if not self.wake.is_set():
+                    self.idle.set()
+
+    def _evict(self, keep, room=0):
+        """ evict tiles not in keep until room more fit in max_resident """
+        for key in list(self.resident):
+            if len(self.resident) + room <= self.max_resident:
+                break
+            if key not in keep:
+                del self.resident[key]
+                self.events.put(('evict', key, None))
@@ -0,0 +1,36 @@
+""" the modules of the project live at the repository root """
+import os
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+class CountingGL:
+    """ stand-in for GL functions of core, recording their calls instead
+        of making them, for tests that need no GL context """
+    def __init__(self, monkeypatch, gl):
+        self.monkeypatch, self.gl = monkeypatch, gl
+        self.calls = []     # (function name, args) in call order
+
+    def patch(self, *names, result=None):
+        """ record the calls to GL functions 'names', which return 'result' """
+        for name in names:
+            self.monkeypatch.setattr(self.gl, name, self.recorder(name, result))
+
+    def recorder(self, name, result=None):
+        def call(*args):
+            self.calls.append((name, args))
+            return result
+        return call
+
+    def count(self, name):
+        return sum(1 for called, _ in self.calls if called == name)
+
+
+@pytest.fixture
+def counting_gl(monkeypatch):
+    """ CountingGL over the OpenGL.GL module that core uses """
+    return CountingGL(monkeypatch, pytest.importorskip('OpenGL.GL'))
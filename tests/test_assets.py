@@ -0,0 +1,61 @@
+""" AssetLoader: threaded decodes, uploads run by poll() / finish(), no GL needed """
+import pytest
+from PIL import Image
+
+from assets import AssetLoader
+
+
+@pytest.fixture
+def files(tmp_path):
+    names = []
+    for k in range(4):
+        names.append(str(tmp_path / ('image%d.png' % k)))
+        Image.new('RGB', (4 + k, 2), (k, 0, 0)).save(names[-1])
+    return names
+
+
+@pytest.mark.parametrize('threaded', [False, True])
+def test_failed_upload_resolves_its_future_only(files, threaded):
+    loader, uploaded = AssetLoader(), []
+    if threaded:
+        loader.start(workers=2)
+
+    def upload(images):
+        if images[0][0] == 5:
+            raise RuntimeError('no GL')
+        uploaded.append(images[0][0])
+        return images[0][0]
+    results = [loader.load([file], upload) for file in files]
+    loader.finish()
+    assert isinstance(results[1].exception(), RuntimeError)
+    assert [result.result() for k, result in enumerate(results) if k != 1] == [4, 6, 7]
+    assert sorted(uploaded) == [4, 6, 7] and not loader.queue
+
+
+def test_missing_file(files):
+    loader = AssetLoader()
+    loader.start(workers=2)
+    result = loader.load([files[0], files[0] + '.missing'], len)
+    loader.finish()
+    assert isinstance(result.exception(), FileNotFoundError)
+
+
+def test_progress_follows_the_uploads(files):
+    loader, events = AssetLoader(), []
+    loader.start(workers=2, progress=lambda done, total, names: events.append(('progress', done, total)))
+    for file in files:
+        loader.load([file], lambda images: events.append(('upload', images[0][0])))
+    loader.finish()
+    assert [event[0] for event in events] == ['upload', 'progress'] * 4
+    assert [event[1:] for event in events[1::2]] == [(k, 4) for k in range(1, 5)]
+
+
+def test_finish_stops_the_workers(files):
+    loader = AssetLoader()
+    loader.start(workers=2)
+    pool = loader.pool
+    loader.load(files, len)
+    loader.finish()
+    assert loader.pool is None and pool._shutdown
+    later = loader.load(files[:2], len)     # after the first frame: right away
+    assert later.done() and later.result() == 2
@@ -0,0 +1,32 @@
+""" HeightField lookups: one kernel for single and batched queries """
+import numpy as np
+import pytest
+
+from heightfield import HeightField
+
+
+@pytest.fixture
+def field():
+    heights = np.random.default_rng(5).normal(0, 3, (20, 30)).astype(np.float32)
+    return HeightField(heights, origin=(-15.0, -10.0), spacing=1.0)
+
+
+def test_height_at_vertices_and_between(field):
+    assert field.height_at(-15.0, -10.0) == pytest.approx(field.heights[0, 0])
+    assert field.height_at(-12.0, -7.0) == pytest.approx(field.heights[3, 3])
+    middle = field.heights[3:5, 3:5].mean()     # center of a cell: mean of its corners
+    assert field.height_at(-11.5, -6.5) == pytest.approx(middle, rel=1e-5)
+    assert field.height_at(-100.0, 100.0) == pytest.approx(field.heights[-1, 0])  # clamped
+
+
+@pytest.mark.parametrize('gradients', [False, True])
+def test_single_and_batched_queries_agree(field, gradients):
+    field = HeightField(field.heights, origin=field.origin, gradients=gradients)
+    points = np.random.default_rng(1).uniform((-20, -15), (20, 15), (200, 2))
+    heights, normals = field.sample_many(points)
+    singles = [field.height_at(x, z) for x, z in points]
+    assert np.array_equal(np.array(singles, heights.dtype), heights)
+    assert np.array_equal(field.height_at(points[:, 0], points[:, 1]), heights)
+    np.testing.assert_allclose(np.linalg.norm(normals, axis=1), 1, rtol=1e-5)
+    xyz = np.insert(points, 1, 99.0, axis=1)    # (N,3) points: y ignored
+    assert np.array_equal(field.sample_many(xyz)[0], heights)
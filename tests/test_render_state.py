@@ -0,0 +1,256 @@
+""" Redundant GL call elision of core.RenderState and Shader.set_uniforms,
+    checked with a counting GL stand-in: no GL context needed """
+import numpy as np
+import pytest
+
+GL = pytest.importorskip('OpenGL.GL')
+pytest.importorskip('glfw')
+pytest.importorskip('assimpcy')     # imported by core
+
+import core
+
+STATE_CALLS = ('glEnable', 'glDisable', 'glBlendFunc', 'glDepthFunc', 'glUseProgram',
+               'glBindVertexArray', 'glActiveTexture', 'glBindTexture', 'glViewport')
+
+
+@pytest.fixture
+def state(counting_gl):
+    counting_gl.patch(*STATE_CALLS)
+    counting_gl.patch('glGetIntegerv', result=[0, 0, 800, 600])
+    return core.RenderState()
+
+
+def test_capabilities_are_set_once(state, counting_gl):
+    for _ in range(3):
+        state.enable(GL.GL_BLEND)
+    state.disable(GL.GL_BLEND)
+    state.disable(GL.GL_BLEND)
+    state.enable(GL.GL_DEPTH_TEST)
+    assert counting_gl.count('glEnable') == 2 and counting_gl.count('glDisable') == 1
+    assert state.end_frame() == dict(issued=3, elided=3)
+    assert state.end_frame() == dict(issued=0, elided=0)
+
+
+def test_functions_program_and_vertex_array(state, counting_gl):
+    for _ in range(2):
+        state.blend_func(GL.GL_SRC_ALPHA, GL.GL_ONE_MINUS_SRC_ALPHA)
+        state.depth_func(GL.GL_LEQUAL)
+        state.use_program(3)
+        state.bind_vertex_array(7)
+    state.blend_func(GL.GL_ONE, GL.GL_ONE)
+    state.depth_func(GL.GL_LESS)
+    state.use_program(4)
+    state.use_program(3)
+    assert [counting_gl.count(name) for name in ('glBlendFunc', 'glDepthFunc', 'glUseProgram', 'glBindVertexArray')] == [2, 2, 3, 1]
+    assert state.counts == dict(issued=8, elided=4)
+
+
+def test_textures_are_tracked_per_unit_and_target(state, counting_gl):
+    state.bind_texture(GL.GL_TEXTURE_2D, 10, 0)
+    state.bind_texture(GL.GL_TEXTURE_2D, 11, 1)
+    state.bind_texture(GL.GL_TEXTURE_2D, 10, 0)         # unit 0 holds it already
+    state.bind_texture(GL.GL_TEXTURE_2D_ARRAY, 12, 0)   # other target of unit 0
+    state.bind_texture(GL.GL_TEXTURE_2D, 11, 1)
+    binds = [args for name, args in counting_gl.calls if name == 'glBindTexture']
+    assert binds == [(GL.GL_TEXTURE_2D, 10), (GL.GL_TEXTURE_2D, 11), (GL.GL_TEXTURE_2D_ARRAY, 12)]
+    units = [args[0] - GL.GL_TEXTURE0 for name, args in counting_gl.calls if name == 'glActiveTexture']
+    assert units == [0, 1, 0, 1]
+
+
+def test_unknown_active_unit_always_binds(state, counting_gl):
+    state.bind_texture(GL.GL_TEXTURE_2D, 5)
+    state.bind_texture(GL.GL_TEXTURE_2D, 5)
+    assert counting_gl.count('glBindTexture') == 2 and state.counts['elided'] == 0
+
+
+def test_deleted_objects_are_bound_again(state, counting_gl):
+    state.bind_texture(GL.GL_TEXTURE_2D, 9, 2)
+    state.bind_vertex_array(9)
+    state.deleted('texture', 9)             # GL may give name 9 to a new texture
+    state.bind_texture(GL.GL_TEXTURE_2D, 9, 2)
+    state.bind_vertex_array(9)              # vertex arrays are untouched
+    assert counting_gl.count('glBindTexture') == 2 and counting_gl.count('glBindVertexArray') == 1
+
+
+def test_reset_forgets_everything(state, counting_gl):
+    state.enable(GL.GL_CULL_FACE)
+    state.use_program(1)
+    state.reset()
+    state.enable(GL.GL_CULL_FACE)
+    state.use_program(1)
+    assert counting_gl.count('glEnable') == 2 and counting_gl.count('glUseProgram') == 2
+
+
+def test_viewport_is_not_read_back_once_set(state, counting_gl):
+    assert state.viewport_size() == (800, 600)      # unknown: asked to GL once
+    assert state.viewport_size() == (800, 600)
+    assert counting_gl.count('glGetIntegerv') == 1
+    state.viewport(0, 0, 800, 600)                  # same as read back
+    state.viewport(0, 0, 1024, 1024)
+    assert state.viewport_size() == (1024, 1024)
+    assert counting_gl.count('glViewport') == 1 and counting_gl.count('glGetIntegerv') == 1
+
+
+class FakeShader(core.Shader):
+    """ program with uniforms name -> GL type, recording uploads, without GL objects """
+    def __init__(self, counting_gl, **types):
+        self.uniforms, self.dtypes, self.values = {}, {}, {}
+        for location, (name, type_) in enumerate(types.items()):
+            args = [location, 1] + ([True] if type_ == GL.GL_FLOAT_MAT4 else [])
+            self.uniforms[name] = (counting_gl.recorder(name), args)
+            self.dtypes[name] = self.SETTER_DTYPES.get(self.GL_SETTERS[type_], np.float32)
+
+    def __del__(self):
+        pass
+
+
+@pytest.fixture
+def shader(counting_gl):
+    return FakeShader(counting_gl, view=GL.GL_FLOAT_MAT4, k_d=GL.GL_FLOAT_VEC3,
+                      s=GL.GL_FLOAT, diffuse_map=GL.GL_SAMPLER_2D)
+
+
+def uploads(counting_gl):
+    return [name for name, _ in counting_gl.calls]
+
+
+def test_same_values_are_uploaded_once(shader, counting_gl):
+    view = np.identity(4, np.float32)
+    view.flags.writeable = False    # like the cached camera matrices
+    for _ in range(3):
+        shader.set_uniforms(dict(view=view, k_d=(0.8, 0.7, 0.7), s=8, diffuse_map=0, unknown=1))
+    assert uploads(counting_gl) == ['view', 'k_d', 's', 'diffuse_map']
+
+
+def test_equal_new_arrays_are_compared(shader, counting_gl):
+    shader.set_uniforms(dict(view=np.identity(4)))
+    shader.set_uniforms(dict(view=np.identity(4)))          # new but equal array
+    shader.set_uniforms(dict(view=np.identity(4) * 2))
+    assert uploads(counting_gl) == ['view', 'view']
+
+
+def test_arrays_changed_in_place_are_uploaded_again(shader, counting_gl):
+    k_d = np.array((0.1, 0.2, 0.3), np.float32)
+    shader.set_uniforms(dict(k_d=k_d))
+    k_d[0] = 0.5                    # same object, new value
+    shader.set_uniforms(dict(k_d=k_d))
+    shader.set_uniforms(dict(k_d=k_d))
+    assert uploads(counting_gl) == ['k_d', 'k_d']
+    assert counting_gl.calls[-1][1][-1][0] == pytest.approx(0.5)
+
+
+def test_prepared_defaults(shader, counting_gl):
+    material = shader.prepare(dict(k_d=(1, 0.5, 0.25), s=16, diffuse_map=1, other='kept'))
+    assert material['other'] == 'kept'
+    assert material['k_d'].dtype == np.float32 and not material['k_d'].flags.writeable
+    assert material['diffuse_map'].dtype == np.int32
+    for _ in range(2):  # two meshes of the same material
+        shader.set_uniforms(dict(s=4), material)
+    assert uploads(counting_gl) == ['k_d', 's', 'diffuse_map']
+    assert counting_gl.calls[1][1][-1] == np.float32(4)
+
+
+# declared draw state ---------------------------------------------------------
+class FakeMesh:
+    """ drawable recording its draws, with the state it was drawn in """
+    def __init__(self, draws):
+        self.draws = draws
+
+    def draw(self, primitives=None, **uniforms):
+        self.draws.append(dict(core.state.current))
+
+
+@pytest.fixture
+def shared_state(state, monkeypatch):
+    """ the RenderState of the decorators and render queue, counting GL calls """
+    monkeypatch.setattr(core, 'state', state)
+    return state
+
+
+def test_consecutive_textured_draws_set_no_state(shared_state, counting_gl):
+    from texture import Textured
+    draws, texture = [], np.uint32(4)   # frame buffer texture
+    meshes = [Textured(FakeMesh(draws), diffuse_map=texture) for _ in range(2)]
+    meshes[0].draw()
+    calls = len(counting_gl.calls)
+    meshes[1].draw()
+    assert counting_gl.calls[calls:] == []
+    assert draws[1][('enabled', GL.GL_BLEND)] and draws[1]['depth_func'] == GL.GL_LESS
+
+
+def test_each_drawable_sets_the_state_it_declares(shared_state, counting_gl):
+    from texture import Textured, TexturedCube
+    draws = []
+    skybox = TexturedCube(FakeMesh(draws))
+    cloud = Textured(FakeMesh(draws))
+    cloud.render_state = dict(blend=True, cull=False)
+    for drawable in (skybox, cloud):
+        drawable.draw()
+    shared_state.require()                      # then an opaque draw
+    blend, cull = ('enabled', GL.GL_BLEND), ('enabled', GL.GL_CULL_FACE)
+    assert (draws[0][blend], draws[0]['depth_func'], draws[0][cull]) == (False, GL.GL_LEQUAL, True)
+    assert (draws[1][blend], draws[1]['depth_func'], draws[1][cull]) == (True, GL.GL_LESS, False)
+    assert (shared_state.current[blend], shared_state.current[cull]) == (False, True)
+
+
+def test_render_queue_sets_culling_per_entry(shared_state, counting_gl):
+    from texture import Textured
+    draws = []
+    cloud = Textured(FakeMesh(draws))
+    cloud.render_state = dict(blend=True, cull=False)
+    root = core.Node([FakeMesh(draws), cloud])      # cloud drawn last
+    queue = core.RenderQueue(root)
+    for _ in range(2):                              # two passes
+        queue.draw()
+        root.draw()
+    cull = [draw[('enabled', GL.GL_CULL_FACE)] for draw in draws]
+    assert cull == [True, False] * 4
+    # each draw switches blending and culling, the depth function never changes
+    assert counting_gl.count('glEnable') + counting_gl.count('glDisable') == 2 * len(draws)
+    assert counting_gl.count('glDepthFunc') == 1
+
+
+# uniform uploads of a real Shader and Mesh ------------------------------------
+PROGRAM_UNIFORMS = [(b'model', GL.GL_FLOAT_MAT4), (b'view', GL.GL_FLOAT_MAT4), (b'k_d', GL.GL_FLOAT_VEC3),
+                    (b's', GL.GL_FLOAT), (b'diffuse_map', GL.GL_SAMPLER_2D)]
+
+
+@pytest.fixture
+def mesh(counting_gl, monkeypatch):
+    """ Mesh of a core.Shader built and introspected through recorded GL calls """
+    counting_gl.patch('glCreateShader', 'glCreateProgram', 'glGetShaderiv', 'glGenVertexArrays', 'glGenBuffers', result=1)
+    counting_gl.patch('glGetAttribLocation', result=0)
+    counting_gl.patch('glGetUniformBlockIndex', result=GL.GL_INVALID_INDEX)
+    counting_gl.patch('glShaderSource', 'glCompileShader', 'glAttachShader', 'glLinkProgram', 'glDeleteShader',
+                      'glDeleteProgram', 'glUseProgram', 'glBindVertexArray', 'glBindBuffer', 'glBufferData',
+                      'glEnableVertexAttribArray', 'glVertexAttribPointer', 'glDrawElements',
+                      'glDeleteVertexArrays', 'glDeleteBuffers')
+    monkeypatch.setattr(GL, 'glGetProgramiv', lambda glid, name: len(PROGRAM_UNIFORMS) if name == GL.GL_ACTIVE_UNIFORMS else 1)
+    monkeypatch.setattr(GL, 'glGetActiveUniform', lambda glid, k: (PROGRAM_UNIFORMS[k][0], 1, PROGRAM_UNIFORMS[k][1]))
+    monkeypatch.setattr(GL, 'glGetUniformLocation', lambda glid, name: [n.decode() for n, _ in PROGRAM_UNIFORMS].index(name))
+    for type_, setter in list(core.Shader.GL_SETTERS.items()):     # setters are looked up once, at import
+        recorder = counting_gl.recorder(setter.__name__)
+        monkeypatch.setitem(core.Shader.GL_SETTERS, type_, recorder)
+        if setter in core.Shader.SETTER_DTYPES:
+            monkeypatch.setitem(core.Shader.SETTER_DTYPES, recorder, core.Shader.SETTER_DTYPES[setter])
+    monkeypatch.setattr(core, 'state', core.RenderState())
+    shader = core.Shader('void main() {}', 'void main() {}')
+    return core.Mesh(shader, dict(position=np.zeros((3, 3))), index=np.arange(3, dtype=np.uint32),
+                     k_d=(0.8, 0.7, 0.7), s=8, diffuse_map=0)
+
+
+def test_second_frame_uploads_no_unchanged_uniform(mesh, counting_gl):
+    view = np.identity(4, np.float32)
+    view.flags.writeable = False    # like the cached camera matrices
+    frames = []
+    for _ in range(2):
+        start = len(counting_gl.calls)
+        mesh.draw(model=np.identity(4, np.float32), view=view)     # new but equal model matrix
+        frames.append([name for name, _ in counting_gl.calls[start:] if name.startswith('glUniform')])
+    assert sorted(frames[0]) == sorted(['glUniformMatrix4fv', 'glUniformMatrix4fv', 'glUniform3fv',
+                                        'glUniform1fv', 'glUniform1iv'])
+    assert frames[1] == []
+    assert counting_gl.count('glDrawElements') == 2
+
+    mesh.draw(model=np.identity(4, np.float32) * 2, view=view)      # moved: model only
+    assert [name for name, _ in counting_gl.calls if name.startswith('glUniform')][5:] == ['glUniformMatrix4fv']
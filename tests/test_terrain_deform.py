@@ -0,0 +1,104 @@
+""" Terrain.deform on the compact (interleaved int16n) vertex layout: the
+    records uploaded by VertexArray.update against normals and tangents of
+    the whole deformed grid. GL calls are recorded, no GL context needed """
+import numpy as np
+import pytest
+
+GL = pytest.importorskip('OpenGL.GL')
+pytest.importorskip('glfw')
+pytest.importorskip('assimpcy')     # imported by core
+
+import core
+from heightfield import HeightField
+from terrain import (Terrain, compact_layout, generate_vertices, generate_indices,
+                     generate_texcoords, generate_tangents)
+from transform import calc_normals
+
+WIDTH, HEIGHT = 40, 30
+
+
+class Shader:
+    """ program stand-in: every attribute is used, no uniform """
+    glid = 1
+
+    @staticmethod
+    def prepare(uniforms):
+        return dict(uniforms)
+
+
+class Buffer:
+    """ contents of the GL buffer of the interleaved vertices, rebuilt from
+        the recorded glBufferData and glBufferSubData calls """
+    def __init__(self, counting_gl):
+        self.data, self.uploaded = None, 0
+        counting_gl.monkeypatch.setattr(GL, 'glBufferData', self.buffer_data)
+        counting_gl.monkeypatch.setattr(GL, 'glBufferSubData', self.buffer_sub_data)
+
+    def buffer_data(self, target, data, usage):
+        if target == GL.GL_ARRAY_BUFFER:
+            self.data = np.array(data, np.uint8)
+
+    def buffer_sub_data(self, target, offset, data):
+        data = np.asarray(data).view(np.uint8).ravel()
+        self.data[offset:offset + data.size] = data
+        self.uploaded += data.size
+
+
+@pytest.fixture
+def terrain(counting_gl, monkeypatch):
+    counting_gl.patch('glGenVertexArrays', 'glGenBuffers', result=1)
+    counting_gl.patch('glGetAttribLocation', result=0)
+    counting_gl.patch('glBindVertexArray', 'glBindBuffer', 'glEnableVertexAttribArray',
+                      'glVertexAttribPointer', 'glDeleteVertexArrays', 'glDeleteBuffers')
+    monkeypatch.setattr(core, 'state', core.RenderState())
+    buffer = Buffer(counting_gl)
+
+    z, x = np.meshgrid(np.arange(HEIGHT), np.arange(WIDTH), indexing='ij')
+    heights = (5 * np.sin(x / 4.0) * np.cos(z / 6.0)).T     # generate_vertices reads [x, z]
+    vertices = generate_vertices(WIDTH, HEIGHT, heights)
+    index = generate_indices(WIDTH, HEIGHT)
+    texcoords = generate_texcoords(WIDTH, HEIGHT)
+    normals = calc_normals(vertices, index)
+    attributes = dict(position=vertices, normal=normals, tex_coord=texcoords,
+                      tangent=generate_tangents(vertices, index, texcoords, normals)[0])
+    mesh = core.Mesh(Shader(), attributes, index=index, layout=compact_layout(WIDTH, HEIGHT))
+
+    # the state Terrain.__init__ leaves for a single mesh, without its textures
+    terrain = Terrain.__new__(Terrain)
+    terrain.drawable, terrain.attributes, terrain.grid_shape = mesh, attributes, (HEIGHT, WIDTH)
+    terrain.vertices = attributes['position']
+    terrain.height_field = HeightField(terrain.grid(terrain.vertices)[..., 1], origin=terrain.vertices[0, [0, 2]])
+    return terrain, buffer
+
+
+def test_compact_layout_is_used(terrain):
+    terrain, buffer = terrain
+    records = terrain.drawable.vertex_array.vertices
+    assert records.dtype['normal'].base == records.dtype['tangent'].base == np.int16
+    assert records.dtype['tex_coord'].base == np.float16
+    assert buffer.data.size == records.nbytes < terrain.drawable.vertex_array.float32_nbytes
+
+
+def test_deform_uploads_the_records_of_the_whole_grid(terrain):
+    terrain, buffer = terrain
+    terrain.deform_around(3.0, -2.5, 4, 6.0)    # a hill in the middle
+    terrain.deform(-3, WIDTH - 5, np.full((8, 8), -2.0), add=True)     # clipped on a corner
+    assert 0 < buffer.uploaded < buffer.data.size / 2   # only the changed rows
+
+    # CPU attributes: as if computed from scratch on the deformed grid
+    vertices, attributes = terrain.vertices, terrain.attributes
+    index = generate_indices(WIDTH, HEIGHT)
+    normals = calc_normals(vertices, index)
+    tangents, _ = generate_tangents(vertices, index, attributes['tex_coord'], normals)
+    np.testing.assert_allclose(attributes['normal'], normals, atol=1e-5)
+    np.testing.assert_allclose(attributes['tangent'], tangents, atol=1e-5)
+
+    # GPU records: what the vertex buffer holds after the partial uploads
+    records = terrain.drawable.vertex_array.vertices
+    uploaded = buffer.data.view(records.dtype)
+    assert (uploaded == records).all()
+    assert (uploaded['position'] == vertices).all()
+    for name, expected in (('normal', normals), ('tangent', tangents)):
+        quantized = core.VertexArray.convert(expected, 'int16n').astype(int)
+        assert np.abs(uploaded[name].astype(int) - quantized).max() <= 1     # rounding of equal floats
+        np.testing.assert_allclose(uploaded[name] / 32767, expected, atol=1e-4)
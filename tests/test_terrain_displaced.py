@@ -0,0 +1,103 @@
+""" Displaced terrain (one instanced flat patch, heights and normals fetched
+    from a texture) against the baked terrain mesh, both rendered offscreen
+    and compared pixel per pixel. Needs an OpenGL 3.3 context, e.g. Mesa
+    llvmpipe: LIBGL_ALWAYS_SOFTWARE=1 python -m pytest tests """
+import os
+import numpy as np
+import pytest
+
+GL = pytest.importorskip('OpenGL.GL')
+glfw = pytest.importorskip('glfw')
+pytest.importorskip('assimpcy')     # imported by core
+
+import core
+from texture import Textured, HeightTexture
+from terrain import (DisplacedGrid, DISPLACED_VERTEX_SHADER, generate_vertices,
+                     generate_indices, generate_texcoords)
+from transform import calc_normals, lookat, perspective, identity
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SIZE = 160              # pixels of the rendered images
+WIDTH = HEIGHT = 65     # grid vertices, not a multiple of the patch size
+
+# shading from the interpolated normal only, the same for both vertex stages
+NORMAL_FRAGMENT = """#version 330 core
+in vec3 w_normal;
+out vec4 out_color;
+void main() {
+    out_color = vec4(normalize(w_normal) * 0.5 + 0.5, 1.0);
+}
+"""
+
+
+@pytest.fixture(scope='module')
+def context():
+    glfw.window_hint(glfw.CONTEXT_VERSION_MAJOR, 3)
+    glfw.window_hint(glfw.CONTEXT_VERSION_MINOR, 3)
+    glfw.window_hint(glfw.OPENGL_FORWARD_COMPAT, GL.GL_TRUE)
+    glfw.window_hint(glfw.OPENGL_PROFILE, glfw.OPENGL_CORE_PROFILE)
+    glfw.window_hint(glfw.VISIBLE, False)
+    if core.HEADLESS:
+        glfw.window_hint(glfw.CONTEXT_CREATION_API, glfw.EGL_CONTEXT_API)
+    try:
+        win = glfw.create_window(SIZE, SIZE, 'test', None, None)
+    except glfw.GLFWError:
+        win = None
+    if not win:
+        pytest.skip('no OpenGL 3.3 context')
+    glfw.make_context_current(win)
+    core.state.reset()
+    yield win
+    glfw.destroy_window(win)
+
+
+def render(drawable, **uniforms):
+    """ RGBA8 image of drawable, drawn in an offscreen framebuffer """
+    fbo = GL.glGenFramebuffers(1)
+    GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, fbo)
+    color, depth = GL.glGenRenderbuffers(2)
+    for buffer, storage, attachment in ((color, GL.GL_RGBA8, GL.GL_COLOR_ATTACHMENT0),
+                                        (depth, GL.GL_DEPTH_COMPONENT24, GL.GL_DEPTH_ATTACHMENT)):
+        GL.glBindRenderbuffer(GL.GL_RENDERBUFFER, buffer)
+        GL.glRenderbufferStorage(GL.GL_RENDERBUFFER, storage, SIZE, SIZE)
+        GL.glFramebufferRenderbuffer(GL.GL_FRAMEBUFFER, attachment, GL.GL_RENDERBUFFER, buffer)
+    assert GL.glCheckFramebufferStatus(GL.GL_FRAMEBUFFER) == GL.GL_FRAMEBUFFER_COMPLETE
+    GL.glViewport(0, 0, SIZE, SIZE)
+    GL.glClearColor(0, 0, 0, 0)
+    GL.glClear(GL.GL_COLOR_BUFFER_BIT | GL.GL_DEPTH_BUFFER_BIT)
+    core.state.enable(GL.GL_DEPTH_TEST)
+    core.state.enable(GL.GL_CULL_FACE)   # as in the viewer: checks the winding too
+    drawable.draw(**uniforms)
+    pixels = GL.glReadPixels(0, 0, SIZE, SIZE, GL.GL_RGBA, GL.GL_UNSIGNED_BYTE)
+    GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, 0)
+    GL.glDeleteRenderbuffers(2, [color, depth])
+    GL.glDeleteFramebuffers(1, [fbo])
+    return np.frombuffer(pixels, np.uint8).reshape(SIZE, SIZE, 4)
+
+
+def test_displaced_matches_baked(context):
+    # smooth hills, indexed [x, z] like generate_height_map
+    x, z = np.meshgrid(np.arange(WIDTH), np.arange(HEIGHT), indexing='ij')
+    height_map = 12 * np.sin(x / 7.0) * np.cos(z / 9.0)
+    vertices = generate_vertices(WIDTH, HEIGHT, height_map)
+    indices = generate_indices(WIDTH, HEIGHT)
+    normals = calc_normals(vertices, indices)
+
+    core.pass_block.update(dict(view=lookat((0, 70, 80), (0, 0, 0), (0, 1, 0)),
+                                projection=perspective(45, 1, 1, 500)))
+    model = identity()
+
+    baked_shader = core.Shader(os.path.join(ROOT, 'glsl', 'texture_terrain.vert'), NORMAL_FRAGMENT)
+    baked = core.Mesh(baked_shader, attributes=dict(position=vertices, normal=normals,
+                                                    tex_coord=generate_texcoords(WIDTH, HEIGHT)), index=indices)
+
+    displaced_shader = core.Shader(os.path.join(ROOT, DISPLACED_VERTEX_SHADER), NORMAL_FRAGMENT)
+    grid = lambda array: array.reshape(HEIGHT, WIDTH, -1)
+    heights = HeightTexture(grid(vertices)[..., 1], grid(normals))
+    displaced = Textured(DisplacedGrid(displaced_shader, heights, patch_size=16, origin=vertices[0, [0, 2]]),
+                         height_map=heights)
+
+    expected, image = render(baked, model=model), render(displaced, model=model)
+    assert (expected[..., 3] > 0).mean() > 0.25, 'the terrain should fill the view'
+    differs = np.abs(expected.astype(int) - image).max(axis=-1) > 1
+    assert differs.mean() < 1e-3, '%d pixels differ' % differs.sum()
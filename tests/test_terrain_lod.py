@@ -0,0 +1,176 @@
+""" Quadtree level of detail selection of terrain_lod, no GPU needed """
+import math
+import numpy as np
+import pytest
+
+from terrain_lod import TerrainQuadTree, lod_scale, tile_indices, tile_ring, tile_attribute, upsample
+
+
+def hills(rows, cols, seed=0):
+    """ smooth heights with some noise, indexed [z, x] """
+    z, x = np.meshgrid(np.arange(rows), np.arange(cols), indexing='ij')
+    noise = np.random.default_rng(seed).normal(0, 0.5, (rows, cols))
+    return (20 * np.sin(x / 17.0) * np.cos(z / 23.0) + noise).astype(np.float32)
+
+
+def perspective(fovy, aspect, near, far):
+    """ OpenGL perspective projection, as transform.perspective """
+    scale = 1 / math.tan(math.radians(fovy) / 2)
+    return np.array([[scale / aspect, 0, 0, 0],
+                     [0, scale, 0, 0],
+                     [0, 0, (far + near) / (near - far), 2 * far * near / (near - far)],
+                     [0, 0, -1, 0]], np.float32)
+
+
+def coverage(tree, nodes):
+    """ number of selected nodes covering each quad of the grid """
+    counts = np.zeros((tree.rows - 1, tree.cols - 1), int)
+    for level, i, j in nodes:
+        block = tree.tile_size * 2**level
+        counts[i * block:(i + 1) * block, j * block:(j + 1) * block] += 1
+    return counts
+
+
+@pytest.mark.parametrize('shape', [(129, 129), (97, 161), (513, 513)])
+@pytest.mark.parametrize('eye', [(0, 30, 0), (60, 5, 40), (-400, 200, 900)])
+def test_select_covers_the_grid_once(shape, eye):
+    tree = TerrainQuadTree(hills(*shape), tile_size=16, origin=(-shape[1] / 2, -shape[0] / 2))
+    scale, _ = lod_scale(perspective(45, 16 / 9, 0.1, 1000), 720)
+    nodes = tree.select(eye, scale, pixel_error=2.0)
+    assert len(set(nodes)) == len(nodes)
+    assert (coverage(tree, nodes) == 1).all()
+    assert all(tree.contains(*node) for node in nodes)
+
+
+def test_select_skips_culled_nodes():
+    tree = TerrainQuadTree(hills(129, 129), tile_size=16)
+    scale, _ = lod_scale(perspective(45, 1, 0.1, 1000), 600)
+    left = lambda bmin, bmax: bmin[:, 0] < 64      # keep the nodes starting left of x = 64
+    nodes = tree.select((32, 20, 32), scale, cull=left)
+    counts = coverage(tree, nodes)
+    assert (counts[:, :64] == 1).all() and (counts[:, 64:] == 0).all()
+
+
+def test_error_decreases_with_distance():
+    tree = TerrainQuadTree(hills(257, 257), tile_size=16)
+    scale, _ = lod_scale(perspective(45, 1, 0.1, 5000), 720)
+    distances = [10, 50, 100, 200, 400, 800, 1600, 10000]
+    selections = [tree.select((128, 40, 128 + d), scale, pixel_error=2.0) for d in distances]
+
+    # farther eyes never need more tiles, nor a finer level anywhere on the map
+    counts = [len(nodes) for nodes in selections]
+    assert counts == sorted(counts, reverse=True)
+    levels = [np.zeros((256, 256), int) for _ in selections]
+    for grid, nodes in zip(levels, selections):
+        for level, i, j in nodes:
+            block = 16 * 2**level
+            grid[i * block:(i + 1) * block, j * block:(j + 1) * block] = level
+    for near, far in zip(levels, levels[1:]):
+        assert (far >= near).all()
+    assert selections[-1] == [(tree.levels, 0, 0)]   # the root alone, far enough
+    assert selections[0] != selections[-1]
+
+
+def test_stricter_pixel_error_refines_more():
+    tree = TerrainQuadTree(hills(257, 257), tile_size=16)
+    scale, _ = lod_scale(perspective(45, 1, 0.1, 5000), 720)
+    counts = [len(tree.select((0, 80, 300), scale, pixel_error=error)) for error in (8, 4, 2, 1, 0.5)]
+    assert counts == sorted(counts)
+
+
+def test_orthographic_selection_ignores_the_eye():
+    tree = TerrainQuadTree(hills(129, 129), tile_size=16)
+    nodes = [tree.select(eye, 0.5, pixel_error=2.0, perspective=False) for eye in ((0, 0, 0), (1e4, 50, -1e4))]
+    assert nodes[0] == nodes[1]
+    assert (coverage(tree, nodes[0]) == 1).all()
+
+
+def test_node_error_bounds_children_and_flat_grid():
+    tree = TerrainQuadTree(hills(257, 257), tile_size=16)
+    for level in range(1, tree.levels + 1):
+        children = tree.error[level - 1]
+        for di in (0, 1):
+            for dj in (0, 1):
+                assert (tree.error[level] >= children[di::2, dj::2]).all()
+    flat = TerrainQuadTree(np.full((65, 65), 3.0, np.float32), tile_size=16)
+    assert all((error == 0).all() for error in flat.error)
+    assert flat.skirt_depth == 1.0
+
+
+def test_bounds_contain_the_tile_samples():
+    heights = hills(97, 161)
+    tree = TerrainQuadTree(heights, tile_size=16, origin=(-80.0, -48.0))
+    for level in range(tree.levels + 1):
+        i, j = np.nonzero(tree.contains(level, *np.indices(tree.error[level].shape)))
+        bmin, bmax = tree.bounds(level, i, j)
+        for k in range(i.size):
+            rows, cols = tree.tile_samples(level, i[k], j[k])
+            y = heights[rows][:, cols]
+            assert bmin[k, 1] <= y.min() - tree.skirt_depth + 1e-4 and y.max() <= bmax[k, 1] + 1e-4
+            assert bmin[k, 0] == -80 + cols[0] and bmax[k, 0] == -80 + cols[-1]
+            assert bmin[k, 2] == -48 + rows[0] and bmax[k, 2] == -48 + rows[-1]
+
+
+def test_upsample_keeps_samples_and_is_linear():
+    coarse = np.arange(25, dtype=np.float32).reshape(5, 5) ** 1.5
+    fine = upsample(coarse, 4)
+    assert fine.shape == (17, 17)
+    np.testing.assert_allclose(fine[::4, ::4], coarse, rtol=1e-6)
+    np.testing.assert_allclose(fine[0, 2], (coarse[0, 0] + coarse[0, 1]) / 2, rtol=1e-6)
+
+
+@pytest.mark.parametrize('tile_size', [4, 16, 32])
+def test_tile_indices_grid_and_skirts(tile_size):
+    width = tile_size + 1
+    ring = tile_ring(tile_size)
+    assert ring.size == 4 * tile_size and np.unique(ring).size == ring.size
+    border = np.zeros((width, width), bool)
+    border[[0, -1], :] = border[:, [0, -1]] = True
+    assert set(ring) == set(np.flatnonzero(border))
+
+    indices = tile_indices(tile_size)
+    assert indices.dtype == np.uint16
+    assert indices.size == 6 * tile_size**2 + 6 * ring.size
+    assert indices.max() == width * width + ring.size - 1
+    assert (tile_indices(tile_size, skirt=False) == indices[:6 * tile_size**2]).all()
+
+    # flat tile at y = 0, skirt vertices hanging below the border
+    z, x = np.meshgrid(np.arange(width), np.arange(width), indexing='ij')
+    grid = np.stack((x, np.zeros_like(x), z), axis=-1).astype(np.float32)
+    positions = tile_attribute(grid, np.arange(width), np.arange(width), tile_size)
+    assert (positions[width * width:] == grid.reshape(-1, 3)[ring]).all()
+    positions[width * width:, 1] -= 1.0
+
+    triangles = positions[indices.reshape(-1, 3).astype(int)]
+    normals = np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+    top, skirts = normals[:2 * tile_size**2], normals[2 * tile_size**2:]
+    assert (top[:, 1] > 0).all()                    # grid faces up, like generate_indices
+    outward = triangles[2 * tile_size**2:].mean(axis=1) - (tile_size / 2, 0, tile_size / 2)
+    assert (np.abs(skirts[:, 1]) < 1e-6).all()      # skirts are vertical
+    assert ((skirts * outward).sum(axis=1) > 0).all()   # and face outward
+
+
+def test_tile_attribute_samples_every_stride():
+    grid = np.arange(33 * 33 * 2, dtype=np.float32).reshape(33, 33, 2)
+    tree = TerrainQuadTree(np.zeros((33, 33), np.float32), tile_size=8)
+    rows, cols = tree.tile_samples(1, 0, 1)
+    assert (rows == np.arange(0, 17, 2)).all() and (cols == np.arange(16, 33, 2)).all()
+    attribute = tile_attribute(grid, rows, cols, 8)
+    assert attribute.shape == (81 + 32, 2)
+    assert (attribute[:81].reshape(9, 9, 2) == grid[0:17:2, 16:33:2]).all()
+
+
+def test_lod_scale():
+    projection = perspective(60, 16 / 9, 0.1, 1000)
+    scale, is_perspective = lod_scale(projection, 720)
+    assert is_perspective
+    # a 1 unit tall segment d units in front of the camera spans scale / d pixels
+    for distance in (1, 10, 250):
+        top, bottom = projection @ (0, 1, -distance, 1), projection @ (0, 0, -distance, 1)
+        pixels = (top[1] / top[3] - bottom[1] / bottom[3]) * 720 / 2
+        assert pixels == pytest.approx(scale / distance, rel=1e-5)
+
+    ortho = np.diag((1 / 100, 1 / 50, -1 / 500, 1)).astype(np.float32)
+    scale, is_perspective = lod_scale(ortho, 600)
+    assert not is_perspective
+    assert scale == pytest.approx(600 / 100)        # pixels per world unit, 100 units tall view
@@ -0,0 +1,166 @@
+""" Tiled heightmap conversion and tile streaming of terrain_stream, no GPU needed """
+import numpy as np
+import pytest
+from PIL import Image
+
+from terrain_stream import convert_heightmap, TiledHeightField, TileStreamer
+
+ROWS, COLS, TILE = 27, 33, 4       # rows do not end on a tile border
+
+
+def heightmap(path, rows=ROWS, cols=COLS, bits=8, seed=0):
+    """ random smooth-ish grayscale image file, and its pixels indexed [z, x] """
+    z, x = np.meshgrid(np.arange(rows), np.arange(cols), indexing='ij')
+    values = np.sin(x / 5.0) * np.cos(z / 7.0) + np.random.default_rng(seed).normal(0, 0.2, (rows, cols))
+    top = 255 if bits == 8 else 65535
+    pixels = np.round((values - values.min()) / np.ptp(values) * top).astype(np.uint8 if bits == 8 else np.uint16)
+    Image.fromarray(pixels).save(path)
+    return pixels
+
+
+def tile_grid(field, attribute, i, j):
+    """ [z, x] grid of an attribute of tile (i, j), and the map rows and
+        columns of its vertices, clipped to the map """
+    array = field.tile_arrays(i, j)[attribute]
+    grid = array.reshape(field.tile_size + 1, field.tile_size + 1, -1)
+    rows, cols = i * field.tile_size + np.arange(field.tile_size + 1), j * field.tile_size + np.arange(field.tile_size + 1)
+    inside = (rows < field.rows)[:, None] & (cols < field.cols)
+    return grid, rows, cols, inside
+
+
+@pytest.mark.parametrize('bits', [8, 16])
+def test_converted_heights_read_back(tmp_path, bits):
+    pixels = heightmap(tmp_path / 'map.png', bits=bits)
+    convert_heightmap(str(tmp_path / 'map.png'), str(tmp_path / 'tiles'), tile_size=TILE, min_height=-10, max_height=30)
+    field = TiledHeightField(str(tmp_path / 'tiles'))
+    assert (field.rows, field.cols, field.tile_size) == (ROWS, COLS, TILE)
+    assert field.shape == (-(-(ROWS - 1) // TILE), (COLS - 1) // TILE)
+    expected = pixels * (40 / (255 if bits == 8 else 65535)) - 10
+    for i in range(field.shape[0]):
+        for j in range(field.shape[1]):
+            positions, rows, cols, inside = tile_grid(field, 'position', i, j)
+            source = expected[rows.clip(0, ROWS - 1)][:, cols.clip(0, COLS - 1)]
+            np.testing.assert_allclose(positions[..., 1][inside], source[inside], rtol=1e-5, atol=1e-4)
+            np.testing.assert_allclose(positions[0, 0, [0, 2]], (field.origin[0] + cols[0], field.origin[1] + rows[0]))
+
+
+def test_seam_normals_match_the_single_mesh(tmp_path):
+    heightmap(tmp_path / 'map.png')
+    tiled = convert_heightmap(str(tmp_path / 'map.png'), str(tmp_path / 'tiles'), tile_size=TILE)
+    whole = convert_heightmap(str(tmp_path / 'map.png'), str(tmp_path / 'whole'), tile_size=64)
+    assert whole.shape == (1, 1)
+    single = whole.tile_arrays(0, 0)['normal'].reshape(65, 65, 3)[:ROWS, :COLS]
+
+    shared = {}     # map vertex -> normals of the tiles holding it
+    for i in range(tiled.shape[0]):
+        for j in range(tiled.shape[1]):
+            normals, rows, cols, inside = tile_grid(tiled, 'normal', i, j)
+            for r, c in zip(*np.nonzero(inside)):
+                shared.setdefault((rows[r], cols[c]), []).append(normals[r, c])
+    seams = [key for key, normals in shared.items() if len(normals) > 1]
+    assert len(seams) > 100
+    for (row, col), normals in shared.items():
+        for normal in normals:      # both sides of a seam, and the single mesh
+            np.testing.assert_allclose(normal, single[row, col], atol=1e-6)
+
+
+class Camera:
+    """ fake camera moving along the x axis, in the middle of a row of tiles """
+    def __init__(self, field):
+        self.field = field
+        self.move(0)
+
+    def move(self, column):
+        """ at the center of tile (3, column) """
+        size = self.field.tile_size * self.field.spacing
+        self.position = np.array((self.field.origin[0] + (column + 0.5) * size, 0.0,
+                                  self.field.origin[1] + 3.5 * size))
+        return self.position
+
+
+@pytest.fixture
+def field(tmp_path):
+    heightmap(tmp_path / 'map.png', rows=33, cols=33)
+    return convert_heightmap(str(tmp_path / 'map.png'), str(tmp_path / 'tiles'), tile_size=TILE)
+
+
+@pytest.fixture
+def streamer(field):
+    streamer = TileStreamer(field, radius=TILE, max_resident=12)
+    yield streamer
+    streamer.stop()
+
+
+def test_streamer_keeps_the_resident_set_bounded(field, streamer):
+    camera, resident, evicted = Camera(field), {}, []
+    for column in range(field.shape[1]):
+        streamer.update(camera.move(column))
+        assert streamer.wait_idle(10)
+        for event, key, arrays in streamer.poll():
+            if event == 'load':
+                assert key not in resident and len(arrays['position']) == (TILE + 1) ** 2
+                resident[key] = arrays
+            else:
+                assert arrays is None
+                del resident[key]
+                evicted.append(key)
+            assert len(resident) <= streamer.max_resident
+        wanted = field.tiles_around(camera.position, streamer.radius)
+        assert set(wanted) <= set(resident) and set(resident) == set(streamer.resident)
+
+    # the tiles left behind go first, farthest column first, never a wanted tile
+    assert evicted and [j for _, j in evicted] == sorted(j for _, j in evicted)
+    assert all(j < field.shape[1] - 2 for _, j in evicted)
+
+
+def test_streamer_evicts_the_least_recently_wanted(field, streamer):
+    camera = Camera(field)
+    for column in (2, 3, 2):    # back and forth: column 4 tiles wanted once, before
+        streamer.update(camera.move(column))
+        assert streamer.wait_idle(10)
+        streamer.poll()
+    streamer.update(camera.move(0))     # needs 3 more tiles, the last ones wanted were those of column 4
+    assert streamer.wait_idle(10)
+    evicted = [key for event, key, _ in streamer.poll() if event == 'evict']
+    assert sorted(j for _, j in evicted) == [4, 4, 4]
+    assert len(streamer.resident) == streamer.max_resident
+
+
+def test_streaming_tiles_drop_evicted_meshes(field, streamer, monkeypatch):
+    terrain = pytest.importorskip('terrain')     # imports OpenGL, but draws nothing here
+    meshes = []
+
+    class Mesh:
+        """ tile mesh stand-in, without GL objects """
+        def __init__(self, shader, attributes, index, **uniforms):
+            meshes.append(self)
+    monkeypatch.setattr(terrain, 'Mesh', Mesh)
+
+    camera = Camera(field)
+    tiles = terrain.StreamingTiles(None, streamer, camera)
+    for column in range(field.shape[1]):
+        camera.move(column)
+        tiles.update()                  # sends the new position
+        assert streamer.wait_idle(10)
+        tiles.update()                  # then handles the loads and evictions
+        assert set(tiles.meshes) == set(streamer.resident)
+        assert len(tiles.meshes) <= streamer.max_resident
+    assert len(meshes) > streamer.max_resident     # tiles were evicted, their meshes dropped
+
+
+def test_streamed_terrain_needs_a_camera():
+    terrain = pytest.importorskip('terrain')
+    with pytest.raises(ValueError, match='camera'):
+        terrain.Terrain(None, (), (), None, None, None, None, 513, 513, None, None, stream=object())
+
+
+@pytest.mark.parametrize('call', [lambda t: t.getVertices(), lambda t: t.height_at(0, 0),
+                                  lambda t: t.sample_many(np.zeros((4, 2))), lambda t: t.deform(0, 0, np.ones((2, 2))),
+                                  lambda t: t.deform_around(0, 0, 5, 1)])
+def test_streamed_terrain_has_no_whole_grid(field, streamer, call):
+    terrain = pytest.importorskip('terrain')
+    streamed = terrain.Terrain.__new__(terrain.Terrain)     # the state __init__ leaves, without textures
+    streamed.vertices, streamed.height_field = None, None
+    streamed.drawable = terrain.StreamingTiles(None, streamer, Camera(field))
+    with pytest.raises(ValueError, match='streamed terrain'):
+        call(streamed)
@@ -0,0 +1,175 @@
+""" transform.py batched kernels against their one value versions, and
+    vectorized tangents against per triangle loops """
+import numpy as np
+import pytest
+
+pytest.importorskip('OpenGL.GL')    # transform star imports OpenGL
+
+from transform import (translate, scale, quaternion_matrix, quaternion_slerp, lookat,
+                       quaternion_from_axis_angle, calc_normals, calc_tangents, identity_many, translate_many, scale_many,
+                       quaternion_matrix_many, quaternion_slerp_many, trs_many, lookat_many)
+
+N = 50
+
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(12)
+
+
+def random_quaternions(rng, n=N):
+    """ non unit quaternions, slerp and matrices normalize them """
+    return rng.normal(size=(n, 4)).astype(np.float32) * rng.uniform(0.5, 2, (n, 1))
+
+
+def test_identity_many_rewrites_out():
+    out = np.full((3, 4, 4), 7, 'f')
+    assert identity_many(3, out) is out
+    assert (out == np.identity(4)).all()
+
+
+def test_translate_many(rng):
+    vectors = rng.uniform(-100, 100, (N, 3))
+    expected = np.array([translate(v) for v in vectors])
+    np.testing.assert_allclose(translate_many(vectors), expected, rtol=1e-6)
+
+
+def test_scale_many(rng):
+    factors = rng.uniform(0.1, 10, (N, 3))
+    np.testing.assert_allclose(scale_many(factors), np.array([scale(f) for f in factors]), rtol=1e-6)
+    uniform = factors[:, 0]
+    np.testing.assert_allclose(scale_many(uniform), np.array([scale(f) for f in uniform]), rtol=1e-6)
+
+
+def test_quaternion_matrix_many(rng):
+    q = random_quaternions(rng)
+    expected = np.array([quaternion_matrix(value) for value in q])
+    np.testing.assert_allclose(quaternion_matrix_many(q), expected, atol=1e-6)
+
+
+@pytest.mark.parametrize('fraction', [0.0, 0.3, 1.0])
+def test_quaternion_slerp_many(rng, fraction):
+    q0, q1 = random_quaternions(rng), random_quaternions(rng)
+    expected = np.array([quaternion_slerp(a, b, fraction) for a, b in zip(q0, q1)])
+    np.testing.assert_allclose(quaternion_slerp_many(q0, q1, fraction), expected, atol=1e-5)
+
+
+def test_quaternion_slerp_many_per_row_fractions(rng):
+    q0, q1 = random_quaternions(rng), random_quaternions(rng)
+    fractions = rng.uniform(0, 1, N)
+    expected = np.array([quaternion_slerp(a, b, f) for a, b, f in zip(q0, q1, fractions)])
+    out = np.empty((N, 4), 'f')
+    assert quaternion_slerp_many(q0, q1, fractions, out=out) is out
+    np.testing.assert_allclose(out, expected, atol=1e-5)
+
+
+def test_quaternion_slerp_many_takes_the_short_path():
+    # keyframes on both sides of a half turn, where the sign of q1 flips
+    q0 = np.array([quaternion_from_axis_angle((0, 1, 0), 170)] * 2)
+    q1 = np.array([quaternion_from_axis_angle((0, 1, 0), -170), -quaternion_from_axis_angle((0, 1, 0), -170)])
+    expected = np.array([quaternion_slerp(a, b, 0.5) for a, b in zip(q0, q1)])
+    np.testing.assert_allclose(quaternion_slerp_many(q0, q1, 0.5), expected, atol=1e-6)
+
+
+@pytest.mark.parametrize('uniform', [False, True])
+def test_trs_many(rng, uniform):
+    t, q = rng.uniform(-50, 50, (N, 3)), random_quaternions(rng)
+    s = rng.uniform(0.2, 5, N if uniform else (N, 3))
+    expected = np.array([translate(*t[k]) @ quaternion_matrix(q[k]) @ scale(s[k]) for k in range(N)])
+    out = np.empty((N, 4, 4), 'f')
+    assert trs_many(t, q, s, out=out) is out
+    np.testing.assert_allclose(out, expected, rtol=1e-5, atol=1e-4)
+
+
+def test_lookat_many(rng):
+    eyes, targets = rng.uniform(-100, 100, (N, 3)), rng.uniform(-100, 100, (N, 3))
+    ups = np.tile((0.0, 1.0, 0.0), (N, 1))
+    expected = np.array([lookat(e, t, u) for e, t, u in zip(eyes, targets, ups)])
+    np.testing.assert_allclose(lookat_many(eyes, targets, ups), expected, rtol=1e-4, atol=1e-3)
+
+
+# tangents ------------------------------------------------------------------
+def grid(width, height, heights):
+    """ positions, indices and texcoords laid out like terrain.py's grid """
+    z, x = np.meshgrid(np.arange(height), np.arange(width), indexing='ij')
+    vertices = np.stack((x - width / 2, heights, z - height / 2), axis=-1).reshape(-1, 3).astype('f')
+    pos = (np.arange(height - 1)[:, None] * width + np.arange(width - 1)).ravel()
+    indices = np.stack((pos, pos + width, pos + width + 1, pos + width + 1, pos + 1, pos), axis=1).ravel()
+    texcoords = np.stack((x, z), axis=-1).reshape(-1, 2).astype('f')
+    return vertices, indices, texcoords
+
+
+def baseline_tangents(vertices, indices, texcoords):
+    """ the per triangle loop terrain.generate_tangents used to run: every
+        vertex gets the tangent of the last triangle drawn with it """
+    tangents = np.zeros((len(vertices), 3))
+    tri_verts = vertices[indices].reshape(-1, 3, 3)
+    tri_uvs = texcoords[indices].reshape(-1, 3, 2)
+    edge_1, edge_2 = tri_verts[:, 1] - tri_verts[:, 0], tri_verts[:, 2] - tri_verts[:, 0]
+    delta_uv1, delta_uv2 = tri_uvs[:, 1] - tri_uvs[:, 0], tri_uvs[:, 2] - tri_uvs[:, 0]
+    f = 1.0 / (delta_uv1[:, 0] * delta_uv2[:, 1] - delta_uv2[:, 0] * delta_uv1[:, 1])
+    for j, i in enumerate(range(0, len(indices), 3)):
+        i1, i2, i3 = indices[i], indices[i+1], indices[i+2]
+        tangents[i1] = f[j] * (delta_uv2[j, 1] * edge_1[j] - delta_uv1[j, 1] * edge_2[j])
+        tangents[i2] = tangents[i1]
+        tangents[i3] = tangents[i1]
+    return tangents
+
+
+def loop_tangents(vertices, indices, texcoords, normals):
+    """ reference: face tangents and bitangents summed on their vertices one
+        triangle at a time, then Gram-Schmidt one vertex at a time """
+    tangents, bitangents = np.zeros((len(vertices), 3)), np.zeros((len(vertices), 3))
+    for triangle in np.asarray(indices).reshape(-1, 3):
+        (p0, p1, p2), (uv0, uv1, uv2) = vertices[triangle].astype(float), texcoords[triangle].astype(float)
+        edge_1, edge_2, duv1, duv2 = p1 - p0, p2 - p0, uv1 - uv0, uv2 - uv0
+        det = duv1[0] * duv2[1] - duv2[0] * duv1[1]
+        if det == 0:
+            continue
+        for vertex in triangle:
+            tangents[vertex] += (duv2[1] * edge_1 - duv1[1] * edge_2) / det
+            bitangents[vertex] += (duv1[0] * edge_2 - duv2[0] * edge_1) / det
+    for k, normal in enumerate(normals.astype(float)):
+        tangent = tangents[k] - normal * normal.dot(tangents[k])
+        norm = np.linalg.norm(tangent)
+        tangents[k] = tangent / norm if norm > 0 else 0
+        sign = -1.0 if np.cross(normal, tangents[k]).dot(bitangents[k]) < 0 else 1.0
+        bitangents[k] = np.cross(normal, tangents[k]) * sign
+    return tangents, bitangents
+
+
+def test_calc_tangents_matches_the_baseline_loop_on_a_flat_grid():
+    vertices, indices, texcoords = grid(9, 7, np.zeros((7, 9)))
+    normals = calc_normals(vertices, indices)
+    tangents, bitangents = calc_tangents(vertices, indices, texcoords, normals)
+    np.testing.assert_allclose(tangents, baseline_tangents(vertices, indices, texcoords), atol=1e-6)
+    np.testing.assert_allclose(tangents, np.tile((1, 0, 0), (len(vertices), 1)), atol=1e-6)  # along u = x
+    np.testing.assert_allclose(bitangents, np.tile((0, 0, 1), (len(vertices), 1)), atol=1e-6)  # along v = z
+
+
+def test_calc_tangents_matches_a_per_triangle_loop():
+    rng = np.random.default_rng(3)
+    vertices, indices, texcoords = grid(12, 10, rng.normal(0, 2, (10, 12)))
+    texcoords[rng.random(len(texcoords)) < 0.1] *= -1     # some mirrored uvs
+    normals = calc_normals(vertices, indices)
+    tangents, bitangents = calc_tangents(vertices, indices, texcoords, normals)
+    expected_tangents, expected_bitangents = loop_tangents(vertices, indices, texcoords, normals)
+    assert tangents.dtype == bitangents.dtype == np.float32
+    np.testing.assert_allclose(tangents, expected_tangents, atol=1e-5)
+    np.testing.assert_allclose(bitangents, expected_bitangents, atol=1e-5)
+
+    # unit, orthogonal to each other and to the normals
+    np.testing.assert_allclose(np.linalg.norm(tangents, axis=1), 1, atol=1e-5)
+    np.testing.assert_allclose(np.sum(tangents * normals, axis=1), 0, atol=1e-5)
+    np.testing.assert_allclose(np.sum(bitangents * tangents, axis=1), 0, atol=1e-5)
+
+
+def test_calc_tangents_ignores_degenerate_uvs():
+    vertices, indices, texcoords = grid(4, 4, np.zeros((4, 4)))
+    texcoords[:4] = 0       # the triangles along the first row have no uv area
+    normals = calc_normals(vertices, indices)
+    tangents, bitangents = calc_tangents(vertices, indices, texcoords, normals)
+    assert np.isfinite(tangents).all() and np.isfinite(bitangents).all()
+    expected_tangents, expected_bitangents = loop_tangents(vertices, indices, texcoords, normals)
+    np.testing.assert_allclose(tangents, expected_tangents, atol=1e-5)
+    np.testing.assert_allclose(bitangents, expected_bitangents, atol=1e-5)
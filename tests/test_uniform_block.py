@@ -0,0 +1,91 @@
+""" std140 packing of core.UniformBlock and its uploads, checked with a
+    counting GL stand-in: no GL context needed """
+import os
+import numpy as np
+import pytest
+
+GL = pytest.importorskip('OpenGL.GL')
+pytest.importorskip('glfw')
+pytest.importorskip('assimpcy')     # imported by core
+
+import core
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+UPLOAD_CALLS = ('glBindBuffer', 'glBufferData', 'glBindBufferBase', 'glBufferSubData')
+
+
+@pytest.fixture
+def blocks(monkeypatch):
+    """ blocks made by the tests don't replace the application ones """
+    monkeypatch.setattr(core.UniformBlock, 'blocks', {})
+
+
+def block_file(tmp_path, members):
+    path = tmp_path / 'block.glsl'
+    path.write_text('// test block\nlayout(std140, row_major) uniform TestBlock {\n%s\n};\n' % members)
+    return str(path)
+
+
+def offsets(block):
+    return {name: block.dtype.fields[name][1] for name in block.dtype.names}
+
+
+def test_pass_block_layout(blocks):
+    block = core.UniformBlock(os.path.join(ROOT, 'glsl', 'pass_block.glsl'))
+    assert block.name == 'PassBlock'
+    assert offsets(block) == dict(view=0, projection=64, light_space_matrix=128, clipping_plane=192,
+                                  w_camera_position=208, time_of_day=220, light_dir=224,
+                                  shadow_distance=236, fog_color=240)
+    assert block.size == 256 and block.dtype.itemsize == 256
+    assert core.UniformBlock.blocks == {'PassBlock': block}
+
+
+def test_std140_alignment_rules(blocks, tmp_path):
+    block = core.UniformBlock(block_file(tmp_path, '''
+        float a;    // comments are ignored
+        vec3 b;     // vec3 aligned like vec4
+        vec2 c;     // 8 byte aligned, not packed in the last 4 bytes of b
+        float d;    // fills the end of c's vec4
+        mat4 e;
+        int f;
+        uint g;
+        vec2 h;
+        vec4 i;
+        float j;'''))
+    assert offsets(block) == dict(a=0, b=16, c=32, d=40, e=48, f=112, g=116, h=120, i=128, j=144)
+    assert block.size == 160    # rounded up to a whole vec4
+
+
+def test_values_are_packed_in_place(blocks):
+    block = core.UniformBlock(os.path.join(ROOT, 'glsl', 'pass_block.glsl'))
+    view = np.arange(16, dtype=np.float64).reshape(4, 4)
+    block.values['view'] = view
+    block.values['light_dir'] = (1, 2, 3)
+    block.values['time_of_day'] = 0.5
+    data = block.values.tobytes()
+    assert len(data) == 256
+    np.testing.assert_array_equal(np.frombuffer(data[:64], '<f4').reshape(4, 4), view)  # row major
+    assert np.frombuffer(data[224:236], '<f4').tolist() == [1, 2, 3]
+    assert np.frombuffer(data[220:224], '<f4')[0] == 0.5
+
+
+def test_uploads_only_when_values_change(blocks, counting_gl):
+    counting_gl.patch(*UPLOAD_CALLS)
+    counting_gl.patch('glGenBuffers', result=5)
+    block = core.UniformBlock(os.path.join(ROOT, 'glsl', 'pass_block.glsl'), binding=2)
+    view = np.identity(4)
+    block.update(dict(view=view, light_dir=(0, 1, 0), model=np.zeros((4, 4))))   # model: not a member
+    assert counting_gl.count('glGenBuffers') == 1 and counting_gl.count('glBufferSubData') == 1
+    assert ('glBindBufferBase', (GL.GL_UNIFORM_BUFFER, 2, 5)) in counting_gl.calls
+    assert ('glBufferData', (GL.GL_UNIFORM_BUFFER, 256, None, GL.GL_DYNAMIC_DRAW)) in counting_gl.calls
+
+    block.update(dict(view=view.copy(), light_dir=(0, 1, 0)))    # equal values
+    block.update({})
+    assert counting_gl.count('glBufferSubData') == 1
+
+    block.update(dict(fog_color=(0.75, 0.4, 0.25)))             # others keep their values
+    assert counting_gl.count('glBufferSubData') == 2 and counting_gl.count('glGenBuffers') == 1
+    name, (_, offset, size, data) = counting_gl.calls[-1]
+    assert (name, offset, size) == ('glBufferSubData', 0, 256)
+    assert np.frombuffer(data[224:236], '<f4').tolist() == [0, 1, 0]
+    np.testing.assert_allclose(np.frombuffer(data[240:252], '<f4'), (0.75, 0.4, 0.25))
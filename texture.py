@@ -3,6 +3,7 @@ from PIL import Image               # load texture maps
 import os
 import core
 import numpy as np
+from assets import loader, ready
 from transform import calc_normals
 
 # -------------- OpenGL Texture Wrapper ---------------------------------------
@@ -13,36 +14,68 @@ class Texture:
                  tex_type=GL.GL_TEXTURE_2D, gamma_correction=True):
         self.glid = GL.glGenTextures(1)
         self.type = tex_type
-        try:
-            # imports image as a numpy array in exactly right format
-            if(isinstance(tex_file,Image.Image)):
-                tex = tex_file
-            elif (isinstance(tex_file, np.ndarray)):
-                tex = Image.fromarray(tex_file)
-            else :
-                tex = Image.open(tex_file).convert('RGBA')
-            GL.glBindTexture(tex_type, self.glid)
+
+        def upload(images):
+            width, height, pixels = images[0]
+            core.state.bind_texture(tex_type, self.glid)
             if(gamma_correction):
-                GL.glTexImage2D(tex_type, 0, GL.GL_SRGB_ALPHA, tex.width, tex.height,
-                            0, GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, tex.tobytes())
+                GL.glTexImage2D(tex_type, 0, GL.GL_SRGB_ALPHA, width, height,
+                            0, GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, pixels)
             else:
-                GL.glTexImage2D(tex_type, 0, GL.GL_RGBA, tex.width, tex.height,
-                            0, GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, tex.tobytes())
+                GL.glTexImage2D(tex_type, 0, GL.GL_RGBA, width, height,
+                            0, GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, pixels)
             GL.glTexParameteri(tex_type, GL.GL_TEXTURE_WRAP_S, wrap_mode)
             GL.glTexParameteri(tex_type, GL.GL_TEXTURE_WRAP_T, wrap_mode)
             GL.glTexParameteri(tex_type, GL.GL_TEXTURE_MIN_FILTER, min_filter)
             GL.glTexParameteri(tex_type, GL.GL_TEXTURE_MAG_FILTER, mag_filter)
             GL.glGenerateMipmap(tex_type)
             if (not isinstance(tex_file, np.ndarray)):
-                print(f'Loaded texture {tex_file} ({tex.width}x{tex.height}'
+                print(f'Loaded texture {tex_file} ({width}x{height}'
                   f' wrap={str(wrap_mode).split()[0]}'
                   f' min={str(min_filter).split()[0]}'
                   f' mag={str(mag_filter).split()[0]})')
-        except FileNotFoundError:
-            print("ERROR: unable to load texture file %s" % tex_file)
+
+        # images already in memory are uploaded at once, files once decoded
+        if(isinstance(tex_file,Image.Image)):
+            self.loaded = ready(upload([(tex_file.width, tex_file.height, tex_file.tobytes())]))
+        elif (isinstance(tex_file, np.ndarray)):
+            tex = Image.fromarray(tex_file)
+            self.loaded = ready(upload([(tex.width, tex.height, tex.tobytes())]))
+        else :
+            self.loaded = loader.load([tex_file], upload)
 
     def __del__(self):  # delete GL texture from GPU when object dies
         GL.glDeleteTextures(self.glid)
+        core.state.deleted('texture', self.glid)
+
+class HeightTexture:
+    """ Float texture of a terrain grid, one texel per vertex holding its
+        normal (rgb) and height (alpha), read with texelFetch in shaders """
+    def __init__(self, heights, normals):
+        self.glid = GL.glGenTextures(1)
+        self.type = GL.GL_TEXTURE_2D
+        self.shape = heights.shape  # grid rows (z) and columns (x)
+        core.state.bind_texture(self.type, self.glid)
+        GL.glTexImage2D(self.type, 0, GL.GL_RGBA32F, self.shape[1], self.shape[0],
+                        0, GL.GL_RGBA, GL.GL_FLOAT, self.texels(heights, normals))
+        GL.glTexParameteri(self.type, GL.GL_TEXTURE_WRAP_S, GL.GL_CLAMP_TO_EDGE)
+        GL.glTexParameteri(self.type, GL.GL_TEXTURE_WRAP_T, GL.GL_CLAMP_TO_EDGE)
+        GL.glTexParameteri(self.type, GL.GL_TEXTURE_MIN_FILTER, GL.GL_NEAREST)
+        GL.glTexParameteri(self.type, GL.GL_TEXTURE_MAG_FILTER, GL.GL_NEAREST)
+
+    @staticmethod
+    def texels(heights, normals):
+        return np.ascontiguousarray(np.concatenate((normals, heights[..., None]), axis=-1), np.float32)
+
+    def update(self, row, col, heights, normals):
+        """ overwrite the block of texels whose first one is grid vertex [row, col] """
+        core.state.bind_texture(self.type, self.glid)
+        GL.glTexSubImage2D(self.type, 0, col, row, heights.shape[1], heights.shape[0],
+                           GL.GL_RGBA, GL.GL_FLOAT, self.texels(heights, normals))
+
+    def __del__(self):
+        GL.glDeleteTextures(self.glid)
+        core.state.deleted('texture', self.glid)
 
 class TextureArray:
     """ Helper class to create and automatically destroy textures """
@@ -50,8 +83,9 @@ class TextureArray:
                  mag_filter=GL.GL_LINEAR, min_filter=GL.GL_LINEAR_MIPMAP_LINEAR, gamma_correction=True):
         self.type = GL.GL_TEXTURE_2D_ARRAY
         self.glid = GL.glGenTextures(1)
-        try:
-            GL.glBindTexture(GL.GL_TEXTURE_2D_ARRAY, self.glid)
+
+        def upload(images):
+            core.state.bind_texture(GL.GL_TEXTURE_2D_ARRAY, self.glid)
             if gamma_correction : 
                 color_coding1 = GL.GL_SRGB8_ALPHA8
                 color_coding2 = GL.GL_RGBA
@@ -59,9 +93,8 @@ class TextureArray:
                 color_coding1 = GL.GL_RGBA8
                 color_coding2 = GL.GL_RGBA
             GL.glTexStorage3D(GL.GL_TEXTURE_2D_ARRAY, 10, color_coding1, files_width, files_height, len(tex_files))
-            for i in range(len(tex_files)):
-                    tex = Image.open(tex_files[i]).convert('RGBA')
-                    GL.glTexSubImage3D(GL.GL_TEXTURE_2D_ARRAY, 0, 0, 0, i, files_width, files_height, 1, color_coding2, GL.GL_UNSIGNED_BYTE, tex.tobytes())
+            for i, (_, _, pixels) in enumerate(images):
+                    GL.glTexSubImage3D(GL.GL_TEXTURE_2D_ARRAY, 0, 0, 0, i, files_width, files_height, 1, color_coding2, GL.GL_UNSIGNED_BYTE, pixels)
             GL.glTexParameteri(GL.GL_TEXTURE_2D_ARRAY, GL.GL_TEXTURE_WRAP_S, wrap_mode)
             GL.glTexParameteri(GL.GL_TEXTURE_2D_ARRAY, GL.GL_TEXTURE_WRAP_T, wrap_mode)
             GL.glTexParameteri(GL.GL_TEXTURE_2D_ARRAY, GL.GL_TEXTURE_MIN_FILTER, min_filter)
@@ -71,11 +104,12 @@ class TextureArray:
                   f' wrap={str(wrap_mode).split()[0]}'
                   f' min={str(min_filter).split()[0]}'
                   f' mag={str(mag_filter).split()[0]})')
-        except FileNotFoundError:
-            print("ERROR: unable to load texture array containing file %s" % tex_files[0])
+
+        self.loaded = loader.load(tex_files, upload)
 
     def __del__(self):  # delete GL texture from GPU when object dies
         GL.glDeleteTextures(self.glid)
+        core.state.deleted('texture', self.glid)
 
 
 class CubeMapTex:
@@ -83,83 +117,75 @@ class CubeMapTex:
     def __init__(self, tex_path):
         self.glid = GL.glGenTextures(1)
         self.type = GL.GL_TEXTURE_CUBE_MAP
-        try:
-            i=0
-            for filename in sorted(os.listdir(tex_path)):
-                tex_file = os.path.join(tex_path, filename)
-                # checking if it is a file
-                if os.path.isfile(tex_file):
-                    # imports image as a numpy array in exactly right format
-                    tex = Image.open(tex_file).convert('RGBA')
-                    GL.glBindTexture(self.type, self.glid)
-                    GL.glTexImage2D(GL.GL_TEXTURE_CUBE_MAP_POSITIVE_X + i, 0, GL.GL_SRGB_ALPHA, tex.width, tex.height,
-                                    0, GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, tex.tobytes())
+        tex_files = [os.path.join(tex_path, filename) for filename in sorted(os.listdir(tex_path))]
+        tex_files = [tex_file for tex_file in tex_files if os.path.isfile(tex_file)]  # checking if it is a file
+
+        def upload(images):
+            for i, (tex_file, (width, height, pixels)) in enumerate(zip(tex_files, images)):
+                    core.state.bind_texture(self.type, self.glid)
+                    GL.glTexImage2D(GL.GL_TEXTURE_CUBE_MAP_POSITIVE_X + i, 0, GL.GL_SRGB_ALPHA, width, height,
+                                    0, GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, pixels)
                     GL.glTexParameteri(GL.GL_TEXTURE_CUBE_MAP, GL.GL_TEXTURE_MIN_FILTER, GL.GL_LINEAR)
                     GL.glTexParameteri(GL.GL_TEXTURE_CUBE_MAP, GL.GL_TEXTURE_MAG_FILTER, GL.GL_LINEAR)
                     GL.glTexParameteri(GL.GL_TEXTURE_CUBE_MAP, GL.GL_TEXTURE_WRAP_S, GL.GL_CLAMP_TO_EDGE)
                     GL.glTexParameteri(GL.GL_TEXTURE_CUBE_MAP, GL.GL_TEXTURE_WRAP_T, GL.GL_CLAMP_TO_EDGE)
                     GL.glTexParameteri(GL.GL_TEXTURE_CUBE_MAP, GL.GL_TEXTURE_WRAP_R, GL.GL_CLAMP_TO_EDGE)
-                    print(f'Loaded texture {tex_file} ({tex.width}x{tex.height}')
+                    print(f'Loaded texture {tex_file} ({width}x{height}')
 
-                    i+=1
-        except FileNotFoundError:
-            print("ERROR: unable to load texture file %s" % tex_file)
+        self.loaded = loader.load(tex_files, upload)
 
     def __del__(self):  # delete GL texture from GPU when object dies
         GL.glDeleteTextures(self.glid)
+        core.state.deleted('texture', self.glid)
 
 
 # -------------- Textured mesh decorator --------------------------------------
+def bind_textures(textures, uniforms):
+    """ bind textures to consecutive units, setting their sampler uniforms """
+    for index, (name, texture) in enumerate(textures.items()):
+        if isinstance(texture, np.uint32):  # for self generated texture from FBOS
+            core.state.bind_texture(GL.GL_TEXTURE_2D, texture, index)
+        else:
+            core.state.bind_texture(texture.type, texture.glid, index)
+        uniforms[name] = index
+
+
 class Textured:
     """ Drawable mesh decorator that activates and binds OpenGL textures """
+    render_state = dict(blend=True)     # core.RenderState.require arguments
+
     def __init__(self, drawable, **textures):
         self.drawable = drawable
         self.textures = textures
 
     def draw(self, primitives=GL.GL_TRIANGLES, **uniforms):
-        for index, (name, texture) in enumerate(self.textures.items()):
-            GL.glActiveTexture(GL.GL_TEXTURE0 + index)
-            if(isinstance(texture, np.uint32) ): #for self generated texture from FBOS
-                GL.glBindTexture(GL.GL_TEXTURE_2D, texture)
-            else:
-                GL.glBindTexture(texture.type, texture.glid)
-            uniforms[name] = index
-        GL.glEnable(GL.GL_BLEND)
-        GL.glBlendFunc(GL.GL_SRC_ALPHA, GL.GL_ONE_MINUS_SRC_ALPHA)
+        bind_textures(self.textures, uniforms)
+        core.state.require(**self.render_state)
         self.drawable.draw(primitives=primitives, **uniforms)
-        GL.glDisable(GL.GL_BLEND)
 
 class TexturedCube:
     """ Drawable mesh decorator that activates and binds OpenGL textures """
+    render_state = dict(depth_func=GL.GL_LEQUAL)   # so depth test passes when values are equal to depth buffer's content
+
     def __init__(self, drawable, **textures):
         self.drawable = drawable 
         self.textures = textures
 
     def draw(self, primitives=GL.GL_TRIANGLES, **uniforms):
-        GL.glDepthFunc(GL.GL_LEQUAL);  # change depth function so depth test passes when values are equal to depth buffer's content
-        for index, (name, texture) in enumerate(self.textures.items()):
-            GL.glActiveTexture(GL.GL_TEXTURE0 + index)
-            GL.glBindTexture(texture.type, texture.glid)
-            uniforms[name] = index
+        bind_textures(self.textures, uniforms)
+        core.state.require(**self.render_state)
         self.drawable.draw(primitives=primitives, **uniforms)
-        GL.glDepthFunc(GL.GL_LESS); # set depth function back to default
 
 class WaterTextured:
     """ Drawable mesh decorator that activates and binds OpenGL textures """
+    render_state = dict(blend=True)
+
     def __init__(self, drawable, **textures):
         self.drawable = drawable
         self.textures = textures
 
     def draw(self, primitives=GL.GL_TRIANGLES, **uniforms):
-        for index, (name, texture) in enumerate(self.textures.items()):
-            GL.glActiveTexture(GL.GL_TEXTURE0 + index)
-            if(isinstance(texture, np.uint32)): #for self generated texture from FBOS
-                GL.glBindTexture(GL.GL_TEXTURE_2D, texture)
-            else:
-                GL.glBindTexture(texture.type, texture.glid)
-            uniforms[name] = index
-        GL.glEnable(GL.GL_BLEND)
-        GL.glBlendFunc(GL.GL_SRC_ALPHA, GL.GL_ONE_MINUS_SRC_ALPHA)
+        bind_textures(self.textures, uniforms)
+        core.state.require(**self.render_state)
         self.drawable.draw(primitives=primitives, **uniforms)
-        GL.glDisable(GL.GL_BLEND)
         
@@ -30,19 +30,76 @@ def lerp(point_a, point_b, fraction):
     """ linear interpolation between two quantities with linear operators """
     return point_a + fraction * (point_b - point_a)
 
-def calc_normals(vertices, index):
-    normals = np.zeros(vertices.shape, dtype=vertices.dtype)
-    a = vertices[index[::3]]  # all 1st pts of triangles
-    b = vertices[index[1::3]] # all 2nd pts
-    c = vertices[index[2::3]]
-    ab = b - a
-    ac = c - a
-    normal = np.cross(ab, ac)
-    normal = np.apply_along_axis(normalized, axis=1, arr=normal)
-    np.add.at(normals, index[::3], normal)  # we add to normals elements from the index array the values of normal
-    np.add.at(normals, index[1::3], normal)
-    np.add.at(normals, index[2::3], normal)
-    return np.apply_along_axis(normalized, axis=1, arr=normals)
+def normalized_rows(vectors):
+    """ normalized version of every row of a (N,3) array, zero rows stay zero """
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+
+def calc_normals(vertices, index, weighting='uniform', subset=None):
+    """ per vertex normals, the sum of the normals of the faces around each
+        vertex: unit normals ('uniform'), or weighted by the face area
+        ('area') or by the face angle at the vertex ('angle'). Given a
+        subset of vertex indices, only the faces around them are used and
+        only their normals are returned (for incremental updates) """
+    vertices = np.asarray(vertices, np.float32)
+    index = np.asarray(index).reshape(-1, 3)
+    if subset is not None:
+        touched = np.zeros(len(vertices), bool)
+        touched[subset] = True
+        index = index[touched[index].any(axis=1)]
+    tri = vertices[index]
+    faces = np.cross(tri[:,1] - tri[:,0], tri[:,2] - tri[:,0])  # length: twice the face area
+    if weighting == 'area':
+        corners = np.repeat(faces, 3, axis=0)
+    elif weighting == 'uniform':
+        corners = np.repeat(normalized_rows(faces), 3, axis=0)
+    elif weighting == 'angle':
+        # angle at each corner from its two edges, |cross| is the same for all 3 corners
+        dots = np.stack([np.sum((tri[:,(k+1)%3] - tri[:,k]) * (tri[:,(k+2)%3] - tri[:,k]), axis=1)
+                         for k in range(3)], axis=1)
+        angles = np.arctan2(np.linalg.norm(faces, axis=1, keepdims=True), dots)
+        corners = (normalized_rows(faces)[:, None, :] * angles[..., None]).reshape(-1, 3)
+    else:
+        raise ValueError(f"unknown normal weighting {weighting!r}")
+
+    # sum the corner normals on their vertices, one bincount per coordinate
+    normals = np.stack([np.bincount(index.ravel(), corners[:, k], minlength=len(vertices))
+                        for k in range(3)], axis=1)
+    if subset is not None:
+        normals = normals[subset]
+    return normalized_rows(normals).astype(np.float32)
+
+
+def calc_tangents(vertices, index, texcoords, normals):
+    """ per vertex tangents and bitangents for normal mapping: face tangents
+        are summed on their vertices, then made orthonormal to the normals """
+    index = np.asarray(index).reshape(-1, 3)
+    tri_verts, tri_uvs = vertices[index], texcoords[index]
+    edge_1 = tri_verts[:,1] - tri_verts[:,0]
+    edge_2 = tri_verts[:,2] - tri_verts[:,0]
+    delta_uv1 = tri_uvs[:,1] - tri_uvs[:,0]
+    delta_uv2 = tri_uvs[:,2] - tri_uvs[:,0]
+    det = delta_uv1[:,0] * delta_uv2[:,1] - delta_uv2[:,0] * delta_uv1[:,1]
+    f = np.divide(1.0, det, out=np.zeros_like(det), where=det != 0)[:, None]  # degenerate uvs count for nothing
+    face_tangents = f * (delta_uv2[:,1:] * edge_1 - delta_uv1[:,1:] * edge_2)
+    face_bitangents = f * (delta_uv1[:,:1] * edge_2 - delta_uv2[:,:1] * edge_1)
+
+    # sum the face vectors on their 3 vertices, one bincount per coordinate
+    corners = index.ravel()
+    def accumulate(face_vectors):
+        per_corner = np.repeat(face_vectors, 3, axis=0)
+        return np.stack([np.bincount(corners, per_corner[:, k], minlength=len(vertices))
+                         for k in range(3)], axis=1)
+    tangents, bitangents = accumulate(face_tangents), accumulate(face_bitangents)
+
+    # Gram-Schmidt: remove the normal component, keep the uv handedness
+    tangents -= normals * np.sum(normals * tangents, axis=1, keepdims=True)
+    norms = np.linalg.norm(tangents, axis=1, keepdims=True)
+    tangents = np.divide(tangents, norms, out=np.zeros_like(tangents), where=norms > 0)
+    handedness = np.where(np.sum(np.cross(normals, tangents) * bitangents, axis=1) < 0, -1.0, 1.0)
+    bitangents = np.cross(normals, tangents) * handedness[:, None]
+    return tangents.astype(vertices.dtype), bitangents.astype(vertices.dtype)
 
 
 def catmull_rom_spline(p0, p1, p2, p3, t): # that is a test to make things smoother
@@ -137,6 +194,39 @@ def lookat(eye, target, up):
     return rotation @ translate(-eye)
 
 
+def frustum_planes(matrix):
+    """ 6 normalized (a,b,c,d) planes of the frustum of a view-projection
+        matrix, pointing inwards: a point p is inside if a*x+b*y+c*z+d >= 0 """
+    matrix = np.asarray(matrix, np.float64)
+    planes = np.array([matrix[3] + matrix[0], matrix[3] - matrix[0],   # left, right
+                       matrix[3] + matrix[1], matrix[3] - matrix[1],   # bottom, top
+                       matrix[3] + matrix[2], matrix[3] - matrix[2]])  # near, far
+    return planes / np.linalg.norm(planes[:, :3], axis=1)[:, None]
+
+
+def aabb_in_frustum(planes, bmin, bmax):
+    """ False for boxes fully outside one of the frustum planes, works on
+        a single box or on (N,3) arrays of min and max corners """
+    bmin, bmax = np.asarray(bmin)[..., None, :], np.asarray(bmax)[..., None, :]
+    corner = np.where(planes[:, :3] > 0, bmax, bmin)  # most inside corner per plane
+    return ((corner * planes[:, :3]).sum(axis=-1) + planes[:, 3] >= 0).all(axis=-1)
+
+
+def transform_aabb(matrix, bmin, bmax):
+    """ axis aligned boxes enclosing the boxes (bmin, bmax) transformed by
+        matrix, works on a single box or on (N,3) arrays of corners, with
+        one matrix or a (N,4,4) stack of matrices, one per box """
+    center, extent = (np.asarray(bmax) + bmin) / 2, (np.asarray(bmax) - bmin) / 2
+    matrix = np.asarray(matrix)
+    if matrix.ndim == 2:
+        center = center @ matrix[:3, :3].T + matrix[:3, 3]
+        extent = extent @ np.abs(matrix[:3, :3]).T
+    else:
+        center = np.einsum('nij,nj->ni', matrix[:, :3, :3], center) + matrix[:, :3, 3]
+        extent = np.einsum('nij,nj->ni', np.abs(matrix[:, :3, :3]), extent)
+    return center - extent, center + extent
+
+
 # quaternion functions -------------------------------------------------------
 def quaternion(x=vec(0., 0., 0.), y=0.0, z=0.0, w=1.0):
     """ Init quaternion, w=real and, x,y,z or vector x imaginary components """
@@ -195,6 +285,81 @@ def quaternion_slerp(q0, q1, fraction):
 
     return q0*math.cos(theta) + q2*math.sin(theta)
 
+
+# batched transforms, N values per call -------------------------------------
+# Array versions of the functions above for many objects at once: (N,3)
+# vectors and (N,4) quaternions in, (N,4,4) float32 matrix stacks out. All
+# take an optional preallocated 'out' stack, reused from frame to frame.
+def identity_many(n, out=None):
+    """ stack of n identity matrices, written to 'out' if given """
+    out = np.empty((n, 4, 4), 'f') if out is None else out
+    out[...] = 0
+    out[:, [0, 1, 2, 3], [0, 1, 2, 3]] = 1
+    return out
+
+
+def translate_many(translations, out=None):
+    """ (N,4,4) translation matrices from (N,3) vectors """
+    translations = np.asarray(translations, 'f')
+    out = identity_many(len(translations), out)
+    out[:, :3, 3] = translations[:, :3]
+    return out
+
+
+def scale_many(factors, out=None):
+    """ (N,4,4) scale matrices from (N,) uniform or (N,3) per axis factors """
+    factors = np.asarray(factors, 'f')
+    factors = np.repeat(factors[:, None], 3, axis=1) if factors.ndim == 1 else factors
+    out = identity_many(len(factors), out)
+    out[:, [0, 1, 2], [0, 1, 2]] = factors[:, :3]
+    return out
+
+
+def quaternion_matrix_many(q, out=None):
+    """ (N,4,4) rotation matrices from (N,4) quaternions (w first) """
+    q = normalized_rows(np.asarray(q, 'f'))
+    w, x, y, z = q.T
+    out = identity_many(len(q), out)
+    out[:, 0, 0], out[:, 0, 1], out[:, 0, 2] = 1 - 2*(y*y + z*z), 2*(x*y - w*z), 2*(x*z + w*y)
+    out[:, 1, 0], out[:, 1, 1], out[:, 1, 2] = 2*(x*y + w*z), 1 - 2*(x*x + z*z), 2*(y*z - w*x)
+    out[:, 2, 0], out[:, 2, 1], out[:, 2, 2] = 2*(x*z - w*y), 2*(y*z + w*x), 1 - 2*(x*x + y*y)
+    return out
+
+
+def quaternion_slerp_many(q0, q1, fraction, out=None):
+    """ (N,4) spherical interpolations of (N,4) quaternions by (N,) or scalar fractions """
+    q0, q1 = normalized_rows(np.asarray(q0, 'f')), normalized_rows(np.asarray(q1, 'f'))
+    dot = np.sum(q0 * q1, axis=1, keepdims=True)
+    flip = dot <= 0  # take the shorter path, as in quaternion_slerp
+    q1, dot = np.where(flip, -q1, q1), np.where(flip, -dot, dot)
+    theta = np.arccos(np.clip(dot, -1, 1)) * np.reshape(fraction, (-1, 1))
+    q2 = normalized_rows(q1 - q0*dot)
+    out = np.empty_like(q0) if out is None else out
+    np.add(q0*np.cos(theta), q2*np.sin(theta), out=out)
+    return out
+
+
+def trs_many(translations, quaternions, scales, out=None):
+    """ (N,4,4) stacks of translate @ quaternion_matrix @ scale, in one go """
+    out = quaternion_matrix_many(quaternions, out)
+    scales = np.asarray(scales, 'f')
+    out[:, :3, :3] *= (scales[:, None, None] if scales.ndim == 1 else scales[:, None, :3])
+    out[:, :3, 3] = np.asarray(translations, 'f')[:, :3]
+    return out
+
+
+def lookat_many(eyes, targets, ups, out=None):
+    """ (N,4,4) view matrices from (N,3) eyes, targets and up vectors """
+    eyes = np.asarray(eyes, 'f')[:, :3]
+    view = normalized_rows(np.asarray(targets, 'f')[:, :3] - eyes)
+    up = normalized_rows(np.asarray(ups, 'f')[:, :3])
+    right = np.cross(view, up)
+    up = np.cross(right, view)
+    out = identity_many(len(eyes), out)
+    out[:, 0, :3], out[:, 1, :3], out[:, 2, :3] = right, up, -view
+    out[:, :3, 3] = -np.einsum('nij,nj->ni', out[:, :3, :3], eyes)
+    return out
+
     
 class FlyoutCamera:
     def __init__(self, position=vec(0,0,0), up=vec(0,1,0), pitch=0.0, yaw=math.radians(-90.0), fov=70.0, near_clip=0.1, far_clip=512, sensitivity=0.2, max_speed=90.0, interp_time=0.0):
@@ -212,13 +377,60 @@ class FlyoutCamera:
         self.interpolation_time = interp_time 
         self.target_yaw = math.radians(-90.0)
         self.target_pitch = 0.0
+        self._cache = {}
         self._update()
 
+    # matrices are cached (read only) until the state they depend on changes
+    def _cached(self, name, key, compute):
+        entry = self._cache.get(name)
+        if entry is None or entry[0] != key:
+            value = compute()
+            value.flags.writeable = False
+            entry = self._cache[name] = (key, value)
+        return entry[1]
+
+    def _view_key(self):
+        return (*np.asarray(self.position, float)[:3].tolist(), self.yaw, self.pitch)
+
+    def _projection_key(self, winsize):
+        return (self.fov, winsize[0] / winsize[1], self.near_clip, self.far_clip)
+
     def view_matrix(self):
-        return lookat(self.position, self.position + self.front, self.up) 
+        return self._cached('view', self._view_key(),
+                            lambda: lookat(self.position, self.position + self.front, self.up))
 
     def projection_matrix(self, winsize):
-        return perspective(self.fov, winsize[0] / winsize[1], self.near_clip, self.far_clip)
+        return self._cached('projection', self._projection_key(winsize),
+                            lambda: perspective(self.fov, winsize[0] / winsize[1], self.near_clip, self.far_clip))
+
+    def view_projection_matrix(self, winsize):
+        return self._cached('view_projection', self._view_key() + self._projection_key(winsize),
+                            lambda: self.projection_matrix(winsize) @ self.view_matrix())
+
+    def inverse_view_matrix(self):
+        """ camera to world matrix, its last column is the camera position """
+        return self._cached('inverse_view', self._view_key(), lambda: np.linalg.inv(self.view_matrix()))
+
+    def frustum(self, winsize):
+        """ inward frustum planes of the camera, see transform.frustum_planes """
+        return self._cached('frustum', self._view_key() + self._projection_key(winsize),
+                            lambda: frustum_planes(self.view_projection_matrix(winsize)))
+
+    def reflected_position(self, water_height):
+        """ camera position mirrored below the water plane """
+        position = np.array(self.position, 'f')
+        position[1] = 2*water_height - position[1]
+        return position
+
+    def reflected_view_matrix(self, water_height):
+        """ view matrix of the camera mirrored below the water plane (same
+            as after underwater_cam), without touching the camera """
+        def compute():
+            front = normalized(self.get_look_direction() * (1, -1, 1))  # flipped pitch
+            up = normalized(np.cross(normalized(np.cross(front, self.w_up)), front))
+            position = self.reflected_position(water_height)
+            return lookat(position, position + front, up)
+        return self._cached('reflected_view', self._view_key() + (water_height,), compute)
 
     def rotate(self, old, new, delta) -> None:
         x_offset = self.sensitivity /15 * (new[0] - old[0])
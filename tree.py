@@ -4,11 +4,14 @@ from core import Node, Mesh
 from texture import Textured, Texture
 from transform import calc_normals       
 import random
+
+# forest meshes are big: unit normals and [0, 1] texture coordinates as 16 bit integers
+FOREST_LAYOUT = dict(normal='int16n', tex_coord='uint16n')
        
 class Treemapping(Node):
-    def __init__(self, shader, position, leavesTextures_path1, leavesTextures_path2, trunkTextures_path, nb_gen, shadow_map_tex):
+    def __init__(self, shader, position, leavesTextures_path1, leavesTextures_path2, trunkTextures_path, nb_gen, shadow_map_tex, seed=None):
         super().__init__()
-        random.seed()
+        random.seed(seed)
         self.WATER_LEVEL = -40
         leavesTextures1 = Texture(leavesTextures_path1, GL.GL_REPEAT, *(GL.GL_LINEAR, GL.GL_LINEAR_MIPMAP_LINEAR))
         leavesTextures2 = Texture(leavesTextures_path2, GL.GL_REPEAT, *(GL.GL_LINEAR, GL.GL_LINEAR_MIPMAP_LINEAR))
@@ -38,6 +41,9 @@ class Treemapping(Node):
             oak_trunks, oak_leaves = self.generate_oak_tree_forest(cpt-nb_pine, tree_positions[nb_pine:cpt], shader, trunkTextures, leavesTextures2, shadow_map_tex)
             self.add(oak_trunks)
             self.add(oak_leaves)
+            arrays = [forest.drawable.vertex_array for forest in (trunks, leaves, oak_trunks, oak_leaves)]
+            print(f'Forest vertex arrays: {sum(a.nbytes for a in arrays) / 2**20:.1f} MB'
+                  f' ({sum(a.float32_nbytes for a in arrays) / 2**20:.1f} MB as float32)')
         
 
     def generate_pine_tree_forest(self, nb_pine, tree_positions, shad, tex1, tex2, shadow_map_tex):
@@ -73,7 +79,7 @@ class GenerateTrunks(Textured):
             index.extend( (trunk_indices + i*len(tmp_vertices)).tolist())
         normals = calc_normals(np.array(vertices), index)
         mesh = Mesh(shader, attributes=dict(position=vertices, tex_coord=tex_coords, normal=normals),
-                    index=index, k_a=(0.4,0.4,0.4), k_d=(0.8,0.7,0.7), k_s=(1.0,0.85,0.85), s=8)
+                    index=index, layout=FOREST_LAYOUT, k_a=(0.4,0.4,0.4), k_d=(0.8,0.7,0.7), k_s=(1.0,0.85,0.85), s=8)
 
         # setup & upload texture to GPU, bind it to shader name 'diffuse_map'
         super().__init__(mesh, diffuse_map=texture, shadow_map=shadow_map_t)
@@ -164,7 +170,7 @@ class GeneratePineLeaves(Textured):
             forest_nb_layers += nb_layers
         normals = calc_normals(np.array(vertices), index)
         mesh = Mesh(shader, attributes=dict(position=vertices, tex_coord=tex_coords, normal=normals),
-                    index=index, k_a=(0.4,0.4,0.4), k_d=(0.8,0.7,0.7), k_s=(1.0,0.85,0.85), s=8)
+                    index=index, layout=FOREST_LAYOUT, k_a=(0.4,0.4,0.4), k_d=(0.8,0.7,0.7), k_s=(1.0,0.85,0.85), s=8)
 
         # setup & upload texture to GPU, bind it to shader name 'diffuse_map'
         super().__init__(mesh, diffuse_map=texture, shadow_map=shadow_map_t)
@@ -229,7 +235,7 @@ class GenerateLeaves(Textured):
             index.extend( (leaves_indices + i*len(tmp_vertices)).tolist())
         normals = calc_normals(np.array(vertices), index)
         mesh = Mesh(shader, attributes=dict(position=vertices, tex_coord=tex_coords, normal=normals),
-                    index=index, k_a=(0.4,0.4,0.4), k_d=(0.8,0.7,0.7), k_s=(1.0,0.85,0.85), s=8)
+                    index=index, layout=FOREST_LAYOUT, k_a=(0.4,0.4,0.4), k_d=(0.8,0.7,0.7), k_s=(1.0,0.85,0.85), s=8)
 
         # setup & upload texture to GPU, bind it to shader name 'diffuse_map'
         super().__init__(mesh, diffuse_map=texture, shadow_map=shadow_map_t)
@@ -4,9 +4,12 @@ from itertools import cycle
 import OpenGL.GL as GL              # standard Python OpenGL wrapper
 import glfw                         # lean window system wrapper for OpenGL
 import numpy as np                  # all matrix manipulations & OpenGL args
-from core import Shader, Viewer, Mesh, load, Node
+from core import shaders, Viewer, Mesh, load, Node
+from profiler import profiler
+from assets import loader
 from texture import Texture, Textured, CubeMapTex, TexturedCube
 from terrain import Terrain
+from terrain_cache import TerrainCache
 from transform import translate, vec, quaternion
 from animation import KeyFrameControlNode
 from water import Water
@@ -16,6 +19,7 @@ from animation_rocks import RockTime
 from cloud import Cloud
 from noise import Noise
 from particles import ParticlesEmitter
+from bench import Benchmark
 
 # -------------- Example textured plane class ---------------------------------
 class TexturedPlane(Textured):
@@ -62,6 +66,7 @@ class CubeMapTexture(TexturedCube):
         base_coords_face6 = ((-1, -1, -1), (-1, -1, 1), (1, -1, -1), (1, -1, -1), (-1, -1, 1), (1, -1, 1))
         base_coords = base_coords_face1 + base_coords_face2 + base_coords_face3 + base_coords_face4 + base_coords_face5 + base_coords_face6
         mesh = Mesh(shader, attributes=dict(position=base_coords))
+        mesh.bounds = None  # drawn around the camera whatever its position, never culled
 
         # setup & upload texture to GPU, bind it to shader name 'cube_map'
         texture = CubeMapTex(tex_path)
@@ -72,16 +77,28 @@ class CubeMapTexture(TexturedCube):
 # -------------- main program and scene setup --------------------------------
 def main():
     """ create a window, add scene objects, then run rendering loop """
-    viewer = Viewer()
-    shader = Shader("glsl/texture.vert", "glsl/texture.frag")
-    shaderTerrain = Shader("glsl/texture_terrain.vert", "glsl/texture_terrain.frag")
-    normalvizShader = Shader("glsl/normalviz.vert", "glsl/normalviz.frag", "glsl/normalviz.geom") 
-    lightCubeShader = Shader("glsl/lightcube.vert", "glsl/lightcube.frag")
-    skyboxShader = Shader("glsl/skybox.vert", "glsl/skybox.frag")
-    waterShader = Shader("glsl/water.vert", "glsl/water.frag")
-    reflectionShader = Shader("glsl/texture.vert", "glsl/texture_reflection.frag") # reflection par rapport a la skybox
-    cloudShader = Shader("glsl/cloud.vert", "glsl/cloud.frag")
-    particleShader = Shader("glsl/particle.vert", "glsl/particle.frag")
+    options = [arg.split('=')[0] for arg in sys.argv[1:] if arg.startswith('--')]
+    values = dict(arg[2:].split('=', 1) for arg in sys.argv[1:] if arg.startswith('--') and '=' in arg)
+    files = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    shaders.watch('--watch-shaders' in options)  # live reload of edited glsl files
+    profiler.enable('--profile' in options)     # frame timings, also toggled with F3
+    bench = None
+    if '--bench' in options:  # e.g. --bench=600 --baseline=bench_before.json --output=bench.json
+        bench = Benchmark(frames=int(values.get('bench') or 600), baseline=values.get('baseline'),
+                          output=values.get('output', 'bench.json'))
+    seed = None if bench is None else 0     # benchmarks: same trees, rocks and particles on every run
+    viewer = Viewer(visible=bench is None)
+    # texture files are decoded in the background while the scene is built
+    loader.start(progress=lambda done, total, files: print('[%d/%d]' % (done, total), end=' '))
+    shader = shaders.get("glsl/texture.vert", "glsl/texture.frag")
+    shaderTerrain = shaders.get("glsl/texture_terrain.vert", "glsl/texture_terrain.frag")
+    normalvizShader = shaders.get("glsl/normalviz.vert", "glsl/normalviz.frag", "glsl/normalviz.geom") 
+    lightCubeShader = shaders.get("glsl/lightcube.vert", "glsl/lightcube.frag")
+    skyboxShader = shaders.get("glsl/skybox.vert", "glsl/skybox.frag")
+    waterShader = shaders.get("glsl/water.vert", "glsl/water.frag")
+    reflectionShader = shaders.get("glsl/texture.vert", "glsl/texture_reflection.frag") # reflection par rapport a la skybox
+    cloudShader = shaders.get("glsl/cloud.vert", "glsl/cloud.frag")
+    particleShader = shaders.get("glsl/particle.vert", "glsl/particle.frag")
     noiseMap = Noise()
     
     
@@ -92,25 +109,28 @@ def main():
                        "texture/terrain_texture/rock_snow_normal.png" )
 
     
-    viewer.add(*[mesh for file in sys.argv[1:] for mesh in load(file, shader)])
+    viewer.add(*[mesh for file in files for mesh in load(file, shader)])
     terrain = Terrain(shaderTerrain, terrain_textures, terrain_normal_textures, "texture/terrain_texture/noise_map.png", "texture/terrain_texture/lava_map.png",
-                       "texture/water/dudv.png", "texture/water/waternormalmap.png", 513, 513, "texture/heightmapstests/Heightmap.png",  viewer.getShadowFrameBuffer())
+                       "texture/water/dudv.png", "texture/water/waternormalmap.png", 513, 513, "texture/heightmapstests/Heightmap.png",  viewer.getShadowFrameBuffer(),
+                       cache=TerrainCache(".cache/terrain"), compact=True)
 
     viewer.add(terrain)
     vertices = terrain.getVertices()    
     
-    viewer.add(Treemapping(shader, vertices , "texture/textures_wood/pineleaf2.png", "texture/textures_wood/leaves.png", "texture/textures_wood/bark.jpg", 500, viewer.getShadowFrameBuffer().getDepthTexture()))
-    viewer.add(RockTime(shader, reflectionShader))
+    viewer.add(Treemapping(shader, vertices , "texture/textures_wood/pineleaf2.png", "texture/textures_wood/leaves.png", "texture/textures_wood/bark.jpg", 500, viewer.getShadowFrameBuffer().getDepthTexture(), seed=seed))
+    viewer.add(RockTime(shader, reflectionShader, seed=seed))
     viewer.add(Water(waterShader, 513, 513, viewer.getWaterFrameBuffers(), "texture/water/dudv.png", "texture/water/waternormalmap.png"))
     viewer.add(CubeMapTexture(skyboxShader, "texture/skybox/skyboxday", "texture/skybox/skyboxnight/"))
     viewer.add(Cloud(cloudShader, 513,513,noiseMap.getNoiseMapTexture()))
 
     #Particles
-    emitter = ParticlesEmitter(particleShader)
+    emitter = ParticlesEmitter(particleShader, seed=seed)
     viewer.add(emitter)
     viewer.setParticlesEmitter(emitter)
     # start rendering loop
-    viewer.run()   
+    viewer.run(bench)
+    if bench is not None and bench.regressions:
+        sys.exit(1)
 
 
 if __name__ == '__main__':
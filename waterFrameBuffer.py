@@ -1,5 +1,6 @@
 import OpenGL.GL as GL              # standard Python OpenGL wrapper
 import glfw                         # lean window system wrapper for OpenGL
+import core
 
 # Class obtained from ThinMatrix tutorial, rewritten by us in Python
 
@@ -48,7 +49,7 @@ class WaterFrameBuffers:
 
     def createTextureAttachment(self,width,height):
         texture = GL.glGenTextures(1)
-        GL.glBindTexture(GL.GL_TEXTURE_2D, texture)
+        core.state.bind_texture(GL.GL_TEXTURE_2D, texture)
         GL.glTexImage2D(GL.GL_TEXTURE_2D, 0, GL.GL_RGB, width, height, 0, GL.GL_RGB, GL.GL_UNSIGNED_BYTE, None)
         GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER, GL.GL_NEAREST)
         GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, GL.GL_NEAREST)
@@ -57,7 +58,7 @@ class WaterFrameBuffers:
 
     def createDepthTextureAttachment(self, width,height):
         texture = GL.glGenTextures(1)
-        GL.glBindTexture(GL.GL_TEXTURE_2D, texture)
+        core.state.bind_texture(GL.GL_TEXTURE_2D, texture)
         GL.glTexImage2D(GL.GL_TEXTURE_2D, 0, GL.GL_DEPTH_COMPONENT32, width, height, 0, GL.GL_DEPTH_COMPONENT, GL.GL_FLOAT,  None)
         GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER, GL.GL_LINEAR)
         GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, GL.GL_LINEAR)
@@ -79,7 +80,7 @@ class WaterFrameBuffers:
     
     def unbindCurrentFrameBuffer(self): #call to switch to default frame buffer
         GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, 0)
-        GL.glViewport(0, 0, *glfw.get_framebuffer_size(self.win))
+        core.state.viewport(0, 0, *glfw.get_framebuffer_size(self.win))
 
     def getReflectionTexture(self): #get the resulting texture
         return self.reflectionTexture
@@ -91,10 +92,10 @@ class WaterFrameBuffers:
         return self.refractionDepthTexture
     
     def bindFrameBuffer(self,frameBuffer,width,height):
-        GL.glBindTexture(GL.GL_TEXTURE_2D, 0)#To make sure the texture isn't bound
+        core.state.bind_texture(GL.GL_TEXTURE_2D, 0)#To make sure the texture isn't bound
         GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, frameBuffer)
         GL.glClear(GL.GL_COLOR_BUFFER_BIT | GL.GL_DEPTH_BUFFER_BIT)
-        GL.glViewport(0, 0, width, height)
+        core.state.viewport(0, 0, width, height)
 
     def cleanUp(self):
         GL.glDeleteFramebuffers(self.reflectionFrameBuffer)